@@ -5,6 +5,8 @@
 # ----- 1.1 Python 标准库 -----
 import os
 import re
+import sys
+import asyncio
 import json
 import time
 import uuid
@@ -12,6 +14,13 @@ import hashlib
 import datetime
 import shutil
 import gzip
+import io
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+import pickle
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Optional, List, Dict, Tuple
 
 # ----- 1.2 第三方库（带依赖检查）-----
@@ -73,10 +82,1285 @@ DEFAULT_MIN_UNIQUE_SENDERS = 3            # 最少不同发送者数量
 DEFAULT_COOLDOWN_SECONDS = 3600           # 冷却时间（秒）
 DEFAULT_MIN_TEXT_LENGTH = 2               # 最小文本长度
 REMINDER_IMAGE_FILENAME = "1000101866.jpg" # 提醒图片文件名
+EMBEDDING_MATRIX_INITIAL_CAPACITY = 256   # Embedding矩阵初始行容量
+DEFAULT_ANN_NPROBE = 8                    # ANN索引每次查询探测的聚类数
+DEFAULT_ANN_MIN_SIZE = 10000              # 向量数达到此值才训练ANN索引（之前使用精确扫描）
+ANN_TRAIN_SAMPLE_SIZE = 16384             # k-means训练采样上限
+ANN_TRAIN_ITERATIONS = 10                 # k-means迭代次数
+IMAGE_HASH_WORDS = 4                      # 图片哈希打包为 4 个 uint64（256位）
+IMAGE_HASH_BLOCK_BITS = 16                # 多索引哈希的分块位数
+IMAGE_HASH_MAX_BLOCK_RADIUS = 2           # 单块枚举半径上限，超出时回退线性扫描
+WAL_COMPACT_THRESHOLD = 500               # 日志累计多少条后合并进当日快照
+DEFAULT_STORAGE_FORMAT = "json"           # 快照格式：json（单文件）/ npy（元数据 + 列式向量文件）
+DEFAULT_FLUSH_INTERVAL_SECONDS = 1.0      # 后台写盘任务的合并写入间隔（秒）
+DEFAULT_PRELOAD_WORKERS = 4               # 启动预热并行加载的群组数 / 单群并行解码的日文件数
+DAY_FILE_LOCK_STRIPES = 64               # 日文件读写锁的分段数（按 群目录+日期 散列，读盘与日志合并互斥）
+DEFAULT_EMBEDDING_CACHE_SIZE = 4096       # Embedding结果内存缓存条数（0表示禁用缓存）
+DEFAULT_EMBEDDING_CACHE_TTL = 86400       # Embedding结果缓存有效期（秒）
+EMBEDDING_CACHE_FILENAME = "embedding_cache.sqlite3"  # Embedding持久缓存文件名（位于数据目录）
+EMBEDDING_CACHE_PRUNE_INTERVAL = 1000     # 持久缓存每写入多少条清理一次过期项
+DEFAULT_EMBEDDING_BATCH_WINDOW_MS = 10    # Embedding请求合并窗口（毫秒，0表示不合并）
+DEFAULT_EMBEDDING_BATCH_MAX_SIZE = 32     # 单次批量Embedding请求的最大文本数
+DEFAULT_VISION_CACHE_SIZE = 2048          # 图片识别结果缓存条数（0表示禁用缓存）
+VISION_CACHE_HASH_THRESHOLD = 0.95        # 复用识别结果所需的图片哈希相似度（比匹配阈值更严格）
+DEFAULT_STICKER_BLOCKLIST_SIZE = 5000     # 表情包哈希黑名单容量（0表示禁用）
+STICKER_BLOCKLIST_FILENAME = "sticker_blocklist.json.gz"  # 表情包黑名单文件名（位于数据目录）
+STICKER_BLOCKLIST_SAVE_DELAY = 5.0        # 表情包黑名单变更后延迟写盘的秒数（合并多次变更）
+DEFAULT_HTTP_POOL_LIMIT = 32              # 图片下载连接池的总连接数上限
+DEFAULT_HTTP_PER_HOST_LIMIT = 8           # 图片下载对同一主机的并发连接上限
+DEFAULT_HTTP_TIMEOUT_SECONDS = 15.0       # 单次图片下载的总超时（秒）
+HTTP_CONNECT_TIMEOUT_SECONDS = 5.0        # 建立连接的超时（秒，不超过总超时）
+HTTP_DNS_CACHE_SECONDS = 300              # 连接器DNS缓存时间（秒）
+LATENCY_STATS_WINDOW = 256                # 耗时分位数统计的滑动窗口大小
+DEFAULT_MAX_IMAGE_SIZE_MB = 10.0          # 单张图片下载大小上限（MB），超出时中止下载
+IMAGE_DOWNLOAD_CHUNK_SIZE = 64 * 1024     # 流式下载的分块大小（字节）
+DHASH_DRAFT_SIZE = (17 * 8, 16 * 8)       # dHash 解码阶段快速缩小的目标尺寸（之后再精确缩放到17x16）
+DEFAULT_IMAGE_HASH_EXECUTOR = "thread"    # 图片哈希执行器：thread（线程池）/ process（进程池）
+DEFAULT_IMAGE_HASH_WORKERS = 2            # 进程池模式下的工作进程数
+DEFAULT_EMBEDDING_PRECISION = "float32"   # 内存中Embedding矩阵的精度：float32 / float16 / int8
+EMBEDDING_PRECISIONS = ("float32", "float16", "int8")
+EMBEDDING_SPILL_DIRNAME = "spill"         # 量化时全精度向量映射文件所在子目录（位于群组数据目录下，启动时清空）
+QUANTIZED_SCAN_CHUNK = 8192               # 量化矩阵分块计算相似度的行数（限制临时内存）
+FLOAT16_ERROR_BOUND = 2.0 ** -11          # float16 存储单位向量时余弦相似度的误差上界
+QUANTIZED_RERANK_EPS = 2e-4               # 误差上界之外的重排余量（覆盖 float32 累加误差）
+DEFAULT_CACHE_MAX_GROUPS = 0              # 内存中最多缓存的群组数（0表示不限制）
+DEFAULT_CACHE_MAX_MEMORY_MB = 0.0         # 群组缓存的内存预算（MB，0表示不限制）
+MESSAGE_RECORD_ESTIMATED_BYTES = 512      # 估算缓存占用时每条消息记录（含文本、ID、指纹等）的字节数
+CACHE_BUDGET_CHECK_INTERVAL = 5.0         # 追加消息时检查内存预算的最小间隔（秒）
+COMMAND_MATCHER_TTL_SECONDS = 30.0        # 命令匹配器复核间隔（秒），到期后按插件注册签名判断是否重建
+COMMAND_PREFIX_PATTERN = "[/!#\\.。]?"     # 命令可选前缀: / ! # . 。
 
 
 # ==============================================================================
-# 第三部分：主插件类
+# 第三部分：辅助数据结构
+# ==============================================================================
+
+class MessageRecord:
+    """
+    缓存中的单条消息（紧凑记录）
+
+    使用 __slots__ 代替逐条字典，且不保存 embedding：向量只存在于群组的 EmbeddingMatrix 中
+    （按行对应，保留原始范数，需要时可还原）。发送者ID与昵称经 sys.intern 驻留，
+    同一发送者的所有消息共享同一个字符串；图片哈希以字节形式打包保存。
+
+    磁盘上的格式不变：from_dict 从快照/日志读出的字典构建记录，to_dict 还原为同样的字典。
+    embedding_provider 记录生成该条向量的嵌入提供商（旧数据没有此字段，为None）。
+    """
+
+    __slots__ = ("id", "sender_id", "sender_name", "content", "timestamp",
+                 "has_image", "cached_image", "_image_hash", "embedding_provider")
+
+    def __init__(self, id: Optional[str], sender_id: Optional[str], sender_name: Optional[str],
+                 content: str, timestamp: float, has_image: bool = False,
+                 cached_image: Optional[str] = None, image_hash: Optional[str] = None,
+                 embedding_provider: Optional[str] = None):
+        self.id = id
+        self.sender_id = sys.intern(sender_id) if type(sender_id) is str else sender_id
+        self.sender_name = sys.intern(sender_name) if type(sender_name) is str else sender_name
+        self.content = content
+        self.timestamp = timestamp
+        self.has_image = has_image
+        self.cached_image = cached_image
+        self.image_hash = image_hash
+        self.embedding_provider = sys.intern(embedding_provider) if type(embedding_provider) is str else None
+
+    @property
+    def image_hash(self) -> Optional[str]:
+        """十六进制图片哈希（无哈希时为None）"""
+        value = self._image_hash
+        return value.hex() if isinstance(value, bytes) else value
+
+    @image_hash.setter
+    def image_hash(self, value: Optional[str]):
+        # 十六进制哈希打包为字节（长度减半）；无法解析的旧数据原样保留
+        if value:
+            try:
+                value = bytes.fromhex(value)
+            except (TypeError, ValueError):
+                pass
+        self._image_hash = value or None
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "MessageRecord":
+        """从持久化的消息字典构建记录（忽略其中的 embedding）"""
+        return cls(data.get("id"), data.get("sender_id"), data.get("sender_name"),
+                   data.get("content") or "", data.get("timestamp", 0), bool(data.get("has_image")),
+                   data.get("cached_image"), data.get("image_hash"), data.get("embedding_provider"))
+
+    def to_dict(self, embedding=None) -> Dict:
+        """还原为持久化格式的消息字典"""
+        data = {
+            "id": self.id, "sender_id": self.sender_id, "sender_name": self.sender_name,
+            "content": self.content, "timestamp": self.timestamp, "embedding": embedding,
+            "has_image": self.has_image, "cached_image": self.cached_image, "image_hash": self.image_hash
+        }
+        if self.embedding_provider is not None:
+            data["embedding_provider"] = self.embedding_provider
+        return data
+
+
+class EmbeddingMatrix:
+    """
+    群组Embedding矩阵（预归一化的连续存储，可选量化）
+
+    第 i 行与群组消息列表中的第 i 条消息一一对应，向量在写入时即完成归一化，
+    查询时只需一次矩阵-向量乘法加 argmax，无需逐条构造数组和重复计算范数。
+
+    为兼容更换嵌入模型后的新旧数据并存，按向量维度分块存储：
+    每个维度一块矩阵，其他维度（或无embedding）的消息在该块中为零向量，
+    零向量的相似度恒为0，不会参与匹配。
+
+    每行额外记录归一化前的范数，消息记录不再保存原始向量，需要时由 vector() 还原。
+
+    量化（precision 为 float16 / int8）:
+        检索块以 float16 或 int8（每行一个缩放系数）保存，内存占用降为 1/2 或约 1/4；
+        全精度的 float32 副本写入 spill_dir 下的内存映射文件，只在精排时按行读取。
+        similarities 给定阈值时，近似相似度落在"阈值 - 误差上界"以上的行改用全精度重算，
+        因此是否达到阈值的判断与 float32 矩阵完全一致。
+
+    容量按倍增策略扩展，append 为均摊 O(1)；过期清理时由 compacted 生成压缩后的新矩阵，
+    原矩阵保持不变。扩容与压缩都会分配新数组而不是原地修改，后台线程持有的旧数组引用始终有效。
+
+    可选挂载 IVFIndex（ann 属性），矩阵的追加与压缩会同步通知索引。
+    """
+
+    def __init__(self, precision: str = DEFAULT_EMBEDDING_PRECISION, spill_dir: Optional[str] = None):
+        self.size = 0                                 # 当前行数（与消息数一致）
+        self._capacity = 0
+        self.precision = precision if precision in EMBEDDING_PRECISIONS else DEFAULT_EMBEDDING_PRECISION
+        self._spill_dir = spill_dir                   # 量化时全精度副本的内存映射文件目录（None 时保存在内存中）
+        self._dims = np.zeros(0, dtype=np.int32)      # 每行的向量维度，0表示无embedding
+        self._norms = np.zeros(0, dtype=np.float32)   # 每行归一化前的范数
+        self._blocks: Dict[int, "np.ndarray"] = {}    # {维度: (capacity, dim) 检索块，dtype 由 precision 决定}
+        self._exact: Dict[int, "np.ndarray"] = {}     # 量化时 {维度: (capacity, dim) float32 全精度副本}
+        self._scales: Dict[int, "np.ndarray"] = {}    # int8 时 {维度: (capacity,) 每行缩放系数}
+        self.reranked = 0                             # 量化检索中以全精度重算的累计行数
+        self.ann: Optional["IVFIndex"] = None         # 可选的近似最近邻索引
+
+    @property
+    def quantized(self) -> bool:
+        return self.precision != "float32"
+
+    @classmethod
+    def from_embeddings(cls, embeddings: List, precision: str = DEFAULT_EMBEDDING_PRECISION,
+                        spill_dir: Optional[str] = None) -> "EmbeddingMatrix":
+        """
+        根据逐行的 embedding 列表批量构建矩阵（无向量的行为None）
+
+        按维度分组后整体拷贝、整体归一化；embedding 可以是列表，
+        也可以是内存映射数组的行视图（列式存储加载时），后者只在此处拷贝一次。
+        """
+        matrix = cls(precision, spill_dir)
+        matrix._reserve(len(embeddings))
+        matrix.size = len(embeddings)
+
+        rows_by_dim: Dict[int, List[int]] = {}
+        for row, emb in enumerate(embeddings):
+            if emb is not None and len(emb) > 0:
+                rows_by_dim.setdefault(len(emb), []).append(row)
+
+        for dim, rows in rows_by_dim.items():
+            vecs = np.asarray([embeddings[r] for r in rows], dtype=np.float32)
+            norms = np.linalg.norm(vecs, axis=1)
+            nonzero = norms > 0
+            if not nonzero.any():
+                continue
+            rows = np.asarray(rows)[nonzero]
+            matrix._allocate(dim)
+            matrix._store(dim, rows, vecs[nonzero] / norms[nonzero, None])
+            matrix._dims[rows] = dim
+            matrix._norms[rows] = norms[nonzero]
+        return matrix
+
+    @staticmethod
+    def quantize(vecs: "np.ndarray", precision: str) -> Tuple["np.ndarray", Optional["np.ndarray"]]:
+        """
+        将已归一化的 (n, dim) float32 向量量化
+
+        Returns:
+            元组 (量化后的数组, int8 时每行的缩放系数，否则为None)
+        """
+        if precision == "int8":
+            scales = (np.abs(vecs).max(axis=1) / 127.0).astype(np.float32)
+            safe = np.where(scales > 0, scales, 1.0)
+            return np.rint(vecs / safe[:, None]).astype(np.int8), scales
+        return vecs.astype(precision), None
+
+    @staticmethod
+    def error_bound(precision: str, query: "np.ndarray", scales: Optional["np.ndarray"] = None):
+        """
+        量化相似度相对全精度相似度的误差上界（不含 QUANTIZED_RERANK_EPS 余量）
+
+        - float16: 每个分量的相对舍入误差不超过 2^-11，对单位向量点积的影响不超过 2^-11
+        - int8: 每个分量的绝对误差不超过 scale/2，点积误差不超过 scale/2 * ||query||_1（逐行）
+        """
+        if precision == "int8":
+            return 0.5 * scales * float(np.abs(query).sum())
+        if precision == "float16":
+            return FLOAT16_ERROR_BOUND
+        return 0.0
+
+    def _allocate_exact(self, dim: int, capacity: int) -> "np.ndarray":
+        """分配全精度副本：优先使用 spill_dir 下的内存映射文件，失败时退回内存数组"""
+        if self._spill_dir:
+            try:
+                os.makedirs(self._spill_dir, exist_ok=True)
+                path = os.path.join(self._spill_dir, f"{dim}.{uuid.uuid4().hex[:8]}.f32")
+                return np.memmap(path, dtype=np.float32, mode="w+", shape=(capacity, dim))
+            except OSError as e:
+                logger.warning(f"[Memory Reboot] 创建全精度向量映射文件失败，改为保存在内存中: {e}")
+                self._spill_dir = None
+        return np.zeros((capacity, dim), dtype=np.float32)
+
+    @staticmethod
+    def _release_exact(array: "np.ndarray"):
+        """删除不再使用的映射文件（已映射的数组在 POSIX 上仍然有效；删除失败时留待下次启动清理）"""
+        if isinstance(array, np.memmap) and array.filename:
+            try:
+                os.remove(array.filename)
+            except OSError:
+                pass
+
+    def _allocate(self, dim: int):
+        """为新出现的维度分配检索块（量化时一并分配全精度副本与缩放系数）"""
+        self._blocks[dim] = np.zeros((self._capacity, dim), dtype=self.precision)
+        if self.quantized:
+            self._exact[dim] = self._allocate_exact(dim, self._capacity)
+        if self.precision == "int8":
+            self._scales[dim] = np.zeros(self._capacity, dtype=np.float32)
+
+    def _store(self, dim: int, rows, vecs: "np.ndarray"):
+        """写入已归一化的 (n, dim) float32 向量"""
+        quantized, scales = self.quantize(vecs, self.precision)
+        self._blocks[dim][rows] = quantized
+        if scales is not None:
+            self._scales[dim][rows] = scales
+        if self.quantized:
+            self._exact[dim][rows] = vecs
+
+    def _remap(self, capacity: int, kept_rows: "np.ndarray", release: bool = True):
+        """
+        把 kept_rows 指定的现有行按顺序拷贝到容量为 capacity 的新数组（扩容与压缩共用）
+
+        分块拷贝，避免一次性把内存映射的全精度副本读入内存；已无数据的维度整块释放。
+        release 为 False 时保留旧的映射文件（旧数组仍属于另一个矩阵）。
+        """
+        kept = len(kept_rows)
+        dims = np.zeros(capacity, dtype=np.int32)
+        dims[:kept] = self._dims[kept_rows]
+        norms = np.zeros(capacity, dtype=np.float32)
+        norms[:kept] = self._norms[kept_rows]
+
+        for dim in list(self._blocks.keys()):
+            old_exact = self._exact.pop(dim, None)
+            if not np.any(dims[:kept] == dim):
+                # 该维度已无数据（如旧模型数据已全部过期），释放整块
+                del self._blocks[dim]
+                self._scales.pop(dim, None)
+                if old_exact is not None and release:
+                    self._release_exact(old_exact)
+                continue
+            arrays = [(self._blocks, self._blocks[dim], np.zeros((capacity, dim), dtype=self._blocks[dim].dtype))]
+            if dim in self._scales:
+                arrays.append((self._scales, self._scales[dim], np.zeros(capacity, dtype=np.float32)))
+            if old_exact is not None:
+                arrays.append((self._exact, old_exact, self._allocate_exact(dim, capacity)))
+            for start in range(0, kept, QUANTIZED_SCAN_CHUNK):
+                chunk = kept_rows[start:start + QUANTIZED_SCAN_CHUNK]
+                for _, old, new in arrays:
+                    new[start:start + len(chunk)] = old[chunk]
+            for store, _, new in arrays:
+                store[dim] = new
+            if old_exact is not None and release:
+                self._release_exact(old_exact)
+
+        self._dims, self._norms = dims, norms
+        self._capacity = capacity
+
+    def _reserve(self, capacity: int):
+        """确保容量不小于 capacity（倍增扩容）"""
+        if capacity <= self._capacity:
+            return
+        new_capacity = max(EMBEDDING_MATRIX_INITIAL_CAPACITY, self._capacity)
+        while new_capacity < capacity:
+            new_capacity *= 2
+        self._remap(new_capacity, np.arange(self.size))
+
+    def append(self, embedding: Optional[List[float]]):
+        """追加一行（embedding为空时追加零向量占位）"""
+        self._reserve(self.size + 1)
+        row = self.size
+        self.size += 1
+
+        if embedding is None or len(embedding) == 0:
+            return
+
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        if norm == 0.0:
+            return
+
+        dim = vec.shape[0]
+        if dim not in self._blocks:
+            self._allocate(dim)
+        self._store(dim, [row], (vec / norm)[None, :])
+        self._dims[row] = dim
+        self._norms[row] = norm
+
+        if self.ann is not None:
+            self.ann.on_append(row)
+
+    def compacted(self, keep_mask: "np.ndarray") -> "EmbeddingMatrix":
+        """
+        按掩码保留行，返回压缩后的新矩阵（用于过期清理）
+
+        不修改当前矩阵：仍持有旧消息列表与旧矩阵的检索继续按旧行号进行，不会错位。
+        量化时新矩阵使用自己的全精度映射文件，旧矩阵的映射文件仍由其 close() 释放。
+        新矩阵的容量按保留行数重新确定（初始容量起倍增到不小于保留行数），清理后内存随之收缩。
+
+        Args:
+            keep_mask: 长度为 size 的布尔数组，True 表示保留
+        """
+        keep_mask = np.asarray(keep_mask, dtype=bool)
+        kept_rows = np.flatnonzero(keep_mask)
+        capacity = EMBEDDING_MATRIX_INITIAL_CAPACITY
+        while capacity < len(kept_rows):
+            capacity *= 2
+        matrix = EmbeddingMatrix(self.precision, self._spill_dir)
+        matrix._dims, matrix._norms, matrix._capacity = self._dims, self._norms, self._capacity
+        matrix._blocks, matrix._exact, matrix._scales = dict(self._blocks), dict(self._exact), dict(self._scales)
+        matrix._remap(capacity, kept_rows, release=False)
+        matrix.size = len(kept_rows)
+        matrix.reranked = self.reranked
+
+        if self.ann is not None:
+            matrix.ann = self.ann.compacted(matrix, keep_mask)
+        return matrix
+
+    def close(self):
+        """删除全精度副本的映射文件（矩阵不再使用时调用）"""
+        for array in self._exact.values():
+            self._release_exact(array)
+
+    def resident_bytes(self) -> int:
+        """矩阵常驻内存的字节数（不含内存映射的全精度副本）"""
+        total = self._dims.nbytes + self._norms.nbytes
+        total += sum(block.nbytes for block in self._blocks.values())
+        total += sum(scales.nbytes for scales in self._scales.values())
+        total += sum(array.nbytes for array in self._exact.values() if not isinstance(array, np.memmap))
+        return total
+
+    def count_valid(self, dim: Optional[int] = None) -> int:
+        """统计含embedding的行数（指定dim时仅统计该维度）"""
+        dims = self._dims[:self.size]
+        if dim is None:
+            return int(np.count_nonzero(dims))
+        return int(np.count_nonzero(dims == dim))
+
+    def dominant_dim(self) -> int:
+        """返回行数最多的向量维度（无数据时为0）"""
+        if not self._blocks:
+            return 0
+        return max(self._blocks, key=self.count_valid)
+
+    def row_dim(self, row: int) -> int:
+        """返回指定行的向量维度（无embedding时为0）"""
+        return int(self._dims[row])
+
+    def vector(self, row: int) -> Optional[List[float]]:
+        """还原指定行归一化前的向量（无embedding时返回None）"""
+        dim = int(self._dims[row])
+        if dim == 0:
+            return None
+        return (self.block(dim)[row] * self._norms[row]).tolist()
+
+    def rows_of_dim(self, dim: int) -> "np.ndarray":
+        """返回指定维度的全部行号"""
+        return np.flatnonzero(self._dims[:self.size] == dim)
+
+    def block(self, dim: int) -> Optional["np.ndarray"]:
+        """返回指定维度的全精度 float32 矩阵（含预留容量，仅前 size 行有效；量化时为内存映射副本）"""
+        if self.quantized:
+            return self._exact.get(dim)
+        return self._blocks.get(dim)
+
+    @staticmethod
+    def normalize(query: List[float]) -> Optional["np.ndarray"]:
+        """将查询向量转换为归一化的 float32 数组，空向量或零向量返回 None"""
+        if query is None or len(query) == 0:
+            return None
+        q = np.asarray(query, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        if norm == 0.0:
+            return None
+        return q / norm
+
+    def similarities(self, query: List[float], limit: Optional[int] = None,
+                     rows: Optional["np.ndarray"] = None,
+                     threshold: Optional[float] = None) -> Optional["np.ndarray"]:
+        """
+        计算查询向量与矩阵行的余弦相似度
+
+        Args:
+            query: 查询向量（无需预先归一化）
+            limit: 仅计算前 limit 行，默认全部
+            rows: 仅计算指定行号（用于ANN候选精排），与 limit 互斥
+            threshold: 量化时据此精排：可能达到阈值的行改用全精度重算
+
+        Returns:
+            float32 相似度数组（rows 给定时与 rows 一一对应）；维度不匹配的行相似度为0。
+            查询向量为空、范数为0或该维度无数据时返回 None
+        """
+        q = self.normalize(query)
+        if q is None:
+            return None
+        dim = q.shape[0]
+        block = self._blocks.get(dim)
+        if block is None:
+            return None
+
+        n = self.size if limit is None else min(limit, self.size)
+        if not self.quantized:
+            if rows is not None:
+                return block[rows] @ q
+            return block[:n] @ q
+
+        # 量化矩阵：分块转换为 float32 后计算，限制临时内存
+        row_ids = rows if rows is not None else np.arange(n)
+        scales = self._scales.get(dim)
+        sims = np.empty(len(row_ids), dtype=np.float32)
+        for start in range(0, len(row_ids), QUANTIZED_SCAN_CHUNK):
+            stop = min(len(row_ids), start + QUANTIZED_SCAN_CHUNK)
+            chunk = row_ids[start:stop] if rows is not None else slice(start, stop)
+            part = block[chunk].astype(np.float32) @ q
+            if scales is not None:
+                part *= scales[chunk]
+            sims[start:stop] = part
+
+        if threshold is not None and len(row_ids):
+            bound = self.error_bound(self.precision, q, scales[row_ids] if scales is not None else None)
+            near = np.flatnonzero(sims >= threshold - bound - QUANTIZED_RERANK_EPS)
+            if near.size:
+                sims[near] = self._exact[dim][row_ids[near]] @ q
+                self.reranked += int(near.size)
+        return sims
+
+
+class IVFIndex:
+    """
+    倒排文件近似最近邻索引（IVF，球面k-means聚类中心）
+
+    挂载在 EmbeddingMatrix 上，仅索引行数最多的那个维度。
+    查询时只计算与最近 nprobe 个聚类中心对应倒排表中的候选行，
+    在长保留期（30-90天）的大群中可将扫描量降到全量的一小部分。
+
+    生命周期:
+        - 向量数达到 min_size 前不训练，检索回退到精确扫描
+        - 训练在线程池中进行（prepare_training 在事件循环中快照，run_training 纯计算）
+        - 训练完成后，新行在 on_append 中增量分配到最近的聚类
+        - 过期压缩时随矩阵生成新索引：沿用聚类中心，按掩码删除过期行并重建倒排表
+        - 向量数增长到上次训练时的2倍后重新训练
+    """
+
+    def __init__(self, matrix: EmbeddingMatrix, nprobe: int = DEFAULT_ANN_NPROBE,
+                 min_size: int = DEFAULT_ANN_MIN_SIZE):
+        self.matrix = matrix
+        self.nprobe = max(1, int(nprobe))
+        self.min_size = max(1, int(min_size))
+        self.dim = 0
+        self.centroids: Optional["np.ndarray"] = None   # (nlist, dim) 归一化聚类中心
+        self.trained_size = 0
+        self.training = False
+        self._assign = np.full(0, -1, dtype=np.int32)    # 每行所属聚类，-1表示未索引
+        self._lists: List[List[int]] = []                # 倒排表：{聚类: [行号]}
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def needs_training(self) -> bool:
+        """是否需要（重新）训练"""
+        if self.training:
+            return False
+        dim = self.matrix.dominant_dim()
+        count = self.matrix.count_valid(dim) if dim else 0
+        if count < self.min_size:
+            return False
+        return not self.is_trained or dim != self.dim or count >= self.trained_size * 2
+
+    def prepare_training(self) -> Dict:
+        """在事件循环线程中快照训练所需数据（只保存引用和行号，不复制矩阵）"""
+        dim = self.matrix.dominant_dim()
+        return {
+            "dim": dim,
+            "block": self.matrix.block(dim),
+            "rows": self.matrix.rows_of_dim(dim),
+            "size": self.matrix.size,
+        }
+
+    @staticmethod
+    def run_training(job: Dict) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        执行球面k-means并分配全部行（纯计算，可在线程池中运行）
+
+        Returns:
+            元组 (聚类中心, 每行所属聚类)
+        """
+        block, rows = job["block"], job["rows"]
+        nlist = max(1, min(4096, int(np.sqrt(len(rows)))))
+        rng = np.random.default_rng(0)
+
+        sample_rows = rows if len(rows) <= ANN_TRAIN_SAMPLE_SIZE else \
+            np.sort(rng.choice(rows, ANN_TRAIN_SAMPLE_SIZE, replace=False))
+        sample = block[sample_rows]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(ANN_TRAIN_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(labels, kind="stable")
+            present, starts = np.unique(labels[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids[present] = sums / np.maximum(norms, 1e-12)
+            # 空聚类用随机样本重新初始化
+            empty = np.setdiff1d(np.arange(nlist), present)
+            if len(empty):
+                centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+
+        assign = np.full(job["size"], -1, dtype=np.int32)
+        for start in range(0, len(rows), 8192):
+            chunk = rows[start:start + 8192]
+            assign[chunk] = np.argmax(block[chunk] @ centroids.T, axis=1)
+        return centroids, assign
+
+    def finish_training(self, job: Dict, result: Optional[Tuple["np.ndarray", "np.ndarray"]]):
+        """在事件循环线程中安装训练结果，并补分配训练期间新增的行"""
+        self.training = False
+        if result is None:
+            # 训练失败，等待下次触发
+            return
+
+        centroids, assign = result
+        self.dim = job["dim"]
+        self.centroids = centroids
+        self.trained_size = len(job["rows"])
+        self._assign = assign
+        for row in range(job["size"], self.matrix.size):
+            self._assign_row(row)
+        self._rebuild_lists()
+
+    def _ensure_assign(self, size: int):
+        """确保分配数组覆盖前 size 行（倍增扩容，新行为-1）"""
+        if size <= len(self._assign):
+            return
+        grown = np.full(max(len(self._assign) * 2, size), -1, dtype=np.int32)
+        grown[:len(self._assign)] = self._assign
+        self._assign = grown
+
+    def _assign_row(self, row: int):
+        self._ensure_assign(row + 1)
+        block = self.matrix.block(self.dim)
+        if block is None or self.matrix.row_dim(row) != self.dim:
+            return
+        self._assign[row] = int(np.argmax(self.centroids @ block[row]))
+
+    def _rebuild_lists(self):
+        self._lists = [[] for _ in range(len(self.centroids))]
+        assign = self._assign[:self.matrix.size]
+        for row in np.flatnonzero(assign >= 0):
+            self._lists[assign[row]].append(int(row))
+
+    def on_append(self, row: int):
+        """矩阵追加新行时调用"""
+        if not self.is_trained:
+            return
+        self._assign_row(row)
+        cluster = self._assign[row]
+        if cluster >= 0:
+            self._lists[cluster].append(row)
+
+    def compacted(self, matrix: EmbeddingMatrix, keep_mask: "np.ndarray") -> "IVFIndex":
+        """
+        矩阵压缩时调用：返回挂载到压缩后新矩阵的索引，按掩码删除过期行并重建倒排表
+
+        当前索引不变；其进行中的训练结果只会安装到旧矩阵上，新索引需要时重新训练。
+        """
+        index = IVFIndex(matrix, self.nprobe, self.min_size)
+        if self.is_trained:
+            assign = np.full(len(keep_mask), -1, dtype=np.int32)
+            n = min(len(keep_mask), len(self._assign))
+            assign[:n] = self._assign[:n]
+            index.dim, index.centroids, index.trained_size = self.dim, self.centroids, self.trained_size
+            index._assign = assign[keep_mask]
+            index._rebuild_lists()
+        return index
+
+    def candidates(self, query: "np.ndarray") -> Optional["np.ndarray"]:
+        """
+        返回查询向量的候选行号（升序）
+
+        Args:
+            query: 已归一化的查询向量
+
+        Returns:
+            候选行号数组；未训练或维度不匹配时返回 None（调用方应回退精确扫描）
+        """
+        if not self.is_trained or query.shape[0] != self.dim:
+            return None
+        scores = self.centroids @ query
+        nprobe = min(self.nprobe, len(scores))
+        probes = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        rows = [row for p in probes for row in self._lists[p]]
+        return np.sort(np.asarray(rows, dtype=np.int64))
+
+
+def _json_default(obj):
+    """json.dump 的兜底序列化：将 numpy 数组/标量（如内存映射加载的embedding）转换为原生类型"""
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def pack_image_hash(hex_hash: Optional[str]) -> Tuple[Optional[int], int]:
+    """
+    将十六进制图片哈希解析为整数
+
+    Returns:
+        元组 (哈希整数, 位数)；哈希为空、格式错误或超过256位时返回 (None, 0)
+    """
+    if not hex_hash:
+        return None, 0
+    nbits = len(hex_hash) * 4
+    if nbits > IMAGE_HASH_WORDS * 64:
+        return None, 0
+    try:
+        return int(hex_hash, 16), nbits
+    except ValueError:
+        return None, 0
+
+
+def compute_dhash(source) -> str:
+    """
+    计算图片的 256 位 dHash（模块级函数，可在线程池或进程池中执行）
+
+    JPEG 通过 draft() 在解码阶段直接按 1/2~1/8 缩小并解码为灰度，其他格式用 reduce()
+    整数倍快速缩小，最后再用 LANCZOS 缩放到 17x16；相邻像素比较由 NumPy 一次完成。
+
+    Args:
+        source: 图片路径或文件对象
+
+    Returns:
+        64 个十六进制字符的哈希
+    """
+    img = PILImage.open(source)
+    target_w, target_h = DHASH_DRAFT_SIZE
+    if img.format == "JPEG":
+        img.draft("L", DHASH_DRAFT_SIZE)
+    else:
+        factor = min(img.width // target_w, img.height // target_h)
+        if factor >= 2:
+            try:
+                img = img.reduce(factor)
+            except ValueError:
+                pass  # 部分模式（如调色板）不支持 reduce，直接走完整缩放
+    # 使用17x16尺寸，宽度多1用于计算差值，生成16x16=256位哈希
+    img = img.convert("L").resize((17, 16), PILImage.Resampling.LANCZOS)
+    pixels = np.asarray(img, dtype=np.int16)
+    # dHash：比较相邻像素差异，按行优先、高位在前打包为 32 字节
+    bits = pixels[:, :-1] > pixels[:, 1:]
+    return np.packbits(bits.ravel()).tobytes().hex()
+
+
+def hash_image_bytes(data: bytes) -> Optional[str]:
+    """从内存中的图片数据计算哈希：有 Pillow 时为 dHash，否则为 MD5（可在进程池中执行）"""
+    if not HAS_PIL:
+        return hashlib.md5(data).hexdigest()
+    return compute_dhash(io.BytesIO(data))
+
+
+if np is not None:
+    # 字节级popcount查找表（numpy<2.0 没有 bitwise_count 时使用）
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# 分块内汉明距离不超过 r 的全部异或掩码：{r: [mask, ...]}
+_BLOCK_NEIGHBOR_MASKS = {
+    r: [m for m in range(1 << IMAGE_HASH_BLOCK_BITS) if m.bit_count() <= r]
+    for r in range(IMAGE_HASH_MAX_BLOCK_RADIUS + 1)
+}
+
+
+def _popcount_rows(words: "np.ndarray") -> "np.ndarray":
+    """计算 (n, IMAGE_HASH_WORDS) uint64 矩阵每行的置位数"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+class HashIndex:
+    """
+    群组图片哈希矩阵（打包为 uint64 的感知哈希）
+
+    与 EmbeddingMatrix 相同，第 i 行对应群组消息列表中的第 i 条消息。
+    每个哈希（dHash 256位，或MD5后备的128位）在写入时解析为 4 个 uint64，
+    查询时对全部行做一次 XOR + popcount 即得到汉明距离，
+    不再逐条把十六进制字符串展开成二进制字符串比较。
+
+    只有位数相同的哈希才可比较（dHash 与 MD5 后备互不匹配），其余行相似度为0。
+
+    多索引哈希（Multi-Index Hashing）:
+        每个哈希按 16 位切成 m 块（dHash 16块，MD5后备 8块），每块各建一张 {块值: [行号]} 表。
+        汉明半径 r 内的近邻至少有一块的距离不超过 r // m（抽屉原理），
+        因此只需在每块中枚举距离 ≤ r // m 的键，取出候选行后再精确计算距离。
+        阈值0.90（256位半径25）时每块只需查 17 个键，与缓存图片总数无关。
+        块内半径超过 IMAGE_HASH_MAX_BLOCK_RADIUS 时（阈值过低）回退线性扫描。
+
+    表中保存的是"绝对行号"（行号 + _base）。过期清理通常只删除最旧的一段前缀，
+    此时只需增加 _base，失效行号在查询时跳过；其他形式的删除或失效项过多时整体重建。
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._capacity = 0
+        self._words = np.zeros((0, IMAGE_HASH_WORDS), dtype=np.uint64)
+        self._nbits = np.zeros(0, dtype=np.int16)     # 每行哈希位数，0表示无哈希
+        self._base = 0                                # 绝对行号偏移
+        self._stale = 0                               # 表中失效行号数量
+        self._tables: Dict[int, List[Dict[int, List[int]]]] = {}  # {位数: [每块的桶表]}
+
+    @classmethod
+    def from_messages(cls, messages: List[MessageRecord]) -> "HashIndex":
+        """根据消息列表批量构建"""
+        index = cls()
+        index._reserve(len(messages))
+        for msg in messages:
+            index.append(msg.image_hash)
+        return index
+
+    @staticmethod
+    def to_words(value: int) -> "np.ndarray":
+        """将哈希整数拆分为 IMAGE_HASH_WORDS 个 uint64（高位在前）"""
+        return np.frombuffer(value.to_bytes(IMAGE_HASH_WORDS * 8, "big"), dtype=">u8").astype(np.uint64)
+
+    def _reserve(self, capacity: int):
+        if capacity <= self._capacity:
+            return
+        new_capacity = max(EMBEDDING_MATRIX_INITIAL_CAPACITY, self._capacity)
+        while new_capacity < capacity:
+            new_capacity *= 2
+        words = np.zeros((new_capacity, IMAGE_HASH_WORDS), dtype=np.uint64)
+        words[:self.size] = self._words[:self.size]
+        nbits = np.zeros(new_capacity, dtype=np.int16)
+        nbits[:self.size] = self._nbits[:self.size]
+        self._words, self._nbits, self._capacity = words, nbits, new_capacity
+
+    def append(self, hex_hash: Optional[str]):
+        """追加一行（无哈希时追加空行占位）"""
+        self._reserve(self.size + 1)
+        row = self.size
+        self.size += 1
+        value, nbits = pack_image_hash(hex_hash)
+        if value is None:
+            return
+        self._words[row] = self.to_words(value)
+        self._nbits[row] = nbits
+        self._insert(row, value, nbits)
+
+    @staticmethod
+    def _block_keys(value: int, nbits: int) -> List[int]:
+        """将哈希整数切分为 16 位块"""
+        mask = (1 << IMAGE_HASH_BLOCK_BITS) - 1
+        return [(value >> shift) & mask for shift in range(0, nbits, IMAGE_HASH_BLOCK_BITS)]
+
+    def _insert(self, row: int, value: int, nbits: int):
+        keys = self._block_keys(value, nbits)
+        tables = self._tables.get(nbits)
+        if tables is None:
+            tables = self._tables[nbits] = [{} for _ in keys]
+        abs_row = row + self._base
+        for table, key in zip(tables, keys):
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = [abs_row]
+            else:
+                bucket.append(abs_row)
+
+    def _rebuild_tables(self):
+        """根据当前行重建全部桶表"""
+        self._tables, self._base, self._stale = {}, 0, 0
+        for row in np.flatnonzero(self._nbits[:self.size]):
+            nbits = int(self._nbits[row])
+            value = int.from_bytes(self._words[row].astype(">u8").tobytes(), "big")
+            self._insert(int(row), value, nbits)
+
+    def retain(self, keep_mask: "np.ndarray"):
+        """按掩码保留行并压缩存储（用于过期清理）"""
+        keep_mask = np.asarray(keep_mask, dtype=bool)
+        kept = int(keep_mask.sum())
+        dropped = self.size - kept
+        words = np.zeros((self._capacity, IMAGE_HASH_WORDS), dtype=np.uint64)
+        words[:kept] = self._words[:self.size][keep_mask]
+        nbits = np.zeros(self._capacity, dtype=np.int16)
+        nbits[:kept] = self._nbits[:self.size][keep_mask]
+        self._words, self._nbits, self.size = words, nbits, kept
+
+        if not keep_mask[:dropped].any():
+            # 只删除了最旧的前缀：平移行号偏移即可，桶中的旧行号查询时跳过
+            self._base += dropped
+            self._stale += dropped
+            if self._stale <= self.size:
+                return
+        self._rebuild_tables()
+
+    def count_valid(self) -> int:
+        """统计含哈希的行数"""
+        return int(np.count_nonzero(self._nbits[:self.size]))
+
+    def resident_bytes(self) -> int:
+        """打包哈希数组占用的字节数（不含桶表）"""
+        return self._words.nbytes + self._nbits.nbytes
+
+    def similarities(self, hex_hash: str, limit: Optional[int] = None) -> Optional["np.ndarray"]:
+        """
+        计算查询哈希与前 limit 行的相似度（1 - 汉明距离/位数）
+
+        Returns:
+            float32 相似度数组，位数不同或无哈希的行为0；查询哈希无效时返回 None
+        """
+        value, nbits = pack_image_hash(hex_hash)
+        if value is None:
+            return None
+        n = self.size if limit is None else min(limit, self.size)
+        dist = _popcount_rows(self._words[:n] ^ self.to_words(value))
+        sims = 1.0 - dist.astype(np.float32) / nbits
+        sims[self._nbits[:n] != nbits] = 0.0
+        return sims
+
+    def search(self, hex_hash: str, threshold: float,
+               limit: Optional[int] = None) -> Optional[Tuple["np.ndarray", "np.ndarray"]]:
+        """
+        通过多索引哈希查找相似度不低于 threshold 的全部行
+
+        Args:
+            hex_hash: 查询哈希
+            threshold: 相似度阈值
+            limit: 仅考虑前 limit 行
+
+        Returns:
+            元组 (升序行号数组, 对应相似度数组)，只包含达到阈值的行；
+            查询哈希无效时返回 None。阈值过低无法分块检索时回退线性扫描。
+        """
+        value, nbits = pack_image_hash(hex_hash)
+        if value is None:
+            return None
+        n = self.size if limit is None else min(limit, self.size)
+
+        keys = self._block_keys(value, nbits)
+        radius = int(nbits * (1.0 - threshold) + 1e-9)
+        block_radius = radius // len(keys)
+        if block_radius > IMAGE_HASH_MAX_BLOCK_RADIUS:
+            sims = self.similarities(hex_hash, n)
+            rows = np.flatnonzero(sims >= threshold)
+            return rows, sims[rows]
+
+        candidates = set()
+        lo, hi = self._base, self._base + n
+        for table, key in zip(self._tables.get(nbits, ()), keys):
+            for flip in _BLOCK_NEIGHBOR_MASKS[block_radius]:
+                bucket = table.get(key ^ flip)
+                if bucket:
+                    candidates.update(r for r in bucket if lo <= r < hi)
+
+        rows = np.fromiter(sorted(candidates), dtype=np.int64, count=len(candidates)) - self._base
+        dist = _popcount_rows(self._words[rows] ^ self.to_words(value))
+        sims = 1.0 - dist.astype(np.float32) / nbits
+        hit = sims >= threshold
+        return rows[hit], sims[hit]
+
+
+class FingerprintIndex:
+    """
+    群组消息内容指纹表：{指纹: [行号]}
+
+    指纹为规范化文本（折叠首尾及连续空白）的 BLAKE2b 摘要，用于在调用任何模型之前
+    识别逐字复读（转发）。与 EmbeddingMatrix 相同，第 i 行对应群组消息列表中的第 i 条消息；
+    只收录纯文本消息，图片消息的内容是视觉模型生成的描述，不参与指纹匹配。
+    行号列表按写入顺序递增；跨天清理时由 from_messages 整体重建。
+    """
+
+    def __init__(self):
+        self._keys: List[Optional[bytes]] = []
+        self._rows: Dict[bytes, List[int]] = {}
+
+    @staticmethod
+    def fingerprint(text: str) -> bytes:
+        """计算文本指纹（128位BLAKE2b）"""
+        return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).digest()
+
+    @classmethod
+    def from_messages(cls, messages: List[MessageRecord]) -> "FingerprintIndex":
+        """根据消息列表批量构建"""
+        index = cls()
+        for msg in messages:
+            index.append(msg)
+        return index
+
+    @property
+    def size(self) -> int:
+        return len(self._keys)
+
+    def append(self, msg: MessageRecord):
+        """追加一行（图片消息或空内容记为无指纹）"""
+        content = msg.content
+        key = self.fingerprint(content) if content and not msg.has_image else None
+        if key is not None:
+            self._rows.setdefault(key, []).append(len(self._keys))
+        self._keys.append(key)
+
+    def lookup(self, key: bytes, limit: Optional[int] = None) -> List[int]:
+        """返回指纹相同的行号（升序），只包含前 limit 行"""
+        rows = self._rows.get(key, [])
+        if limit is not None and rows and rows[-1] >= limit:
+            rows = [r for r in rows if r < limit]
+        return rows
+
+
+class VisionResultCache:
+    """
+    图片识别结果缓存：按图片感知哈希记住视觉模型的结论（内容描述或"表情包"）
+
+    哈希完全相同时直接查字典；否则借助 HashIndex 的多索引哈希，在 threshold 内查找
+    近似哈希（同一张图被重新压缩、缩放后再次转发）。全局共享，同一张图在不同群也只识别一次。
+    超出容量时淘汰最早写入的一半（HashIndex 对前缀删除只需调整偏移）。
+    """
+
+    def __init__(self, max_entries: int, threshold: float):
+        self.max_entries = max(1, int(max_entries))
+        self.threshold = threshold
+        self._index = HashIndex()
+        self._hashes: List[str] = []                    # 第 i 行对应的哈希
+        self._results: Dict[str, Tuple[str, str]] = {}  # {哈希: (内容, 类型)}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def get(self, image_hash: str) -> Optional[Tuple[str, str]]:
+        """查找完全相同或近似哈希的识别结果，未命中返回None"""
+        result = self._results.get(image_hash)
+        if result is None and self._hashes:
+            found = self._index.search(image_hash, self.threshold)
+            if found is not None and found[0].size > 0:
+                rows, sims = found
+                result = self._results[self._hashes[int(rows[int(np.argmax(sims))])]]
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, image_hash: str, result: Tuple[str, str]):
+        """记录识别结果"""
+        if image_hash in self._results:
+            self._results[image_hash] = result
+            return
+        if len(self._hashes) >= self.max_entries:
+            drop = len(self._hashes) // 2
+            for old in self._hashes[:drop]:
+                del self._results[old]
+            self._hashes = self._hashes[drop:]
+            self._index.retain(np.arange(self._index.size) >= drop)
+        self._hashes.append(image_hash)
+        self._results[image_hash] = result
+        self._index.append(image_hash)
+
+
+class StickerBlocklist:
+    """
+    表情包感知哈希黑名单（持久化、容量有限）
+
+    视觉模型判定为表情包（或管理员手动添加）的图片哈希记入此表，之后哈希相同或近似
+    （threshold 内）的图片在调用视觉模型之前即被跳过。超出容量时淘汰最早加入的一批。
+    本类只维护内存结构，写盘由插件在线程池中完成。
+    """
+
+    def __init__(self, max_entries: int, threshold: float, hashes: Optional[List[str]] = None):
+        self.max_entries = max(1, int(max_entries))
+        self.threshold = threshold
+        self._index = HashIndex()
+        self._hashes: List[str] = []   # 第 i 行对应的哈希，按加入顺序
+        self._members: set = set()
+        self.hits = 0
+        for image_hash in hashes or []:
+            self.add(image_hash)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def match(self, image_hash: str) -> bool:
+        """判断图片是否为已知表情包（哈希相同或近似）"""
+        hit = image_hash in self._members
+        if not hit and self._hashes:
+            found = self._index.search(image_hash, self.threshold)
+            hit = found is not None and found[0].size > 0
+        if hit:
+            self.hits += 1
+        return hit
+
+    def add(self, image_hash: str) -> bool:
+        """加入哈希，已存在或哈希无效时返回False"""
+        if not image_hash or image_hash in self._members or pack_image_hash(image_hash)[0] is None:
+            return False
+        if len(self._hashes) >= self.max_entries:
+            drop = max(1, self.max_entries // 10)
+            self._members.difference_update(self._hashes[:drop])
+            self._hashes = self._hashes[drop:]
+            self._index.retain(np.arange(self._index.size) >= drop)
+        self._hashes.append(image_hash)
+        self._members.add(image_hash)
+        self._index.append(image_hash)
+        return True
+
+    def clear(self):
+        self._index = HashIndex()
+        self._hashes = []
+        self._members = set()
+
+    def to_list(self) -> List[str]:
+        """返回全部哈希（按加入顺序），用于持久化"""
+        return list(self._hashes)
+
+
+class LatencyStats:
+    """
+    耗时统计：累计次数/失败数，并保留最近 LATENCY_STATS_WINDOW 次耗时用于计算分位数
+    """
+
+    def __init__(self, window: int = 0):
+        self.count = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self._recent: deque = deque(maxlen=window or LATENCY_STATS_WINDOW)
+
+    def record(self, elapsed_ms: float, ok: bool = True):
+        self.count += 1
+        if not ok:
+            self.failures += 1
+        self.total_ms += elapsed_ms
+        self._recent.append(elapsed_ms)
+
+    def summary(self) -> Optional[Dict[str, float]]:
+        """返回 {count, failures, avg_ms, p50_ms, p95_ms}，无记录时返回None"""
+        if not self.count:
+            return None
+        recent = np.fromiter(self._recent, dtype=np.float64, count=len(self._recent))
+        p50, p95 = np.percentile(recent, [50, 95])
+        return {"count": self.count, "failures": self.failures, "avg_ms": self.total_ms / self.count,
+                "p50_ms": float(p50), "p95_ms": float(p95)}
+
+
+# 无法安全并入合并正则的写法：全局内联标志、条件分组、按编号反向引用（命名分组另行判断）
+_UNCOMBINABLE_REGEX = re.compile(r"\(\?[aiLmsux]+\)|\(\?\(|\\[1-9]")
+
+
+class IgnorePatternSet:
+    """
+    预编译的忽略正则集合（按 fullmatch 语义匹配）
+
+    - 可安全合并的模式以命名分组包裹后拼成一个交替正则，一次 fullmatch 即可判定，
+      通过 lastgroup 得知命中的是哪一条
+    - 含命名分组、反向引用、全局内联标志的模式单独编译，在合并正则之后逐个检查
+    - 无效模式在构建时记录到 invalid，不参与匹配
+    hits 按模式文本累计命中次数，配置变化重建时沿用未变模式的计数。
+    """
+
+    def __init__(self, patterns: List[str], hits: Optional[Dict[str, int]] = None):
+        self.patterns: List[str] = []
+        self.invalid: List[Tuple[str, str]] = []
+        self.hits: Dict[str, int] = {}
+        previous = hits or {}
+        combinable: List[str] = []
+        separate: List[Tuple[str, re.Pattern]] = []
+        for raw in patterns:
+            pattern = str(raw)
+            if pattern in self.hits:
+                continue
+            try:
+                compiled = re.compile(pattern)
+            except re.error as e:
+                self.invalid.append((pattern, str(e)))
+                continue
+            self.patterns.append(pattern)
+            self.hits[pattern] = previous.get(pattern, 0)
+            if compiled.groupindex or _UNCOMBINABLE_REGEX.search(pattern):
+                separate.append((pattern, compiled))
+            else:
+                combinable.append(pattern)
+
+        self._combined: Optional[re.Pattern] = None
+        self._combined_names: Dict[str, str] = {}
+        if combinable:
+            self._combined_names = {f"_p{i}": pattern for i, pattern in enumerate(combinable)}
+            try:
+                self._combined = re.compile("|".join(f"(?P<{name}>{pattern})"
+                                                     for name, pattern in self._combined_names.items()))
+            except re.error:
+                # 个别模式拼接后才暴露冲突时，整体退回逐个匹配
+                self._combined = None
+                self._combined_names = {}
+                separate = [(pattern, re.compile(pattern)) for pattern in combinable] + separate
+        self._separate = separate
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def match(self, content: str, count: bool = True) -> Optional[str]:
+        """返回第一条完全匹配的模式，无匹配时返回None；count 为False时不累计命中（用于预判）"""
+        pattern = None
+        if self._combined is not None:
+            m = self._combined.fullmatch(content)
+            if m is not None:
+                pattern = self._combined_names[m.lastgroup]
+        if pattern is None:
+            for candidate, compiled in self._separate:
+                if compiled.fullmatch(content):
+                    pattern = candidate
+                    break
+        if pattern is not None and count:
+            self.hits[pattern] += 1
+        return pattern
+
+    def top_hits(self, limit: int) -> List[Tuple[str, int]]:
+        """返回命中次数最多的若干模式（不含零命中）"""
+        ranked = sorted(((p, n) for p, n in self.hits.items() if n), key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+
+class EmbeddingCache:
+    """
+    文本 Embedding 结果缓存（LRU + TTL，可选 SQLite 持久层）
+
+    键为 "提供商ID + 规范化文本" 的 BLAKE2b 摘要。规范化只折叠首尾及连续空白，
+    因此完全相同或仅空白不同的复读无需再次请求嵌入服务。
+
+    - 内存层：OrderedDict 实现的 LRU，向量以 float32 数组保存，只在事件循环线程访问
+    - 持久层（可选）：数据目录下的 SQLite 文件，内存未命中时在线程池中查询，命中后回填内存层；
+      读写由锁串行化，关闭后的写入直接忽略
+    两层均按写入时间做 TTL 过期（ttl_seconds <= 0 表示永不过期）。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries: "OrderedDict[bytes, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._db_writes = 0
+        self.hits = 0          # 内存层命中
+        self.disk_hits = 0     # 持久层命中
+        self.misses = 0        # 两层均未命中（需请求嵌入服务）
+        if db_path:
+            self._open_db(db_path)
+
+    @staticmethod
+    def make_key(provider_id: str, text: str) -> bytes:
+        """计算缓存键：提供商ID与折叠空白后的文本的128位摘要"""
+        normalized = " ".join(text.split())
+        return hashlib.blake2b(f"{provider_id}\0{normalized}".encode("utf-8"), digest_size=16).digest()
+
+    @property
+    def persistent(self) -> bool:
+        return self._db is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def get(self, key: bytes) -> Optional["np.ndarray"]:
+        """查询内存层，命中时刷新LRU顺序"""
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        stored_at, vector = item
+        if self._expired(stored_at):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return vector
+
+    def put(self, key: bytes, vector: "np.ndarray", stored_at: Optional[float] = None):
+        """写入内存层，超出容量时淘汰最久未使用的项"""
+        self._entries[key] = (stored_at or time.time(), vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # ----- 持久层（在线程池中调用） -----
+
+    def _open_db(self, db_path: str):
+        try:
+            db = sqlite3.connect(db_path, check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS embedding_cache ("
+                       "key BLOB PRIMARY KEY, stored_at REAL NOT NULL, vector BLOB NOT NULL)")
+            db.commit()
+            self._db = db
+            self._prune_db()
+        except sqlite3.Error as e:
+            logger.error(f"[Memory Reboot] 打开Embedding持久缓存失败，仅使用内存缓存: {e}")
+            self._db = None
+
+    def _prune_db(self):
+        """删除持久层中已过期的项（调用方持有锁或处于初始化阶段）"""
+        if self.ttl > 0:
+            self._db.execute("DELETE FROM embedding_cache WHERE stored_at < ?", (time.time() - self.ttl,))
+            self._db.commit()
+
+    def load_from_disk(self, key: bytes) -> Optional[Tuple[float, "np.ndarray"]]:
+        """查询持久层，返回 (写入时间, 向量)"""
+        with self._db_lock:
+            if self._db is None:
+                return None
+            try:
+                row = self._db.execute(
+                    "SELECT stored_at, vector FROM embedding_cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"[Memory Reboot] 读取Embedding持久缓存失败: {e}")
+                return None
+        if row is None or self._expired(row[0]):
+            return None
+        return row[0], np.frombuffer(row[1], dtype=np.float32)
+
+    def save_to_disk(self, key: bytes, stored_at: float, vector: "np.ndarray"):
+        """写入持久层；每 EMBEDDING_CACHE_PRUNE_INTERVAL 次写入顺带清理过期项"""
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                self._db.execute("INSERT OR REPLACE INTO embedding_cache (key, stored_at, vector) VALUES (?, ?, ?)",
+                                 (key, stored_at, vector.astype(np.float32).tobytes()))
+                self._db_writes += 1
+                if self._db_writes % EMBEDDING_CACHE_PRUNE_INTERVAL == 0:
+                    self._prune_db()
+                else:
+                    self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"[Memory Reboot] 写入Embedding持久缓存失败: {e}")
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# ==============================================================================
+# 第四部分：主插件类
 # ==============================================================================
 
 class MemoryRebootPlugin(Star):
@@ -107,9 +1391,12 @@ class MemoryRebootPlugin(Star):
         - 内存缓存: 消息列表缓存在内存中，避免每次从磁盘加载
         - 增量写入: 新消息直接追加到缓存和磁盘，无需读-改-写
         - 懒加载: 仅在首次访问群组数据时从磁盘加载
+        - 向量化检索: 每群维护预归一化的Embedding矩阵，一次矩阵乘法完成相似度计算
     """
     
-    # 内存缓存：{group_id: {"messages": [...], "last_load": timestamp, "dirty": bool}}
+    # 内存缓存：{group_id: {"messages": [...], "embeddings": EmbeddingMatrix,
+    #                        "image_hashes": HashIndex, "fingerprints": FingerprintIndex,
+    #                        "last_load": timestamp}}
     _cache: Dict[str, Dict] = {}
     
     # ==========================================================================
@@ -241,20 +1528,147 @@ class MemoryRebootPlugin(Star):
         
         # 设置数据存储目录（支持旧版本数据自动迁移）
         self._setup_data_directory()
+        self._clear_spill_dirs()
         
         # 插件所在目录（用于加载资源文件如提醒图片）
         self.plugin_dir = os.path.dirname(os.path.abspath(__file__))
         
-        # 初始化内存缓存
-        self._cache = {}
+        # 初始化内存缓存（按最近活跃顺序排列，超出预算时从最久未活跃的群组开始淘汰）
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._evicting: set = set()               # 正在淘汰（等待写盘）的群组
+        self._eviction_tasks: set = set()
+        self._evictions = 0
+        self._last_budget_check = 0.0
+        self._inflight: Dict[str, int] = {}       # {group_id: 处理中的消息数}，处理期间该群不会被淘汰
+        self._retired_matrices: Dict[str, List[EmbeddingMatrix]] = {}  # 待该群处理结束后释放的矩阵
+        
+        # 追加日志状态：{(group_id, date): 未合并条数}、{group_id: 最近写入日期}、{(group_id, date): 后台合并任务}
+        self._wal_counts: Dict[Tuple[str, str], int] = {}
+        self._wal_last_date: Dict[str, str] = {}
+        self._compactions: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._rotation_tasks: set = set()  # 等待写盘锁以轮转遗留日志的任务
+        self._wal_checked: set = set()  # 本进程已检查过末行完整性的日志路径
+        # 日文件锁：读取某天（快照 + 日志）与合并该天的日志互斥，读盘不会看到合并到一半的文件
+        self._day_file_locks = [threading.Lock() for _ in range(DAY_FILE_LOCK_STRIPES)]
+        
+        # 后台写盘任务：待写消息 {(group_id, date): [消息]}，由 _flush_loop 定期合并写出
+        self._pending_writes: Dict[Tuple[str, str], List[Dict]] = {}
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._flush_wakeup: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock()
+        self._flusher_stopping = False
+        
+        # 冷启动加载：{group_id: 后台加载任务}、日文件解码线程池、启动预热任务
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._load_pool: Optional[ThreadPoolExecutor] = None
+        self._load_lock = threading.Lock()        # 读盘在多个线程中进行：保护线程池的创建与旧数据迁移
+        self._preload_task: Optional[asyncio.Task] = None
+        
+        # Embedding 结果缓存（首次使用时创建）
+        self._embedding_cache: Optional[EmbeddingCache] = None
+        
+        # 进行中的后台保存（Embedding缓存落盘、表情包黑名单写盘），卸载时等待完成后再关闭资源
+        self._background_saves: set = set()
+        
+        # Embedding 微批处理：{provider_id: [(文本, 等待结果的Future)]}、{provider_id: 窗口定时器}、进行中的批量调用
+        self._embedding_batches: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+        self._embedding_batch_timers: Dict[str, asyncio.TimerHandle] = {}
+        self._embedding_batch_tasks: set = set()
+        
+        # 已解析的嵌入方法：(provider_id, 绑定方法, 是否批量接口)，首次成功调用后记住
+        self._embedding_method: Optional[Tuple[str, object, bool]] = None
+        
+        # 图片识别结果缓存（首次使用时创建）
+        self._vision_cache: Optional[VisionResultCache] = None
+        
+        # 表情包哈希黑名单（启动时或首次使用时在线程池中从磁盘加载）及其延迟写盘定时器
+        self._sticker_blocklist: Optional[StickerBlocklist] = None
+        self._sticker_blocklist_loading: Optional[asyncio.Future] = None
+        self._sticker_save_timer: Optional[asyncio.TimerHandle] = None
+        
+        # 图片下载共享会话（首次下载时创建，复用连接池）及下载耗时统计
+        self._http_session = None
+        self._download_stats = LatencyStats()
+        
+        # 图片哈希进程池（image_hash_executor 为 process 时懒加载；不可用时回退线程池）
+        self._hash_process_pool: Optional[ProcessPoolExecutor] = None
+        self._hash_process_pool_failed = False
+        
+        # 插件命令匹配器缓存：(插件注册签名, 命令列表, 合并正则) 及下次复核时间
+        self._command_matcher: Optional[Tuple[Optional[tuple], List[str], re.Pattern]] = None
+        self._command_matcher_expires = 0.0
+        
+        # 预编译的忽略正则集合及其对应的配置快照（配置变化时重建）
+        self._ignore_patterns: Optional[IgnorePatternSet] = None
+        self._ignore_source: Optional[tuple] = None
         
         logger.info("[Memory Reboot] 插件初始化完成（含内存缓存优化）")
 
+    async def initialize(self):
+        """插件激活后调用：在线程池中加载表情包黑名单，并按配置在后台预热群组缓存，不阻塞启动"""
+        await self._get_sticker_blocklist()
+        group_ids = self._resolve_preload_groups()
+        if group_ids:
+            logger.info(f"[Memory Reboot] 开始启动预热 {len(group_ids)} 个群组...")
+            self._preload_task = asyncio.create_task(self._preload_groups(group_ids))
+
     async def terminate(self):
         """插件卸载时调用"""
+        # 立即发出积攒中的Embedding批量请求，让等待中的消息处理得以结束
+        for provider_id in list(self._embedding_batches):
+            self._dispatch_embedding_batch(provider_id)
+        if self._embedding_batch_tasks:
+            await asyncio.gather(*self._embedding_batch_tasks, return_exceptions=True)
+
+        # 取消尚未完成的启动预热，并等待进行中的读盘结束，避免与最终合并并发
+        if self._preload_task is not None and not self._preload_task.done():
+            self._preload_task.cancel()
+        if self._loading:
+            await asyncio.gather(*self._loading.values(), return_exceptions=True)
+        if self._eviction_tasks:
+            await asyncio.gather(*self._eviction_tasks, return_exceptions=True)
+        if self._rotation_tasks:
+            await asyncio.gather(*self._rotation_tasks, return_exceptions=True)
+
+        # 停止后台写盘任务，并把队列中剩余的消息全部写出
+        self._flusher_stopping = True
+        if self._flusher_task is not None and not self._flusher_task.done():
+            self._flush_wakeup.set()
+            await self._flusher_task
+        await self._flush_pending()
+
+        # 等待进行中的后台合并完成，再合并剩余日志
+        if self._compactions:
+            await asyncio.gather(*self._compactions.values(), return_exceptions=True)
+        loop = asyncio.get_running_loop()
         for group_id in list(self._cache.keys()):
-            self._flush_cache(group_id)
+            await loop.run_in_executor(None, self._flush_cache, group_id)
+        for entry in self._cache.values():
+            entry["embeddings"].close()
         self._cache.clear()
+        for matrices in self._retired_matrices.values():
+            for matrix in matrices:
+                matrix.close()
+        self._retired_matrices.clear()
+        
+        # 等待进行中的后台保存（Embedding缓存落盘、表情包黑名单写盘），再做最终保存并关闭资源
+        if self._background_saves:
+            await asyncio.gather(*self._background_saves, return_exceptions=True)
+        if self._sticker_save_timer is not None:
+            self._sticker_save_timer.cancel()
+            self._sticker_save_timer = None
+            await loop.run_in_executor(None, self._save_sticker_blocklist, self._sticker_blocklist.to_list())
+        if self._http_session is not None and not self._http_session.closed:
+            await self._http_session.close()
+        self._http_session = None
+        if self._embedding_cache is not None:
+            await loop.run_in_executor(None, self._embedding_cache.close)
+            self._embedding_cache = None
+        self._shutdown_hash_executor()
+        with self._load_lock:
+            load_pool, self._load_pool = self._load_pool, None
+        if load_pool is not None:
+            load_pool.shutdown(wait=False)
         logger.info("[Memory Reboot] 资源已清理")
     
     def _setup_data_directory(self):
@@ -392,37 +1806,79 @@ class MemoryRebootPlugin(Star):
         
         return list(commands)
     
-    def _build_command_patterns(self) -> List[str]:
+    def _command_registry_signature(self) -> Optional[tuple]:
+        """
+        计算插件注册状态签名
+        
+        由处理器注册数量和各插件的激活状态组成，插件启用、停用、重载后签名随之改变。
+        
+        Returns:
+            签名元组；无法获取时返回None（此时到期即重建）
+        """
+        if not HAS_COMMAND_FILTER:
+            return ()
+        try:
+            stars = self.context.get_all_stars()
+            return (len(star_handlers_registry),
+                    tuple(sorted((getattr(star, "module_path", None) or "", bool(star.activated))
+                                 for star in stars)))
+        except Exception:
+            return None
+    
+    @classmethod
+    def _compile_command_matcher(cls, commands: List[str]) -> re.Pattern:
         """
-        根据插件命令构建正则表达式模式列表
+        将所有命令编译为一个合并正则
         
-        为每个命令生成匹配模式，支持以下格式：
+        自己的命令（SELF_COMMANDS）放在最前面并单独捕获为 self 分组，
+        其余命令按长度降序排列，支持以下格式：
         - 直接匹配命令（如 "签到"）
         - 带前缀的命令（如 "/签到", "!签到"）
         - 命令后带参数（如 "签到 xxx", "/天气 北京"）
         
+        Args:
+            commands: 插件命令列表
+            
         Returns:
-            正则表达式模式列表
+            编译后的正则，每条消息只需一次 match
         """
-        commands = self._get_all_plugin_commands()
-        patterns = []
+        def alternation(names) -> str:
+            return "|".join(re.escape(name) for name in sorted(set(names), key=len, reverse=True))
         
-        for cmd in commands:
-            if not cmd:
-                continue
-            # 转义正则特殊字符
-            escaped_cmd = re.escape(cmd)
-            # 匹配：可选前缀 + 命令 + 可选参数
-            # 前缀包括: / ! # . 等常见命令前缀
-            pattern = f"^[/!#\\.。]?{escaped_cmd}($|\\s.*$)"
-            patterns.append(pattern)
-        
-        return patterns
+        self_names = set(cls.SELF_COMMANDS)
+        others = [cmd for cmd in commands if cmd and cmd not in self_names]
+        body = f"(?P<self>{alternation(self_names)})"
+        if others:
+            body += f"|{alternation(others)}"
+        return re.compile(f"^{COMMAND_PREFIX_PATTERN}(?:{body})($|\\s.*$)", re.IGNORECASE)
+    
+    def _get_command_matcher(self) -> Tuple[List[str], re.Pattern]:
+        """
+        获取缓存的命令列表与合并正则
+        
+        缓存到期后先比对插件注册签名，未变化则直接续期，只有插件启用/停用时才重新遍历注册表并编译。
+        
+        Returns:
+            (命令列表, 合并正则)
+        """
+        now = time.monotonic()
+        cached = self._command_matcher
+        if cached is not None and now < self._command_matcher_expires:
+            return cached[1], cached[2]
+        
+        signature = self._command_registry_signature()
+        if cached is None or signature is None or signature != cached[0]:
+            commands = self._get_all_plugin_commands()
+            cached = (signature, commands, self._compile_command_matcher(commands))
+            self._command_matcher = cached
+            logger.debug(f"[Memory Reboot] 已重建命令匹配器 ({len(commands)} 个命令)")
+        self._command_matcher_expires = now + COMMAND_MATCHER_TTL_SECONDS
+        return cached[1], cached[2]
     
     # 自己的命令白名单，这些命令不应该被过滤（需要由自己的命令处理器处理）
-    SELF_COMMANDS = ["记忆状态", "查看过滤命令", "擦除记忆"]
+    SELF_COMMANDS = ["记忆状态", "查看过滤命令", "擦除记忆", "索引召回测试", "量化评估", "屏蔽表情包", "清空表情包库"]
     
-    def _is_plugin_command(self, content: str) -> bool:
+    def _is_plugin_command(self, content: str, quiet: bool = False) -> bool:
         """
         检查消息内容是否为其他插件的命令
         
@@ -430,6 +1886,7 @@ class MemoryRebootPlugin(Star):
         
         Args:
             content: 消息文本内容
+            quiet: 为True时不输出日志（用于预判）
             
         Returns:
             True: 是其他插件命令，应该被过滤
@@ -442,30 +1899,20 @@ class MemoryRebootPlugin(Star):
             return False
         
         content_stripped = content.strip()
+        _, matcher = self._get_command_matcher()
+        match = matcher.match(content_stripped)
+        if match is None:
+            return False
         
-        # 检查是否是自己的命令（白名单），如果是则不过滤
-        for self_cmd in self.SELF_COMMANDS:
-            # 匹配：可选前缀 + 命令
-            self_pattern = f"^[/!#\\.。]?{re.escape(self_cmd)}($|\\s.*$)"
-            try:
-                if re.match(self_pattern, content_stripped, re.IGNORECASE):
-                    logger.debug(f"[Memory Reboot] 检测到自己的命令，不过滤: {content_stripped[:50]}")
-                    return False
-            except re.error:
-                continue
-        
-        # 获取命令模式并检查是否是其他插件的命令
-        patterns = self._build_command_patterns()
-        
-        for pattern in patterns:
-            try:
-                if re.match(pattern, content_stripped, re.IGNORECASE):
-                    logger.debug(f"[Memory Reboot] 检测到插件命令: {content_stripped[:50]}")
-                    return True
-            except re.error:
-                continue
+        # 命中自己的命令（白名单），不过滤
+        if match.group("self") is not None:
+            if not quiet:
+                logger.debug(f"[Memory Reboot] 检测到自己的命令，不过滤: {content_stripped[:50]}")
+            return False
         
-        return False
+        if not quiet:
+            logger.debug(f"[Memory Reboot] 检测到插件命令: {content_stripped[:50]}")
+        return True
     
     # ==========================================================================
     # 4.4 数据持久化方法 (分片存储 + Gzip压缩优化)
@@ -477,6 +1924,27 @@ class MemoryRebootPlugin(Star):
         os.makedirs(path, exist_ok=True)
         return path
 
+    def _new_embedding_matrix(self, group_id: str, embeddings: Optional[List] = None) -> EmbeddingMatrix:
+        """按 embedding_precision 创建群组Embedding矩阵（量化时全精度副本映射到群组目录下的 spill 子目录）"""
+        precision = self.config.get("embedding_precision", DEFAULT_EMBEDDING_PRECISION)
+        spill_dir = None
+        if precision != "float32":
+            spill_dir = os.path.join(self.data_dir, str(group_id), EMBEDDING_SPILL_DIRNAME)
+        if embeddings is None:
+            return EmbeddingMatrix(precision, spill_dir)
+        return EmbeddingMatrix.from_embeddings(embeddings, precision, spill_dir)
+
+    def _clear_spill_dirs(self):
+        """删除上次运行遗留的全精度向量映射文件（仅供本进程的量化矩阵精排使用，不跨进程保留）"""
+        try:
+            names = os.listdir(self.data_dir)
+        except OSError:
+            return
+        for name in names:
+            spill_dir = os.path.join(self.data_dir, name, EMBEDDING_SPILL_DIRNAME)
+            if os.path.isdir(spill_dir):
+                shutil.rmtree(spill_dir, ignore_errors=True)
+
     def _get_daily_file(self, group_id: str, timestamp: float) -> str:
         """获取指定时间戳对应的日存储文件路径（.json.gz）"""
         date_str = datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
@@ -518,7 +1986,7 @@ class MemoryRebootPlugin(Star):
         except Exception as e:
             logger.error(f"[Memory Reboot] 数据迁移失败: {e}")
 
-    def _load_messages(self, group_id: str) -> List[Dict]:
+    def _load_messages(self, group_id: str) -> List[MessageRecord]:
         """
         加载最近N天的消息（带内存缓存优化）
         
@@ -534,6 +2002,8 @@ class MemoryRebootPlugin(Star):
             cache_date = datetime.date.fromtimestamp(cache_entry.get("last_load", 0))
             today = datetime.date.today()
             
+            self._touch_group(group_id)
+            
             # 如果是同一天的缓存，直接返回
             if cache_date == today:
                 return cache_entry["messages"]
@@ -541,17 +2011,44 @@ class MemoryRebootPlugin(Star):
             # 跨天了，需要清理过期消息并更新缓存
             retention_days = self.config.get("data_retention_days", 7)
             cutoff = time.time() - retention_days * 86400
-            cache_entry["messages"] = [m for m in cache_entry["messages"] if m.get("timestamp", 0) > cutoff]
+            messages = cache_entry["messages"]
+            keep_mask = np.fromiter((m.timestamp > cutoff for m in messages),
+                                    dtype=bool, count=len(messages))
+            if not keep_mask.all():
+                # 整体替换为新的消息列表与索引，不原地压缩：处理中的消息仍持有旧条目，行号保持一致
+                kept = [m for m, keep in zip(messages, keep_mask) if keep]
+                old_matrix = cache_entry["embeddings"]
+                cache_entry = self._cache[group_id] = {
+                    **cache_entry,
+                    "messages": kept,
+                    "embeddings": old_matrix.compacted(keep_mask),
+                    "image_hashes": HashIndex.from_messages(kept),
+                    "fingerprints": FingerprintIndex.from_messages(kept),
+                }
+                self._retire_matrix(group_id, old_matrix)
             cache_entry["last_load"] = time.time()
             return cache_entry["messages"]
         
         # 缓存不存在，从磁盘加载
         return self._load_messages_from_disk(group_id)
     
-    def _load_messages_from_disk(self, group_id: str) -> List[Dict]:
-        """从磁盘加载消息并更新缓存"""
-        # 1. 尝试迁移单一大文件
-        self._migrate_legacy_data(group_id)
+    def _load_messages_from_disk(self, group_id: str) -> List[MessageRecord]:
+        """从磁盘加载消息并更新缓存（同步路径，供命令等未预热的场景兜底）"""
+        entry, leftover_dates = self._read_group_from_disk(group_id)
+        self._install_cache_entry(group_id, entry, leftover_dates)
+        logger.debug(f"[Memory Reboot] 从磁盘加载 {len(entry['messages'])} 条消息到缓存")
+        return entry["messages"]
+
+    def _read_group_from_disk(self, group_id: str) -> Tuple[Dict, List[str]]:
+        """
+        读取群组历史并构建缓存条目（不触碰共享状态，可在线程池中执行）
+
+        Returns:
+            (缓存条目, 仍有遗留追加日志的往日日期列表)
+        """
+        # 1. 尝试迁移单一大文件（同一群可能同时在后台与同步路径中读盘，迁移串行执行）
+        with self._load_lock:
+            self._migrate_legacy_data(group_id)
         
         group_dir = self._get_group_dir(group_id)
         retention_days = self.config.get("data_retention_days", 7)
@@ -562,6 +2059,7 @@ class MemoryRebootPlugin(Star):
                         for i in range(retention_days + 1) }
         
         all_messages = []
+        log_dates = set()
         if os.path.exists(group_dir):
             try:
                 for filename in sorted(os.listdir(group_dir)):
@@ -586,103 +2084,695 @@ class MemoryRebootPlugin(Star):
                             logger.error(f"[Memory Reboot] 自动压缩失败: {e}")
                             continue
 
-                    # 加载 .json.gz 文件
-                    if filename.endswith(".json.gz"):
-                        date_part = filename.replace(".json.gz", "")
-                        if date_part in valid_dates:
-                            try:
-                                with gzip.open(filepath, "rt", encoding="utf-8") as f:
-                                    day_msgs = json.load(f)
-                                    all_messages.extend(day_msgs)
-                            except Exception as e:
-                                logger.error(f"[Memory Reboot] 读取压缩文件失败 {filepath}: {e}")
+                    # 收集存在快照或追加日志的日期
+                    for suffix in (".meta.json.gz", ".json.gz", ".wal", ".wal.compacting"):
+                        if filename.endswith(suffix):
+                            log_dates.add(filename[:-len(suffix)])
+                            break
+
+                # 加载快照 + 追加日志：各日文件互相独立，多于一天时并行解码
+                load_dates = sorted(log_dates & valid_dates)
+                if len(load_dates) > 1:
+                    daily = self._get_load_pool().map(
+                        lambda d: self._read_daily_messages(group_dir, d), load_dates)
+                else:
+                    daily = (self._read_daily_messages(group_dir, d) for d in load_dates)
+                for day_messages in daily:
+                    all_messages.extend(day_messages)
             except Exception as e:
                 logger.error(f"[Memory Reboot] 读取消息失败: {e}")
+
+        # 往日遗留的追加日志（如上次未正常退出），交由调用方在后台合并进快照
+        today_str = today.strftime("%Y-%m-%d")
+        leftover_dates = [
+            date_part for date_part in sorted(log_dates & valid_dates - {today_str})
+            if os.path.exists(os.path.join(group_dir, f"{date_part}.wal")) or
+            os.path.exists(os.path.join(group_dir, f"{date_part}.wal.compacting"))
+        ]
                 
         # 确保按时间排序
         all_messages.sort(key=lambda x: x.get("timestamp", 0))
         
-        # 更新缓存
-        self._cache[group_id] = {
-            "messages": all_messages,
-            "last_load": time.time()
+        # 向量进入共享矩阵，消息本身转为不含向量的紧凑记录
+        records = [MessageRecord.from_dict(m) for m in all_messages]
+        entry = {
+            "messages": records,
+            "embeddings": self._new_embedding_matrix(group_id, [m.get("embedding") for m in all_messages]),
+            "image_hashes": HashIndex.from_messages(records),
+            "fingerprints": FingerprintIndex.from_messages(records),
+            "last_load": time.time(),
+            "last_active": time.monotonic()
         }
-        
-        logger.debug(f"[Memory Reboot] 从磁盘加载 {len(all_messages)} 条消息到缓存")
-        return all_messages
-    def _append_message(self, group_id: str, message: Dict):
+        return entry, leftover_dates
+
+    def _install_cache_entry(self, group_id: str, entry: Dict, leftover_dates: List[str]):
+        """在事件循环线程中登记缓存条目，并启动ANN训练与遗留日志合并，超出内存预算时淘汰其他群组"""
+        self._cache[group_id] = entry
+        self._touch_group(group_id)
+        self._prepare_ann_index(entry["embeddings"])
+        self._compact_leftover_logs(group_id, leftover_dates)
+        self._enforce_cache_budget(group_id, force=True)
+
+    def _get_load_pool(self) -> ThreadPoolExecutor:
+        """懒加载用于并行解码日文件的线程池（可在多个读盘线程中同时调用，只创建一个）"""
+        with self._load_lock:
+            if self._load_pool is None:
+                workers = max(1, int(self.config.get("preload_workers", DEFAULT_PRELOAD_WORKERS)))
+                self._load_pool = ThreadPoolExecutor(max_workers=workers,
+                                                     thread_name_prefix="memory_reboot_load")
+            return self._load_pool
+
+    async def _load_messages_async(self, group_id: str) -> List[MessageRecord]:
+        """
+        异步版 _load_messages：未缓存的群在线程池中读盘，不阻塞事件循环
+
+        同一群的并发请求（含启动预热）共享同一个加载任务。
+        """
+        group_id = str(group_id)
+        if group_id not in self._cache:
+            task = self._loading.get(group_id)
+            if task is None:
+                task = asyncio.ensure_future(self._load_group_in_background(group_id))
+                self._loading[group_id] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[Memory Reboot] 后台加载群 {group_id} 失败，改为同步加载: {e}")
+        return self._load_messages(group_id)
+
+    async def _load_group_in_background(self, group_id: str):
+        """在线程池中读取群组历史，回到事件循环后登记缓存"""
+        try:
+            loop = asyncio.get_running_loop()
+            entry, leftover_dates = await loop.run_in_executor(
+                None, self._read_group_from_disk, group_id)
+            # 读盘期间若已被同步路径加载（缓存中可能已有新消息），以现有缓存为准
+            if group_id not in self._cache:
+                self._install_cache_entry(group_id, entry, leftover_dates)
+                logger.debug(f"[Memory Reboot] 后台加载 {len(entry['messages'])} 条消息到缓存")
+            else:
+                entry["embeddings"].close()
+        finally:
+            self._loading.pop(group_id, None)
+
+    def _resolve_preload_groups(self) -> List[str]:
+        """解析需要在启动时预热的群组列表（"*" 表示数据目录中的全部群组）"""
+        configured = [str(g).strip() for g in self.config.get("preload_groups", []) if str(g).strip()]
+        if "*" in configured:
+            try:
+                configured = [name for name in sorted(os.listdir(self.data_dir))
+                              if os.path.isdir(os.path.join(self.data_dir, name))]
+            except OSError as e:
+                logger.error(f"[Memory Reboot] 枚举群组目录失败: {e}")
+                configured = []
+        return [g for g in dict.fromkeys(configured) if self._is_group_enabled(g)]
+
+    async def _preload_groups(self, group_ids: List[str]):
+        """并行预热群组缓存，同时加载的群组数受 preload_workers 限制"""
+        start = time.time()
+        semaphore = asyncio.Semaphore(max(1, int(self.config.get("preload_workers", DEFAULT_PRELOAD_WORKERS))))
+
+        async def _warm(group_id: str):
+            async with semaphore:
+                await self._load_messages_async(group_id)
+
+        results = await asyncio.gather(*(_warm(g) for g in group_ids), return_exceptions=True)
+        failed = sum(1 for r in results if isinstance(r, Exception))
+        total = sum(len(self._cache[g]["messages"]) for g in group_ids if g in self._cache)
+        logger.info(f"[Memory Reboot] 启动预热完成: {len(group_ids) - failed}/{len(group_ids)} 个群组，"
+                    f"{total} 条消息，耗时 {time.time() - start:.2f}s")
+
+    def _append_message(self, group_id: str, message: MessageRecord, embedding: Optional[List[float]] = None):
         """
         追加单条消息（内存缓存优化版）
         
         优化策略:
-        - 先更新内存缓存（O(1)操作）
-        - 异步/延迟写入磁盘
-        - 使用批量写入减少I/O次数
+        - 先更新内存缓存（O(1)操作，Embedding矩阵均摊O(1)扩容；向量只进入矩阵，不留在消息记录中）
+        - 消息只放入待写队列，由后台写盘任务按间隔合并后在线程池中追加到日志（{date}.wal）
+        - 日志累计到一定条数或跨天后，在后台合并进当日快照（{date}.json.gz）
         """
         group_id = str(group_id)
         
-        # 1. 更新内存缓存
+        # 1. 更新内存缓存（处理中的群不会被淘汰，只有处理期间被擦除记忆时才不在缓存中）
         if group_id not in self._cache:
             self._cache[group_id] = {
                 "messages": [],
-                "last_load": time.time()
+                "embeddings": self._new_embedding_matrix(group_id),
+                "image_hashes": HashIndex(),
+                "fingerprints": FingerprintIndex(),
+                "last_load": time.time(),
+                "last_active": time.monotonic()
             }
+        self._touch_group(group_id)
         
         self._cache[group_id]["messages"].append(message)
+        self._cache[group_id]["embeddings"].append(embedding)
+        self._cache[group_id]["image_hashes"].append(message.image_hash)
+        self._cache[group_id]["fingerprints"].append(message)
+        self._prepare_ann_index(self._cache[group_id]["embeddings"])
         
-        # 2. 写入磁盘（优化：每N条消息或跨天时才写入）
-        cache_entry = self._cache[group_id]
-        messages = cache_entry["messages"]
-        
-        # 获取当天的消息用于写入
-        today_str = datetime.datetime.fromtimestamp(message.get("timestamp", time.time())).strftime("%Y-%m-%d")
-        today_messages = [m for m in messages if datetime.datetime.fromtimestamp(m.get("timestamp", 0)).strftime("%Y-%m-%d") == today_str]
-        
-        # 每10条消息写入一次，或者是当天第一条消息时写入
-        should_write = len(today_messages) == 1 or len(today_messages) % 10 == 0
+        # 2. 以持久化格式（含向量）放入待写队列，交给后台写盘任务（无事件循环时同步写入）
+        date_str = datetime.datetime.fromtimestamp(message.timestamp or time.time()).strftime("%Y-%m-%d")
+        self._pending_writes.setdefault((group_id, date_str), []).append(message.to_dict(embedding))
+        if self._ensure_flusher():
+            self._flush_wakeup.set()
+        else:
+            batch = self._take_pending()
+            self._after_write(batch, self._write_batch(batch))
         
-        if should_write:
-            self._write_daily_messages(group_id, today_str, today_messages)
+        self._enforce_cache_budget(group_id)
+
+    # ----- 群组缓存内存预算 -----
+
+    def _touch_group(self, group_id: str):
+        """标记群组为最近活跃（移到LRU队尾）"""
+        entry = self._cache.get(group_id)
+        if entry is not None:
+            entry["last_active"] = time.monotonic()
+            self._cache.move_to_end(group_id)
+
+    @staticmethod
+    def _estimate_entry_bytes(entry: Dict) -> int:
+        """估算单个群组缓存的常驻内存：向量与哈希按实际数组大小，消息记录按每条固定估值"""
+        return (entry["embeddings"].resident_bytes() + entry["image_hashes"].resident_bytes()
+                + len(entry["messages"]) * MESSAGE_RECORD_ESTIMATED_BYTES)
+
+    def _cache_usage(self) -> Tuple[int, int]:
+        """返回 (缓存群组数, 估算占用字节数)"""
+        return len(self._cache), sum(self._estimate_entry_bytes(e) for e in self._cache.values())
+
+    def _enforce_cache_budget(self, keep: str, force: bool = False):
+        """
+        超出 cache_max_groups / cache_max_memory_mb 时，从最久未活跃的群组开始淘汰（keep 除外）
+
+        淘汰前先把该群的待写消息写入日志（后台任务），之后再次活跃时由 _load_messages 从磁盘重新加载。
+        仍有消息在处理的群组不淘汰（处理过程跨越多次 await，一直持有该群的消息列表与索引），
+        其最后一条消息处理结束时会再检查一次。
+        按内存预算检查需要遍历全部群组，追加消息时至多每 CACHE_BUDGET_CHECK_INTERVAL 秒检查一次。
+        """
+        max_groups = int(self.config.get("cache_max_groups", DEFAULT_CACHE_MAX_GROUPS))
+        max_bytes = float(self.config.get("cache_max_memory_mb", DEFAULT_CACHE_MAX_MEMORY_MB)) * 1048576
+        if max_groups <= 0 and max_bytes <= 0:
+            return
+        now = time.monotonic()
+        over_groups = 0 < max_groups < len(self._cache) - len(self._evicting)
+        if not force and not over_groups and now - self._last_budget_check < CACHE_BUDGET_CHECK_INTERVAL:
+            return
+        self._last_budget_check = now
+
+        sizes = [(g, self._estimate_entry_bytes(e)) for g, e in self._cache.items() if g not in self._evicting]
+        count, total = len(sizes), sum(size for _, size in sizes)
+        victims = []
+        for group_id, size in sizes:
+            if not (0 < max_groups < count or 0 < max_bytes < total):
+                break
+            if group_id == keep or group_id in self._inflight:
+                continue
+            victims.append(group_id)
+            count -= 1
+            total -= size
+        if not victims:
+            return
+
+        logger.debug(f"[Memory Reboot] 缓存超出预算，淘汰 {len(victims)} 个不活跃群组: {victims}")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 无事件循环时消息已同步写盘，直接淘汰
+            for group_id in victims:
+                self._evict_group(group_id)
+            return
+        self._evicting.update(victims)
+        task = loop.create_task(self._evict_groups(victims, now))
+        self._eviction_tasks.add(task)
+        task.add_done_callback(self._eviction_tasks.discard)
+
+    async def _evict_groups(self, group_ids: List[str], started: float):
+        """先写出待写消息再淘汰；写盘期间重新活跃、开始处理消息或又有待写消息的群组保留"""
+        try:
+            for group_id in group_ids:
+                try:
+                    await self._flush_pending(group_id)
+                except Exception as e:
+                    logger.error(f"[Memory Reboot] 淘汰前写盘失败，保留群 {group_id} 的缓存: {e}")
+                    continue
+                entry = self._cache.get(group_id)
+                if entry is None or entry["last_active"] > started or group_id in self._inflight or \
+                        any(key[0] == group_id for key in self._pending_writes):
+                    continue
+                self._evict_group(group_id)
+        finally:
+            self._evicting.difference_update(group_ids)
+
+    def _evict_group(self, group_id: str):
+        """从内存中移除群组缓存（磁盘数据不受影响）"""
+        entry = self._cache.pop(group_id, None)
+        if entry is None:
+            return
+        self._retire_matrix(group_id, entry["embeddings"])
+        self._evictions += 1
+        logger.debug(f"[Memory Reboot] 已淘汰群 {group_id} 的缓存（{len(entry['messages'])}条消息）")
+
+    def _retire_matrix(self, group_id: str, matrix: EmbeddingMatrix):
+        """释放已移出缓存的矩阵；该群仍有消息在处理（可能仍在检索该矩阵）时推迟到处理结束"""
+        if group_id in self._inflight:
+            self._retired_matrices.setdefault(group_id, []).append(matrix)
+        else:
+            matrix.close()
+
+    def _release_inflight(self, group_id: str):
+        """一条消息处理结束；该群最后一条消息处理结束时释放推迟的矩阵，并补做处理期间跳过的淘汰"""
+        count = self._inflight.get(group_id, 0) - 1
+        if count > 0:
+            self._inflight[group_id] = count
+            return
+        self._inflight.pop(group_id, None)
+        for matrix in self._retired_matrices.pop(group_id, []):
+            matrix.close()
+        self._enforce_cache_budget(group_id)
+
+    # ----- 后台写盘任务 -----
+
+    def _ensure_flusher(self) -> bool:
+        """
+        确保后台写盘任务在运行（懒启动）
+
+        Returns:
+            True: 任务在运行；False: 当前没有运行中的事件循环，调用方应同步写入
+        """
+        if self._flusher_task is not None and not self._flusher_task.done():
+            return True
+        if self._flusher_stopping:
+            return False
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        self._flush_wakeup = asyncio.Event()
+        self._flusher_task = loop.create_task(self._flush_loop())
+        return True
+
+    async def _flush_loop(self):
+        """
+        后台写盘循环：有新消息时等待一个合并间隔，再把这段时间内的消息按群/日期一次写出
+
+        flush_interval_seconds 越大，写入合并得越充分，但进程崩溃时最多丢失这一间隔内的消息。
+        """
+        while True:
+            await self._flush_wakeup.wait()
+            if not self._flusher_stopping:
+                interval = self.config.get("flush_interval_seconds", DEFAULT_FLUSH_INTERVAL_SECONDS)
+                await asyncio.sleep(max(0.0, float(interval)))
+            self._flush_wakeup.clear()
+            try:
+                await self._flush_pending()
+            except Exception as e:
+                logger.error(f"[Memory Reboot] 后台写盘失败: {e}")
+            if self._flusher_stopping:
+                return
+
+    def _take_pending(self, group_id: Optional[str] = None) -> Dict[Tuple[str, str], List[Dict]]:
+        """取出待写消息（指定 group_id 时只取该群）"""
+        if group_id is None:
+            batch, self._pending_writes = self._pending_writes, {}
+            return batch
+        batch = {k: v for k, v in self._pending_writes.items() if k[0] == group_id}
+        for key in batch:
+            del self._pending_writes[key]
+        return batch
+
+    def _write_batch(self, batch: Dict[Tuple[str, str], List[Dict]]) -> Dict[Tuple[str, str], Optional[int]]:
+        """将一批消息按群/日期各一次写入追加日志（序列化与I/O都在这里，可在线程池中运行）"""
+        return {key: self._append_to_log(key[0], key[1], messages) for key, messages in batch.items()}
+
+    def _after_write(self, batch: Dict[Tuple[str, str], List[Dict]], results: Dict[Tuple[str, str], Optional[int]]):
+        """
+        写入完成后在事件循环线程中更新日志计数，并按需触发合并（调用方持有 _flush_lock 或无事件循环）
+
+        写入失败的消息放回队列，下次写盘时重试。
+        """
+        for key, existing in results.items():
+            group_id, date_str = key
+            if existing is None:
+                self._pending_writes[key] = batch[key] + self._pending_writes.get(key, [])
+                continue
+
+            # existing 为日志中上次运行遗留的条数（仅本进程首次写入时非0），重启后合并阈值照常生效
+            self._wal_counts[key] = self._wal_counts.get(key, 0) + existing + len(batch[key])
+
+            # 跨天时合并前一天的日志；当日日志过长时合并进快照
+            last_date = self._wal_last_date.get(group_id)
+            if last_date is None or date_str >= last_date:
+                self._wal_last_date[group_id] = date_str
+            if last_date and last_date < date_str:
+                self._schedule_compaction(group_id, last_date)
+            if self._wal_counts[key] >= WAL_COMPACT_THRESHOLD:
+                self._schedule_compaction(group_id, date_str)
+
+    async def _flush_pending(self, group_id: Optional[str] = None):
+        """
+        将待写消息写入磁盘（在线程池中执行）
+
+        写入串行化：同一时刻只有一批写入在进行，日志改名（合并）也只在两批写入之间发生，
+        保证不会有记录写进正在合并的日志。
+        """
+        async with self._flush_lock:
+            batch = self._take_pending(group_id)
+            if not batch:
+                return
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(None, self._write_batch, batch)
+            self._after_write(batch, results)
+
+    def _append_to_log(self, group_id: str, date_str: str, messages: List[Dict]) -> Optional[int]:
+        """
+        将消息以一行一条JSON的形式追加到当日日志
+
+        每次写入都重新按路径打开文件：合并时日志会被改名，
+        之后的追加自然落到新的日志文件中。每批写完即 fsync，进程或系统崩溃都不会丢失已追加的记录。
+
+        Returns:
+            写入失败时为None；否则为本进程首次写入该日志前其中已有的完整记录条数（之后的写入为0）
+        """
+        path = os.path.join(self._get_group_dir(group_id), f"{date_str}.wal")
+        try:
+            lines = "".join(json.dumps(m, ensure_ascii=False, default=_json_default) + "\n" for m in messages)
+            # 本进程首次写入某个已存在的日志时，统计上次运行遗留的记录数；
+            # 若上次崩溃留下了不完整的末行，先补换行，避免新记录与残行拼接在一起被一并丢弃
+            existing = 0
+            first_write = path not in self._wal_checked
+            if first_write and os.path.exists(path) and os.path.getsize(path) > 0:
+                last = b"\n"
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        existing += chunk.count(b"\n")
+                        last = chunk[-1:]
+                if last != b"\n":
+                    lines = "\n" + lines
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            if first_write:
+                self._wal_checked.add(path)
+            return existing
+        except Exception as e:
+            logger.error(f"[Memory Reboot] 追加日志失败: {e}")
+            return None
+
+    @staticmethod
+    def _read_log_file(path: str) -> List[Dict]:
+        """读取追加日志，跳过崩溃时可能残留的不完整末行"""
+        messages = []
+        if not os.path.exists(path):
+            return messages
+        with open(path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    messages.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"[Memory Reboot] 跳过损坏的日志行 {path}:{line_no}")
+        return messages
+
+    def _day_file_lock(self, group_dir: str, date_str: str) -> threading.Lock:
+        """某群某天数据文件的锁（读取与合并该天日志时持有，可在任意线程中使用）"""
+        return self._day_file_locks[hash((group_dir, date_str)) % DAY_FILE_LOCK_STRIPES]
+
+    def _read_daily_messages(self, group_dir: str, date_str: str) -> List[Dict]:
+        """
+        读取某一天的完整消息：快照 + 当前日志 + 合并中的日志（按消息ID去重）
+
+        持有日文件锁，合并不会在读取快照与日志之间完成；日志改名（.wal → .wal.compacting）
+        不受锁约束，因此先读当前日志再读合并中的日志，改名前后读到的同一批记录按ID去重。
+        合并过程中若在替换快照后、删除日志前崩溃，同一条消息也会同时出现在快照和日志中。
+        """
+        messages = []
+        with self._day_file_lock(group_dir, date_str):
+            try:
+                messages.extend(self._read_snapshot(group_dir, date_str))
+            except Exception as e:
+                logger.error(f"[Memory Reboot] 读取快照失败 {group_dir} {date_str}: {e}")
+
+            for suffix in (".wal", ".wal.compacting"):
+                path = os.path.join(group_dir, f"{date_str}{suffix}")
+                try:
+                    messages.extend(self._read_log_file(path))
+                except Exception as e:
+                    logger.error(f"[Memory Reboot] 读取追加日志失败 {path}: {e}")
+
+        return self._dedupe_messages(messages)
+
+    @staticmethod
+    def _dedupe_messages(messages: List[Dict]) -> List[Dict]:
+        """按消息ID去重（保留首次出现的记录，无ID的旧数据全部保留）"""
+        seen, unique = set(), []
+        for msg in messages:
+            msg_id = msg.get("id")
+            if msg_id:
+                if msg_id in seen:
+                    continue
+                seen.add(msg_id)
+            unique.append(msg)
+        return unique
+
+    def _compact_leftover_logs(self, group_id: str, dates: List[str]):
+        """
+        合并加载时发现的往日遗留日志
+
+        该日期可能仍有一批写入在线程池中进行（如淘汰后重新加载），先取得写盘锁再改名日志；
+        无事件循环时写入都是同步的，直接合并。
+        """
+        if not dates:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            for date_str in dates:
+                self._schedule_compaction(group_id, date_str)
+            return
+
+        async def _rotate():
+            async with self._flush_lock:
+                for date_str in dates:
+                    self._schedule_compaction(group_id, date_str)
+
+        task = loop.create_task(_rotate())
+        self._rotation_tasks.add(task)
+        task.add_done_callback(self._rotation_tasks.discard)
+
+    def _schedule_compaction(self, group_id: str, date_str: str):
+        """
+        将指定日期的追加日志合并进快照（后台线程执行）
+
+        日志改名在事件循环线程中完成，调用方须持有 _flush_lock（或没有事件循环），
+        与 _append_to_log 的写入串行，保证改名后不会再有记录写进待合并的文件；合并本身在线程池中执行。
+        """
+        key = (group_id, date_str)
+        if key in self._compactions:
+            return
+        group_dir = os.path.join(self.data_dir, group_id)
+        wal_path = os.path.join(group_dir, f"{date_str}.wal")
+        compacting_path = wal_path + ".compacting"
+
+        # 上次合并若中途退出会留下 .compacting，先合并它，当前日志留待下一轮
+        if not os.path.exists(compacting_path):
+            if not os.path.exists(wal_path):
+                return
+            try:
+                os.replace(wal_path, compacting_path)
+            except Exception as e:
+                logger.error(f"[Memory Reboot] 日志轮转失败: {e}")
+                return
+        self._wal_counts.pop(key, None)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._compact_daily_log(group_dir, date_str)
+            return
+
+        fut = loop.run_in_executor(None, self._compact_daily_log, group_dir, date_str)
+        self._compactions[key] = fut
+        fut.add_done_callback(lambda _: self._compactions.pop(key, None))
+
+    def _compact_daily_log(self, group_dir: str, date_str: str):
+        """合并快照与 .wal.compacting 为新快照，然后删除已合并的日志（可在线程池中运行，持有日文件锁）"""
+        with self._day_file_lock(group_dir, date_str):
+            compacting_path = os.path.join(group_dir, f"{date_str}.wal.compacting")
+            if not os.path.exists(compacting_path):
+                return
+            try:
+                messages = self._read_snapshot(group_dir, date_str)
+                messages.extend(self._read_log_file(compacting_path))
+
+                unique = self._dedupe_messages(messages)
+                unique.sort(key=lambda x: x.get("timestamp", 0))
+
+                # 群目录已被擦除时不再重建
+                if not os.path.isdir(group_dir):
+                    return
+                self._write_snapshot(group_dir, date_str, unique)
+                os.remove(compacting_path)
+                logger.debug(f"[Memory Reboot] 已合并日志 {group_dir} {date_str}: {len(unique)}条")
+            except Exception as e:
+                logger.error(f"[Memory Reboot] 合并日志失败 {compacting_path}: {e}")
     
-    def _write_daily_messages(self, group_id: str, date_str: str, messages: List[Dict]):
-        """将消息写入指定日期的文件"""
-        path = os.path.join(self._get_group_dir(group_id), f"{date_str}.json.gz")
+    def _read_snapshot(self, group_dir: str, date_str: str) -> List[Dict]:
+        """
+        读取某一天的快照，兼容两种格式:
+
+        - json: {date}.json.gz，消息列表（embedding 为浮点数列表）
+        - npy:  {date}.meta.json.gz 保存不含向量的元数据，向量按行存入其引用的
+                {date}.<版本>.emb.npy（float32，开启 storage_float16 时为 float16）。向量文件以 mmap 方式打开，
+                消息的 embedding 是内存映射数组的行视图，冷启动无需解析和拷贝浮点数。
+
+        切换格式时若两种快照同时存在（写入新格式后、删除旧格式前退出），以较新的为准。
+        调用方应持有日文件锁；若元数据引用的向量文件在读取期间被替换删除，重新读取一次元数据。
+        """
+        meta_path = os.path.join(group_dir, f"{date_str}.meta.json.gz")
+        json_path = os.path.join(group_dir, f"{date_str}.json.gz")
+        has_meta, has_json = os.path.exists(meta_path), os.path.exists(json_path)
+
+        if has_meta and (not has_json or os.path.getmtime(meta_path) >= os.path.getmtime(json_path)):
+            for attempt in range(2):
+                with gzip.open(meta_path, "rt", encoding="utf-8") as f:
+                    meta = json.load(f)
+                messages = meta.get("messages", [])
+                emb_file = meta.get("emb_file")
+                if not emb_file:
+                    return messages
+                try:
+                    embeddings = np.load(os.path.join(group_dir, emb_file), mmap_mode="r")
+                    break
+                except FileNotFoundError:
+                    if attempt:
+                        raise
+            for msg in messages:
+                row = msg.pop("emb_row", None)
+                if row is not None:
+                    msg["embedding"] = embeddings[row]
+            return messages
+
+        if has_json:
+            with gzip.open(json_path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        return []
+
+    def _write_snapshot(self, group_dir: str, date_str: str, messages: List[Dict]):
+        """
+        按配置的 storage_format 原子地写入一天的快照，并删除另一种格式的旧快照，失败时抛出异常
+
+        npy 格式的向量文件名带随机版本号：先写新向量文件，再替换元数据（提交点），
+        最后删除旧向量文件，任何时刻元数据引用的向量文件都是完整的。调用方须持有日文件锁，
+        删除旧向量文件时不会有读盘线程仍持有旧元数据。
+        """
+        meta_path = os.path.join(group_dir, f"{date_str}.meta.json.gz")
+        json_path = os.path.join(group_dir, f"{date_str}.json.gz")
+        storage_format = self.config.get("storage_format", DEFAULT_STORAGE_FORMAT)
+
+        if storage_format == "npy":
+            emb_file = self._write_columnar_snapshot(group_dir, date_str, meta_path, messages)
+            stale = [json_path]
+        else:
+            emb_file = None
+            self._atomic_write_json_gz(json_path, messages)
+            stale = [meta_path]
+
+        # 删除旧格式快照和不再引用的向量文件（Windows 上仍被映射的文件删除失败时留待下次）
+        prefix = f"{date_str}."
+        stale += [os.path.join(group_dir, f) for f in os.listdir(group_dir)
+                  if f.startswith(prefix) and f.endswith(".emb.npy") and f != emb_file]
+        for path in stale:
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.debug(f"[Memory Reboot] 删除旧快照文件失败 {path}: {e}")
+
+    def _write_columnar_snapshot(self, group_dir: str, date_str: str, meta_path: str,
+                                 messages: List[Dict]) -> Optional[str]:
+        """写入 npy 格式快照，返回向量文件名（当天没有向量时为 None）"""
+        # 以当天最常见的维度作为列式存储的维度，其余维度（更换模型前的旧数据）内联保存
+        dim_counts: Dict[int, int] = {}
+        for msg in messages:
+            emb = msg.get("embedding")
+            if emb is not None and len(emb) > 0:
+                dim_counts[len(emb)] = dim_counts.get(len(emb), 0) + 1
+        dim = max(dim_counts, key=dim_counts.get) if dim_counts else 0
+
+        rows, meta_messages = [], []
+        for msg in messages:
+            record = dict(msg)
+            emb = record.pop("embedding", None)
+            if emb is not None and len(emb) == dim:
+                record["emb_row"] = len(rows)
+                rows.append(emb)
+            elif emb is not None and len(emb) > 0:
+                record["embedding"] = emb
+            meta_messages.append(record)
+
+        emb_file = None
+        if rows:
+            emb_file = f"{date_str}.{uuid.uuid4().hex[:8]}.emb.npy"
+            emb_path = os.path.join(group_dir, emb_file)
+            tmp_path = emb_path + ".tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    dtype = np.float16 if self.config.get("storage_float16", False) else np.float32
+                    np.save(f, np.asarray(rows, dtype=dtype))
+                os.replace(tmp_path, emb_path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    try: os.remove(tmp_path)
+                    except: pass
+                raise
+
+        self._atomic_write_json_gz(meta_path, {"emb_file": emb_file, "messages": meta_messages})
+        return emb_file
+
+    @staticmethod
+    def _atomic_write_json_gz(path: str, data):
+        """先写临时文件再替换，保证读到的文件总是完整的"""
         tmp_path = path + ".tmp"
-        
         try:
             with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
-                json.dump(messages, f, ensure_ascii=False)
+                json.dump(data, f, ensure_ascii=False, default=_json_default)
             os.replace(tmp_path, path)
-        except Exception as e:
-            logger.error(f"[Memory Reboot] 写入失败: {e}")
+        except Exception:
             if os.path.exists(tmp_path):
                 try: os.remove(tmp_path)
                 except: pass
+            raise
     
     def _flush_cache(self, group_id: str):
-        """强制将缓存写入磁盘（用于关闭前或手动保存）"""
+        """强制将群组的全部追加日志合并进快照（用于关闭前或手动保存，同步执行）"""
         group_id = str(group_id)
-        if group_id not in self._cache:
-            return
-        
-        messages = self._cache[group_id]["messages"]
-        if not messages:
+        group_dir = os.path.join(self.data_dir, group_id)
+        if not os.path.isdir(group_dir):
             return
         
-        # 按日期分组写入
-        grouped = {}
-        for msg in messages:
-            date_str = datetime.datetime.fromtimestamp(msg.get("timestamp", 0)).strftime("%Y-%m-%d")
-            if date_str not in grouped:
-                grouped[date_str] = []
-            grouped[date_str].append(msg)
-        
-        for date_str, day_msgs in grouped.items():
-            self._write_daily_messages(group_id, date_str, day_msgs)
+        dates = {f[:-len(".wal")] for f in os.listdir(group_dir) if f.endswith(".wal")}
+        dates |= {f[:-len(".wal.compacting")] for f in os.listdir(group_dir) if f.endswith(".wal.compacting")}
+        for date_str in sorted(dates):
+            # 两轮：第一轮可能只处理了遗留的 .compacting，第二轮处理当前日志
+            wal_path = os.path.join(group_dir, f"{date_str}.wal")
+            for _ in range(2):
+                self._compact_daily_log(group_dir, date_str)
+                # 合并失败时 .compacting 仍在，不能用当前日志覆盖它
+                if not os.path.exists(wal_path) or os.path.exists(wal_path + ".compacting"):
+                    break
+                os.replace(wal_path, wal_path + ".compacting")
+            self._wal_counts.pop((group_id, date_str), None)
         
-        logger.debug(f"[Memory Reboot] 已将群 {group_id} 的 {len(messages)} 条消息写入磁盘")
+        if dates:
+            logger.debug(f"[Memory Reboot] 已将群 {group_id} 的 {len(dates)} 天追加日志合并进快照")
     
-    def _cleanup_messages(self, messages: List[Dict]) -> List[Dict]:
+    def _cleanup_messages(self, messages: List[MessageRecord]) -> List[MessageRecord]:
         """
         清理过期消息
         
@@ -699,10 +2789,10 @@ class MemoryRebootPlugin(Star):
         cutoff = now - retention_days * 86400
         
         # 快速检查：如果最老的消息都没过期，直接返回
-        if messages[0].get("timestamp", 0) > cutoff:
+        if messages[0].timestamp > cutoff:
             return messages
         
-        return [m for m in messages if m.get("timestamp", 0) > cutoff]
+        return [m for m in messages if m.timestamp > cutoff]
     
     def _cleanup_image_cache(self, group_id: str):
         """
@@ -756,8 +2846,7 @@ class MemoryRebootPlugin(Star):
         """
         获取文本的Embedding向量
 
-        通过AstrBot provider调用embedding服务。
-        优先使用 get_all_embedding_providers() 获取嵌入提供商。
+        先查询 Embedding 结果缓存（内存LRU，可选持久层），未命中时才调用embedding服务。
 
         Args:
             text: 要编码的文本
@@ -770,32 +2859,174 @@ class MemoryRebootPlugin(Star):
             logger.debug("[Memory Reboot] Embedding: 未配置provider_id")
             return None
 
+        cache = self._get_embedding_cache()
+        if cache is None:
+            return await self._request_embedding(provider_id, text)
+
+        key = EmbeddingCache.make_key(provider_id, text)
+        vector = cache.get(key)
+        if vector is None and cache.persistent:
+            loop = asyncio.get_running_loop()
+            found = await loop.run_in_executor(None, cache.load_from_disk, key)
+            if found is not None:
+                stored_at, vector = found
+                cache.put(key, vector, stored_at)
+                cache.disk_hits += 1
+        if vector is not None:
+            logger.debug("[Memory Reboot] Embedding: 命中缓存")
+            return vector.tolist()
+
+        cache.misses += 1
+        embedding = await self._request_embedding(provider_id, text)
+        if embedding:
+            vector = np.asarray(embedding, dtype=np.float32)
+            stored_at = time.time()
+            cache.put(key, vector, stored_at)
+            if cache.persistent:
+                self._track_background_save(
+                    asyncio.get_running_loop().run_in_executor(None, cache.save_to_disk, key, stored_at, vector))
+        return embedding
+
+    def _track_background_save(self, future: asyncio.Future):
+        """登记一次后台保存，terminate 会等待其完成后再关闭数据库等资源"""
+        self._background_saves.add(future)
+        future.add_done_callback(self._background_saves.discard)
+
+    def _get_embedding_cache(self) -> Optional[EmbeddingCache]:
+        """懒加载 Embedding 结果缓存；embedding_cache_size 为0时返回None"""
+        if self._embedding_cache is None:
+            size = int(self.config.get("embedding_cache_size", DEFAULT_EMBEDDING_CACHE_SIZE))
+            if size <= 0:
+                return None
+            db_path = None
+            if self.config.get("embedding_cache_persistent", False):
+                db_path = os.path.join(self.data_dir, EMBEDDING_CACHE_FILENAME)
+            self._embedding_cache = EmbeddingCache(
+                size, float(self.config.get("embedding_cache_ttl_seconds", DEFAULT_EMBEDDING_CACHE_TTL)), db_path)
+        return self._embedding_cache
+
+    async def _request_embedding(self, provider_id: str, text: str) -> Optional[List[float]]:
+        """
+        请求单条文本的向量（微批处理）
+
+        在 embedding_batch_window_ms 窗口内到达的请求（或累计满 embedding_batch_max_size 条）
+        合并为一次 get_embeddings 调用，结果再分发给各自的等待者；窗口为0时直接请求。
+        """
+        window_ms = self.config.get("embedding_batch_window_ms", DEFAULT_EMBEDDING_BATCH_WINDOW_MS)
+        if window_ms <= 0:
+            return (await self._request_embeddings(provider_id, [text]))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._embedding_batches.setdefault(provider_id, [])
+        batch.append((text, future))
+        max_size = max(1, int(self.config.get("embedding_batch_max_size", DEFAULT_EMBEDDING_BATCH_MAX_SIZE)))
+        if len(batch) >= max_size:
+            self._dispatch_embedding_batch(provider_id)
+        elif len(batch) == 1:
+            self._embedding_batch_timers[provider_id] = loop.call_later(
+                window_ms / 1000, self._dispatch_embedding_batch, provider_id)
+        return await future
+
+    def _dispatch_embedding_batch(self, provider_id: str):
+        """取出该提供商当前积攒的请求并发起批量调用"""
+        timer = self._embedding_batch_timers.pop(provider_id, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._embedding_batches.pop(provider_id, None)
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run_embedding_batch(provider_id, batch))
+        self._embedding_batch_tasks.add(task)
+        task.add_done_callback(self._embedding_batch_tasks.discard)
+
+    async def _run_embedding_batch(self, provider_id: str, batch: List[Tuple[str, asyncio.Future]]):
+        """执行一批embedding请求，相同文本只请求一次"""
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        if len(batch) > 1:
+            logger.debug(f"[Memory Reboot] 合并Embedding请求: {len(batch)}条 -> {len(texts)}条文本")
         try:
-            provider = None
+            results = await self._request_embeddings(provider_id, texts)
+        except Exception as e:
+            logger.error(f"[Memory Reboot] 批量获取embedding失败: {e}")
+            results = [None] * len(texts)
+        by_text = dict(zip(texts, results))
+        for text, future in batch:
+            # 等待者可能已被取消
+            if not future.done():
+                future.set_result(by_text.get(text))
 
-            # 优先从嵌入提供商列表中查找
-            if hasattr(self.context, 'get_all_embedding_providers'):
-                all_providers = self.context.get_all_embedding_providers()
-                # 先尝试ID精确匹配
-                for p in all_providers:
-                    if hasattr(p, 'id') and p.id == provider_id:
-                        provider = p
-                        break
-                # 如果ID匹配失败，尝试名称匹配
-                if not provider:
-                    for p in all_providers:
-                        if hasattr(p, 'meta') and hasattr(p.meta, 'name'):
-                            if p.meta.name == provider_id:
-                                provider = p
-                                break
-
-            # 回退到通用方法
+    async def _request_embeddings(self, provider_id: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        调用embedding服务获取一组文本的向量
+
+        首次调用时解析嵌入提供商及可用的嵌入方法并记住，之后直接调用；
+        提供商ID变更或已记住的方法调用失败时重新解析。
+
+        Returns:
+            与 texts 一一对应的向量列表，失败的项为None
+        """
+        resolved = self._embedding_method
+        if resolved is not None and resolved[0] == provider_id:
+            try:
+                result = await self._call_embedding_method(resolved[1], resolved[2], texts)
+                if result is not None:
+                    return result
+            except Exception as e:
+                logger.debug(f"[Memory Reboot] 嵌入方法调用失败，重新解析提供商: {e}")
+        self._embedding_method = None
+        return await self._resolve_and_request_embeddings(provider_id, texts)
+
+    async def _call_embedding_method(self, method, is_batch: bool, texts: List[str]) -> Optional[List[Optional[List[float]]]]:
+        """
+        调用嵌入方法：批量接口一次请求全部文本，单条接口并发逐条调用
+
+        Returns:
+            与 texts 一一对应的向量列表；结果为空或条数不符时返回None
+        """
+        if is_batch:
+            result = await method(list(texts))
+            if result and len(result) == len(texts):
+                return list(result)
+            return None
+        singles = await asyncio.gather(*(method(text) for text in texts))
+        if any(singles):
+            return [(r if isinstance(r, list) else list(r)) if r else None for r in singles]
+        return None
+
+    def _find_embedding_provider(self, provider_id: str):
+        """按ID或名称查找嵌入提供商，优先使用 get_all_embedding_providers()"""
+        provider = None
+
+        # 优先从嵌入提供商列表中查找
+        if hasattr(self.context, 'get_all_embedding_providers'):
+            all_providers = self.context.get_all_embedding_providers()
+            # 先尝试ID精确匹配
+            for p in all_providers:
+                if hasattr(p, 'id') and p.id == provider_id:
+                    provider = p
+                    break
+            # 如果ID匹配失败，尝试名称匹配
             if not provider:
-                provider = self.context.get_provider_by_id(provider_id)
+                for p in all_providers:
+                    if hasattr(p, 'meta') and hasattr(p.meta, 'name'):
+                        if p.meta.name == provider_id:
+                            provider = p
+                            break
+
+        # 回退到通用方法
+        if not provider:
+            provider = self.context.get_provider_by_id(provider_id)
+        return provider
 
+    async def _resolve_and_request_embeddings(self, provider_id: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """查找提供商并依次尝试各嵌入方法，记住第一个调用成功的方法"""
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        try:
+            provider = self._find_embedding_provider(provider_id)
             if not provider:
                 logger.debug(f"[Memory Reboot] 未找到嵌入提供商: {provider_id}")
-                return None
+                return results
 
             # 尝试多种嵌入方法
             methods = ['get_embeddings', 'embeddings', 'embedding', 'get_embedding']
@@ -803,15 +3034,13 @@ class MemoryRebootPlugin(Star):
             for method_name in methods:
                 if hasattr(provider, method_name):
                     method = getattr(provider, method_name)
+                    is_batch = method_name in ['get_embeddings', 'embeddings']
                     try:
-                        if method_name in ['get_embeddings', 'embeddings']:
-                            result = await method([text])
-                            if result and len(result) > 0:
-                                return result[0]
-                        else:
-                            result = await method(text)
-                            if result:
-                                return result if isinstance(result, list) else list(result)
+                        result = await self._call_embedding_method(method, is_batch, texts)
+                        if result is not None:
+                            self._embedding_method = (provider_id, method, is_batch)
+                            logger.debug(f"[Memory Reboot] 已解析嵌入方法: {provider_id}.{method_name}")
+                            return result
                     except Exception as e:
                         last_error = e
                         logger.debug(f"[Memory Reboot] 方法 {method_name} 调用失败: {e}")
@@ -823,34 +3052,7 @@ class MemoryRebootPlugin(Star):
         except Exception as e:
             logger.error(f"[Memory Reboot] 获取embedding失败: {e}")
 
-        return None
-    
-    def _cosine_similarity(self, v1: List[float], v2: List[float]) -> float:
-        """
-        计算两个向量的余弦相似度
-        
-        余弦相似度公式: cos(θ) = (A·B) / (|A| × |B|)
-        
-        余弦相似度的特点:
-        - 值域为 [-1, 1]
-        - 1 表示向量方向完全相同（最相似）
-        - 0 表示向量正交（无关）
-        - -1 表示向量方向完全相反
-        
-        Args:
-            v1: 向量1
-            v2: 向量2
-            
-        Returns:
-            相似度值，范围 [-1, 1]
-        """
-        # 参数校验
-        if not v1 or not v2 or len(v1) != len(v2):
-            return 0.0
-        
-        a, b = np.array(v1), np.array(v2)
-        # 添加极小值1e-9避免除零错误
-        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-9))
+        return results
     
     # ==========================================================================
     # 4.6 图片处理方法
@@ -863,7 +3065,10 @@ class MemoryRebootPlugin(Star):
         group_id: str
     ) -> Tuple[Optional[str], Optional[str]]:
         """
-        下载图片并缓存到本地，同时计算感知哈希
+        下载图片并计算感知哈希，按配置缓存到本地
+        
+        图片以流式下载到内存（超过 max_image_size_mb 时提前中止），直接从内存计算哈希；
+        仅在开启 save_image_cache 时才写入缓存目录。
         
         Args:
             url: 图片的URL地址
@@ -871,13 +3076,25 @@ class MemoryRebootPlugin(Star):
             group_id: 群组ID（用于分目录存储）
             
         Returns:
-            元组 (缓存文件路径, 图片哈希值)
+            元组 (缓存文件路径, 图片哈希值)，未保存文件时路径为None
             如果下载或处理失败，返回 (None, None)
         """
         try:
+            # 异步下载图片
+            data = await self._download_image(url)
+            if data is None:
+                return None, None
+            
+            # 直接从内存计算图片的感知哈希
+            image_hash = await self._hash_image_bytes(data)
+            if image_hash:
+                logger.debug(f"[Memory Reboot] 图片哈希: {image_hash}")
+            
+            if not self.config.get("save_image_cache", True):
+                return None, image_hash
+            
             # 创建群组专属的缓存目录
             cache_dir = os.path.join(self.plugin_dir, "image_cache", group_id)
-            os.makedirs(cache_dir, exist_ok=True)
             
             # 生成文件名: 20260202_041900_123456.jpg
             dt = datetime.datetime.fromtimestamp(timestamp)
@@ -885,155 +3102,440 @@ class MemoryRebootPlugin(Star):
             filename = dt.strftime("%Y%m%d_%H%M%S") + f"_{int((timestamp % 1) * 1000000)}.jpg"
             filepath = os.path.join(cache_dir, filename)
             
-            # 异步下载图片
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        with open(filepath, "wb") as f:
-                            f.write(await response.read())
-                        logger.debug(f"[Memory Reboot] 图片缓存成功: {filename}")
-                        
-                        # 计算图片的感知哈希
-                        image_hash = self._compute_image_hash(filepath)
-                        if image_hash:
-                            logger.debug(f"[Memory Reboot] 图片哈希: {image_hash}")
-                        
-                        return filepath, image_hash
-                        
+            def _write():
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(filepath, "wb") as f:
+                    f.write(data)
+            
+            await asyncio.get_running_loop().run_in_executor(None, _write)
+            logger.debug(f"[Memory Reboot] 图片缓存成功: {filename}")
+            return filepath, image_hash
+                
         except Exception as e:
             logger.error(f"[Memory Reboot] 图片缓存失败: {e}")
         
         return None, None
     
-    def _compute_image_hash(self, image_path: str) -> Optional[str]:
+    def _get_http_session(self):
         """
-        计算图片的感知哈希值（Difference Hash / dHash算法）
+        懒加载图片下载共享会话
+
+        所有下载复用同一个连接池（DNS缓存、keep-alive），
+        连接数上限、单主机并发上限与超时取自配置。
         """
-        if HAS_PIL:
-            try:
-                img = PILImage.open(image_path)
-                # 使用17x16尺寸，宽度多1用于计算差值，生成16x16=256位哈希
-                img = img.convert('L').resize((17, 16), PILImage.Resampling.LANCZOS)
-                pixels = list(img.getdata())
-                
-                # dHash：比较相邻像素差异
-                bits = []
-                for row in range(16):
-                    for col in range(16):
-                        left_pixel = pixels[row * 17 + col]
-                        right_pixel = pixels[row * 17 + col + 1]
-                        bits.append('1' if left_pixel > right_pixel else '0')
-                
-                # 256位 = 64个十六进制字符
-                hash_value = hex(int(''.join(bits), 2))[2:].zfill(64)
-                return hash_value
-            except Exception as e:
-                logger.error(f"[Memory Reboot] 计算图片dHash失败: {e}")
-                return None
-        else:
-            logger.debug("[Memory Reboot] PIL未安装，使用MD5哈希")
-            return self._compute_file_md5(image_path)
+        if self._http_session is None or self._http_session.closed:
+            total = float(self.config.get("http_timeout_seconds", DEFAULT_HTTP_TIMEOUT_SECONDS))
+            connector = aiohttp.TCPConnector(
+                limit=int(self.config.get("http_pool_limit", DEFAULT_HTTP_POOL_LIMIT)),
+                limit_per_host=int(self.config.get("http_per_host_limit", DEFAULT_HTTP_PER_HOST_LIMIT)),
+                ttl_dns_cache=HTTP_DNS_CACHE_SECONDS,
+            )
+            timeout = aiohttp.ClientTimeout(total=total, connect=min(HTTP_CONNECT_TIMEOUT_SECONDS, total))
+            self._http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._http_session
+
+    async def _download_image(self, url: str) -> Optional[bytes]:
+        """
+        通过共享会话流式下载图片并记录耗时
+
+        响应头声明或实际读取的大小超过 max_image_size_mb 时立即中止，不再读取剩余数据。
+        非200响应、超限、超时或出错时返回None。
+        """
+        start = time.perf_counter()
+        ok = False
+        max_bytes = int(float(self.config.get("max_image_size_mb", DEFAULT_MAX_IMAGE_SIZE_MB)) * 1024 * 1024)
+        try:
+            async with self._get_http_session().get(url) as response:
+                if response.status != 200:
+                    logger.debug(f"[Memory Reboot] 图片下载失败: HTTP {response.status}")
+                    return None
+                if max_bytes > 0 and (response.content_length or 0) > max_bytes:
+                    logger.info(f"[Memory Reboot] 跳过过大图片: {response.content_length}字节 > {max_bytes}字节")
+                    return None
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(IMAGE_DOWNLOAD_CHUNK_SIZE):
+                    buffer.extend(chunk)
+                    if max_bytes > 0 and len(buffer) > max_bytes:
+                        logger.info(f"[Memory Reboot] 跳过过大图片: 已超过{max_bytes}字节，中止下载")
+                        return None
+                ok = True
+                return bytes(buffer)
+        except asyncio.TimeoutError:
+            logger.warning(f"[Memory Reboot] 图片下载超时: {url[:80]}")
+        except Exception as e:
+            logger.error(f"[Memory Reboot] 图片下载失败: {e}")
+        finally:
+            self._download_stats.record((time.perf_counter() - start) * 1000, ok)
+        return None
+
+    async def _hash_image_url(self, url: str) -> Optional[str]:
+        """下载图片并在内存中计算哈希（不写入图片缓存目录）"""
+        data = await self._download_image(url)
+        if data is None:
+            return None
+        return await self._hash_image_bytes(data)
+
+    def _collect_image_urls(self, event: AstrMessageEvent, include_reply: bool = True) -> List[str]:
+        """收集消息中的图片URL，include_reply 为True时包括所引用消息中的图片"""
+        urls = []
+        if hasattr(event, "message_obj") and event.message_obj:
+            for comp in event.message_obj.message:
+                if isinstance(comp, Reply):
+                    images = (getattr(comp, "chain", None) or []) if include_reply else []
+                else:
+                    images = [comp]
+                for img in images:
+                    if isinstance(img, Image):
+                        url = getattr(img, "url", None) or getattr(img, "file", None)
+                        if url:
+                            urls.append(url)
+        return urls
     
-    def _compute_file_md5(self, file_path: str) -> Optional[str]:
-        """计算文件的MD5哈希（后备方案）"""
+    async def _hash_image_bytes(self, data: bytes) -> Optional[str]:
+        """
+        从内存中的图片数据计算感知哈希（无需先写盘）
+
+        解码与缩放在 image_hash_executor 指定的线程池/进程池中执行，不阻塞事件循环；
+        进程池不可用时自动回退到线程池。
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_hash_executor()
         try:
-            with open(file_path, 'rb') as f:
-                return hashlib.md5(f.read()).hexdigest()
+            try:
+                return await loop.run_in_executor(executor, hash_image_bytes, data)
+            except (BrokenProcessPool, pickle.PicklingError, AttributeError) as e:
+                if executor is None:
+                    raise
+                logger.warning(f"[Memory Reboot] 图片哈希进程池不可用，回退到线程池: {e}")
+                self._hash_process_pool_failed = True
+                self._shutdown_hash_executor()
+                return await loop.run_in_executor(None, hash_image_bytes, data)
         except Exception as e:
-            logger.error(f"[Memory Reboot] 计算MD5失败: {e}")
+            logger.error(f"[Memory Reboot] 计算图片dHash失败: {e}")
             return None
-    
-    def _hash_similarity(self, hash1: str, hash2: str) -> float:
-        """计算两个哈希值的相似度（基于汉明距离）"""
-        if not hash1 or not hash2 or len(hash1) != len(hash2):
-            return 0.0
-        try:
-            bin1 = bin(int(hash1, 16))[2:].zfill(len(hash1) * 4)
-            bin2 = bin(int(hash2, 16))[2:].zfill(len(hash2) * 4)
-            diff = sum(c1 != c2 for c1, c2 in zip(bin1, bin2))
-            return 1.0 - (diff / len(bin1))
-        except Exception:
-            return 0.0
+
+    def _get_hash_executor(self) -> Optional[ProcessPoolExecutor]:
+        """返回图片哈希使用的执行器：配置为 process 时为懒加载的进程池，否则为None（默认线程池）"""
+        if self.config.get("image_hash_executor", DEFAULT_IMAGE_HASH_EXECUTOR) != "process" or \
+                self._hash_process_pool_failed:
+            return None
+        if self._hash_process_pool is None:
+            workers = max(1, int(self.config.get("image_hash_workers", DEFAULT_IMAGE_HASH_WORKERS)))
+            self._hash_process_pool = ProcessPoolExecutor(max_workers=workers)
+        return self._hash_process_pool
+
+    def _shutdown_hash_executor(self):
+        if self._hash_process_pool is not None:
+            self._hash_process_pool.shutdown(wait=False, cancel_futures=True)
+            self._hash_process_pool = None
     
     # ==========================================================================
     # 4.7 相似度匹配方法
     # ==========================================================================
     
-    def _find_best_match(self, messages: List[Dict], embedding: List[float],
-                         threshold: float, exclude_recent: int = 0) -> Tuple[Optional[Dict], int, float]:
-        """查找最相似的历史消息（基于文本Embedding）"""
+    def _prepare_ann_index(self, matrix: EmbeddingMatrix):
+        """
+        按配置挂载/卸载ANN索引，并在需要时调度后台训练
+
+        训练在默认线程池中执行，完成后回到事件循环线程安装结果；
+        无运行中的事件循环时（如同步加载路径）直接同步训练。
+        """
+        if not self.config.get("ann_index_enabled", False):
+            matrix.ann = None
+            return
+
+        nprobe = self.config.get("ann_nprobe", DEFAULT_ANN_NPROBE)
+        min_size = self.config.get("ann_min_size", DEFAULT_ANN_MIN_SIZE)
+        ann = matrix.ann
+        if ann is None:
+            ann = matrix.ann = IVFIndex(matrix, nprobe, min_size)
+        else:
+            ann.nprobe, ann.min_size = max(1, int(nprobe)), max(1, int(min_size))
+
+        if not ann.needs_training():
+            return
+
+        job = ann.prepare_training()
+        ann.training = True
+        logger.info(f"[Memory Reboot] 开始训练ANN索引: {len(job['rows'])}条向量, 维度={job['dim']}")
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None:
+            try:
+                ann.finish_training(job, IVFIndex.run_training(job))
+            except Exception as e:
+                logger.error(f"[Memory Reboot] ANN索引训练失败: {e}")
+                ann.finish_training(job, None)
+            return
+
+        def _on_done(fut):
+            try:
+                ann.finish_training(job, fut.result())
+                logger.info(f"[Memory Reboot] ANN索引训练完成: {len(ann.centroids)}个聚类")
+            except Exception as e:
+                logger.error(f"[Memory Reboot] ANN索引训练失败: {e}")
+                ann.finish_training(job, None)
+
+        loop.run_in_executor(None, IVFIndex.run_training, job).add_done_callback(_on_done)
+
+    def _evaluate_ann_recall(self, matrix: EmbeddingMatrix, threshold: float,
+                             samples: int = 100) -> Optional[Dict]:
+        """
+        以精确扫描为基准评估ANN索引的召回率
+
+        从已索引的向量中随机抽取 samples 条作为查询（排除自身），统计:
+            - top1_recall: 精确最近邻出现在ANN候选中的比例
+            - threshold_recall: 超过阈值的精确近邻被ANN候选覆盖的比例
+            - scan_ratio: ANN候选行数占全部行数的平均比例
+            - exact_ms / ann_ms: 单次查询平均耗时
+
+        Returns:
+            评估结果字典；索引未启用或未训练时返回 None
+        """
+        ann = matrix.ann
+        if ann is None or not ann.is_trained:
+            return None
+
+        rows = matrix.rows_of_dim(ann.dim)
+        if len(rows) < 2:
+            return None
+        rng = np.random.default_rng()
+        queries = rng.choice(rows, min(samples, len(rows)), replace=False)
+        block = matrix.block(ann.dim)
+
+        top1_hits, exact_total, ann_hits, scanned = 0, 0, 0, 0
+        exact_time, ann_time = 0.0, 0.0
+        for row in queries:
+            query = block[row]
+
+            start = time.perf_counter()
+            exact_sims = block[:matrix.size] @ query
+            exact_time += time.perf_counter() - start
+            exact_sims[row] = -np.inf
+            exact_best = int(np.argmax(exact_sims))
+            exact_above = set(np.flatnonzero(exact_sims >= threshold).tolist())
+
+            start = time.perf_counter()
+            cand = ann.candidates(query)
+            _ = block[cand] @ query
+            ann_time += time.perf_counter() - start
+            cand_set = set(cand.tolist())
+            cand_set.discard(int(row))
+
+            top1_hits += exact_best in cand_set
+            exact_total += len(exact_above)
+            ann_hits += len(exact_above & cand_set)
+            scanned += len(cand_set)
+
+        n = len(queries)
+        return {
+            "queries": n,
+            "top1_recall": top1_hits / n,
+            "threshold_recall": ann_hits / exact_total if exact_total else 1.0,
+            "threshold_pairs": exact_total,
+            "scan_ratio": scanned / n / matrix.size,
+            "exact_ms": exact_time / n * 1000,
+            "ann_ms": ann_time / n * 1000,
+        }
+
+    def _evaluate_quantization(self, matrix: EmbeddingMatrix, threshold: float,
+                               samples: int = 100) -> Optional[Dict]:
+        """
+        以全精度相似度为基准，评估 float16 / int8 量化在本群数据上的效果
+
+        从主维度的向量中随机抽取 samples 条作为查询（排除自身），对每种精度统计:
+            - top1_recall: 量化相似度的最近邻与全精度最近邻一致的比例
+            - max_error: 相似度的最大绝对误差
+            - flips: 不精排时，是否达到阈值的判断与全精度不一致的对数
+            - flips_after_rerank: 按误差上界精排后仍不一致的对数（应为0）
+            - rerank_ratio: 需要以全精度重算的行所占比例
+            - bytes_per_row: 每行常驻内存字节数（int8 含缩放系数）
+
+        Returns:
+            评估结果字典；向量不足2条时返回 None
+        """
+        dim = matrix.dominant_dim()
+        rows = matrix.rows_of_dim(dim) if dim else np.zeros(0, dtype=np.int64)
+        if len(rows) < 2:
+            return None
+        vecs = np.asarray(matrix.block(dim)[rows], dtype=np.float32)
+        rng = np.random.default_rng()
+        queries = rng.choice(len(rows), min(samples, len(rows)), replace=False)
+        exact_sims = []
+        for i in queries:
+            sims = vecs @ vecs[i]
+            sims[i] = np.nan  # 排除自身
+            exact_sims.append(sims)
+        pairs = len(queries) * (len(rows) - 1)
+
+        report = {"vectors": len(rows), "dim": dim, "queries": len(queries), "float32_bytes": 4 * dim,
+                  "threshold_pairs": int(sum(np.count_nonzero(sims >= threshold) for sims in exact_sims))}
+        for precision in EMBEDDING_PRECISIONS[1:]:
+            quantized, scales = EmbeddingMatrix.quantize(vecs, precision)
+            restored = quantized.astype(np.float32)
+            if scales is not None:
+                restored *= scales[:, None]
+            top1, max_error, flips, flips_after, reranked = 0, 0.0, 0, 0, 0
+            for i, exact in zip(queries, exact_sims):
+                approx = restored @ vecs[i]
+                approx[i] = np.nan
+                bound = EmbeddingMatrix.error_bound(precision, vecs[i], scales)
+                near = approx >= threshold - bound - QUANTIZED_RERANK_EPS
+                after = np.where(near, exact, approx)
+                exact_above = exact >= threshold
+
+                top1 += int(np.nanargmax(approx) == np.nanargmax(exact))
+                max_error = max(max_error, float(np.nanmax(np.abs(approx - exact))))
+                flips += int(np.count_nonzero((approx >= threshold) != exact_above))
+                flips_after += int(np.count_nonzero((after >= threshold) != exact_above))
+                reranked += int(np.count_nonzero(near))
+
+            report[precision] = {
+                "top1_recall": top1 / len(queries),
+                "max_error": max_error,
+                "flips": flips,
+                "flips_after_rerank": flips_after,
+                "rerank_ratio": reranked / pairs,
+                "bytes_per_row": dim + 4 if precision == "int8" else 2 * dim,
+            }
+        return report
+
+    def _stored_embedding(self, messages: List[MessageRecord], matrix: EmbeddingMatrix,
+                          rows: List[int], provider_id: str) -> Optional[List[float]]:
+        """
+        从矩阵中还原指定行里最近一条带向量的消息的Embedding（用于逐字复读时复用，避免再次请求嵌入服务）
+
+        只复用由当前嵌入提供商生成的向量；更换提供商后旧模型的向量不可混用，返回None时照常请求嵌入服务。
+        """
+        if not provider_id:
+            return None
+        for row in reversed(rows):
+            if row < matrix.size and messages[row].embedding_provider == provider_id:
+                emb = matrix.vector(row)
+                if emb is not None:
+                    return emb
+        return None
+
+    def _find_best_match(self, messages: List[MessageRecord], matrix: EmbeddingMatrix, embedding: List[float],
+                         threshold: float, sender_id: Optional[str] = None, min_senders: int = 0
+                         ) -> Tuple[Optional[MessageRecord], int, float, set]:
+        """
+        查找最相似的历史消息，并在同一次遍历中统计超过阈值的不同发送者（基于文本Embedding）
+
+        使用ANN索引时只在候选行中查找；找到匹配但候选行中的发送者不足 min_senders 时，
+        再对全部行精确统计一次，人数判断与精确扫描一致，ANN只影响能否找到匹配。
+
+        Args:
+            messages: 历史消息列表（不含当前消息）
+            matrix: 与 messages 逐行对应的Embedding矩阵
+            embedding: 当前消息的向量
+            threshold: 相似度阈值
+            sender_id: 当前消息的发送者ID（当前消息与自身相似度为1，计入发送者集合）
+            min_senders: 触发所需的不同发送者数（仅用于决定是否需要全量统计）
+
+        Returns:
+            元组 (匹配消息, 索引, 最高相似度, 发送者ID集合)，
+            未达阈值时匹配消息为None、索引为-1
+        """
         best_sim, best_msg, best_idx = 0.0, None, -1
-        search_range = len(messages) - exclude_recent if exclude_recent > 0 else len(messages)
-        skipped_no_emb, skipped_dim_mismatch = 0, 0
+        sender_ids = {sender_id} if sender_id and threshold <= 1.0 else set()
+        search_range = min(len(messages), matrix.size)
+        valid_count = matrix.count_valid()
+        skipped_no_emb = search_range - valid_count
+        skipped_dim_mismatch = valid_count - matrix.count_valid(len(embedding))
 
-        for i in range(search_range):
-            msg = messages[i]
-            emb = msg.get("embedding")
-            if not emb:
-                skipped_no_emb += 1
-                continue
-            if len(emb) != len(embedding):
-                skipped_dim_mismatch += 1
-                continue
+        # 启用ANN索引且已训练时，只对候选行精排；否则精确扫描全部行
+        rows = None
+        if matrix.ann is not None:
+            query = EmbeddingMatrix.normalize(embedding)
+            if query is not None:
+                rows = matrix.ann.candidates(query)
+            if rows is not None:
+                rows = rows[rows < search_range]
 
-            sim = self._cosine_similarity(embedding, emb)
+        sims = matrix.similarities(embedding, search_range, rows=rows, threshold=threshold)
+        if sims is not None and sims.size > 0:
+            row_ids = rows if rows is not None else np.arange(sims.size)
+            # argmax 返回首个最大值，与逐条比较时"严格大于才更新"的语义一致（候选行号为升序）
+            i = int(np.argmax(sims))
+            sim = float(sims[i])
             if sim > best_sim:
                 best_sim = sim
                 if sim >= threshold:
-                    best_msg, best_idx = msg, i
+                    best_idx = int(row_ids[i])
+                    best_msg = messages[best_idx]
+            for j in row_ids[sims >= threshold]:
+                msg_sender = messages[j].sender_id
+                if msg_sender:
+                    sender_ids.add(msg_sender)
+
+            # 候选行之外也可能有相似消息：已匹配但人数不足时全量统计，避免ANN少计人数
+            if rows is not None and best_msg is not None and len(sender_ids) < min_senders:
+                all_sims = matrix.similarities(embedding, search_range, threshold=threshold)
+                for j in np.flatnonzero(all_sims >= threshold) if all_sims is not None else ():
+                    msg_sender = messages[j].sender_id
+                    if msg_sender:
+                        sender_ids.add(msg_sender)
 
         # 只在有跳过的消息时记录
         if skipped_no_emb > 0 or skipped_dim_mismatch > 0:
             logger.debug(f"[Memory Reboot] 匹配统计: 跳过{skipped_no_emb}条无embedding, {skipped_dim_mismatch}条维度不匹配")
 
-        return best_msg, best_idx, best_sim
+        return best_msg, best_idx, best_sim, sender_ids
     
-    def _find_similar_image(self, messages: List[Dict], current_hash: str,
-                            threshold: float = DEFAULT_IMAGE_HASH_THRESHOLD, exclude_recent: int = 0) -> Tuple[Optional[Dict], int, float]:
-        """查找相似图片（基于图片哈希）"""
+    def _find_similar_image(self, messages: List[MessageRecord], hash_index: HashIndex, current_hash: str,
+                            threshold: float = DEFAULT_IMAGE_HASH_THRESHOLD, sender_id: Optional[str] = None
+                            ) -> Tuple[Optional[MessageRecord], int, float, set]:
+        """
+        查找相似图片，并在同一次遍历中统计超过阈值的不同发送者（基于图片哈希）
+
+        Args:
+            messages: 历史消息列表（不含当前消息）
+            hash_index: 与 messages 逐行对应的打包哈希矩阵
+            current_hash: 当前图片的十六进制哈希
+
+        其余参数与返回值同 _find_best_match。
+        """
         best_sim, best_msg, best_idx = 0.0, None, -1
-        search_range = len(messages) - exclude_recent if exclude_recent > 0 else len(messages)
-        
-        for i in range(search_range):
-            msg = messages[i]
-            msg_hash = msg.get("image_hash")
-            if not msg_hash:
-                continue
-            sim = self._hash_similarity(current_hash, msg_hash)
-            if sim > best_sim:
-                best_sim = sim
-                if sim >= threshold:
-                    best_msg, best_idx = msg, i
-        return best_msg, best_idx, best_sim
-    
-    def _count_unique_senders(self, messages: List[Dict], embedding: List[float],
-                               threshold: float = DEFAULT_SIMILARITY_THRESHOLD) -> Tuple[int, List[str]]:
-        """统计发送相似内容的不同用户数量"""
-        sender_ids = set()
-        for msg in messages:
-            emb = msg.get("embedding")
-            if emb and len(emb) == len(embedding) and self._cosine_similarity(embedding, emb) >= threshold:
-                if msg.get("sender_id"):
-                    sender_ids.add(msg.get("sender_id"))
-        return len(sender_ids), list(sender_ids)
-    
-    def _count_unique_senders_by_hash(self, messages: List[Dict], image_hash: str,
-                                       threshold: float = DEFAULT_IMAGE_HASH_THRESHOLD) -> Tuple[int, List[str]]:
-        """统计发送相似图片的不同用户数量"""
-        sender_ids = set()
-        for msg in messages:
-            msg_hash = msg.get("image_hash")
-            if msg_hash and self._hash_similarity(image_hash, msg_hash) >= threshold:
-                if msg.get("sender_id"):
-                    sender_ids.add(msg.get("sender_id"))
-        return len(sender_ids), list(sender_ids)
+        sender_ids = {sender_id} if sender_id and threshold <= 1.0 else set()
+
+        # 多索引哈希只返回达到阈值的行，未命中时 best_sim 记为0（仅影响日志）
+        found = hash_index.search(current_hash, threshold, min(len(messages), hash_index.size))
+        if found is not None and found[0].size > 0:
+            rows, sims = found
+            i = int(np.argmax(sims))
+            best_sim = float(sims[i])
+            best_idx = int(rows[i])
+            best_msg = messages[best_idx]
+            for j in rows:
+                msg_sender = messages[j].sender_id
+                if msg_sender:
+                    sender_ids.add(msg_sender)
+        return best_msg, best_idx, best_sim, sender_ids
     
-    def _get_context_around(self, messages: List[Dict], index: int, before: int = 40, after: int = 40) -> List[Dict]:
-        """获取指定消息前后的上下文"""
+    def _get_context_around(self, messages: List[MessageRecord], index: int, before: int = 40, after: int = 40,
+                            current: Optional[MessageRecord] = None) -> List[Dict]:
+        """
+        获取指定消息前后的上下文
+
+        Args:
+            messages: 历史消息列表
+            index: 中心消息索引
+            before / after: 前后各取多少条
+            current: 尚未追加到历史的当前消息，视为位于 messages 末尾（不复制历史列表）
+        """
+        total = len(messages) + (1 if current is not None else 0)
         start = max(0, index - before)
-        end = min(len(messages), index + after + 1)
-        return [{"sender_name": m.get("sender_name"), "content": m.get("content"), "timestamp": m.get("timestamp")} 
-                for m in messages[start:end]]
+        end = min(total, index + after + 1)
+        window = messages[start:min(end, len(messages))]
+        if current is not None and end > len(messages):
+            window.append(current)
+        return [{"sender_name": m.sender_name, "content": m.content, "timestamp": m.timestamp}
+                for m in window]
     
     # ==========================================================================
     # 4.8 时间格式化方法
@@ -1059,19 +3561,29 @@ class MemoryRebootPlugin(Star):
     # 4.9 LLM交互方法
     # ==========================================================================
     
-    async def _image_to_text(self, url: str) -> Optional[Tuple[str, str]]:
-        """使用LLM识别图片内容，返回(内容, 类型)或None（表情包）"""
+    def _get_vision_provider(self):
+        """获取视觉模型provider，未配置或未找到时返回None"""
         provider_id = self.config.get("vision_provider_id", "")
         if not provider_id:
             logger.debug("[Memory Reboot] 图片识别: 未配置vision_provider_id")
             return None
-        
         try:
             provider = self.context.get_provider_by_id(provider_id)
-            if not provider:
-                logger.debug(f"[Memory Reboot] 图片识别: 未找到provider={provider_id}")
-                return None
-            
+        except Exception as e:
+            logger.error(f"[Memory Reboot] 图片识别: 获取provider失败: {e}")
+            return None
+        if not provider:
+            logger.debug(f"[Memory Reboot] 图片识别: 未找到provider={provider_id}")
+            return None
+        return provider
+
+    async def _image_to_text(self, url: str) -> Optional[Tuple[str, str]]:
+        """使用LLM识别图片内容，返回(内容, 类型)，表情包的类型为"sticker"，识别失败返回None"""
+        provider = self._get_vision_provider()
+        if provider is None:
+            return None
+        
+        try:
             logger.debug(f"[Memory Reboot] 图片识别: 开始调用视觉模型...")
             
             prompt = self.config.get("vision_prompt") or self.DEFAULT_VISION_PROMPT
@@ -1099,20 +3611,20 @@ class MemoryRebootPlugin(Star):
                         is_sticker = True
                     
                     if is_sticker:
-                        return None
+                        return ("", "sticker")
                     
                     return (content, "content")
                     
                 except json.JSONDecodeError:
                     sticker_keywords = ["is_sticker\": true", "表情包", "emoji", "sticker", "熊猫头", "滑稽"]
                     if any(kw in result.lower() for kw in sticker_keywords):
-                        return None
+                        return ("", "sticker")
                     return (result, "unknown")
         except Exception as e:
             logger.error(f"[Memory Reboot] 图片识别失败: {e}")
         return None
     
-    async def _judge_remind(self, content: str, sender_name: str, matched_msg: Dict,
+    async def _judge_remind(self, content: str, sender_name: str, matched_msg: MessageRecord,
                             history_ctx: List[Dict], current_ctx: List[Dict], unique_count: int) -> bool:
         """LLM判断是否需要提醒"""
         provider_id = self.config.get("judge_provider_id", "")
@@ -1134,16 +3646,16 @@ class MemoryRebootPlugin(Star):
             history_str = "\n".join([fmt(m) for m in history_ctx])
             current_str = "\n".join([fmt(m) for m in current_ctx])
             
-            matched_time_ago = self._format_time_ago(matched_msg.get("timestamp", 0))
-            matched_sender = matched_msg.get("sender_name", "未知")
-            matched_content = matched_msg.get("content", "")[:300]
+            matched_time_ago = self._format_time_ago(matched_msg.timestamp)
+            matched_sender = matched_msg.sender_name or "未知"
+            matched_content = matched_msg.content[:300]
             min_senders = self.config.get("min_unique_senders", 3)
             
             prompt_template = self.config.get("judge_prompt") or self.DEFAULT_JUDGE_PROMPT
             
             try:
                 prompt = prompt_template.format(
-                    matched_time=self._format_time(matched_msg.get("timestamp", 0)),
+                    matched_time=self._format_time(matched_msg.timestamp),
                     matched_time_ago=matched_time_ago, matched_sender=matched_sender,
                     matched_content=matched_content, history_str=history_str,
                     current_str=current_str, sender_name=sender_name,
@@ -1153,7 +3665,7 @@ class MemoryRebootPlugin(Star):
             except Exception:
                 # 兼容旧版提示词如果不包含 {unique_count} 的情况
                 prompt = self.DEFAULT_JUDGE_PROMPT.format(
-                    matched_time=self._format_time(matched_msg.get("timestamp", 0)),
+                    matched_time=self._format_time(matched_msg.timestamp),
                     matched_time_ago=matched_time_ago, matched_sender=matched_sender,
                     matched_content=matched_content, history_str=history_str,
                     current_str=current_str, sender_name=sender_name,
@@ -1204,31 +3716,205 @@ class MemoryRebootPlugin(Star):
             chain.append(Plain("这个话题之前已经有人讨论过了哦~"))
         yield event.chain_result(chain)
     
-    async def _extract_content(self, event: AstrMessageEvent) -> Optional[Tuple[str, Optional[str]]]:
-        """提取消息内容，返回(文本内容, 图片URL)"""
+    def _get_ignore_patterns(self) -> IgnorePatternSet:
+        """
+        获取预编译的忽略正则集合
+        
+        仅在 ignore_regex 配置变化时重新编译，无效模式只在编译时报告一次。
+        """
+        source = tuple(self.config.get("ignore_regex", []) or [])
+        if self._ignore_patterns is None or source != self._ignore_source:
+            previous = self._ignore_patterns.hits if self._ignore_patterns is not None else None
+            self._ignore_patterns = IgnorePatternSet(list(source), previous)
+            self._ignore_source = source
+            for pattern, error in self._ignore_patterns.invalid:
+                logger.warning(f"[Memory Reboot] 忽略正则无效，已跳过: {pattern} ({error})")
+        return self._ignore_patterns
+
+    def _should_ignore_content(self, content: str, has_image: bool, quiet: bool = False) -> bool:
+        """
+        判断内容是否应被忽略（短文本、正则匹配、插件命令）
+
+        Args:
+            content: 提取后的消息内容
+            has_image: 是否为带图消息（带图消息不做长度检查）
+            quiet: 为True时不输出日志（用于预判）
+        """
+        # 过滤：最小长度检查
+        if not has_image:
+            min_length = self.config.get("min_text_length", DEFAULT_MIN_TEXT_LENGTH)
+            if len(content) < min_length:
+                if not quiet:
+                    logger.debug(f"[Memory Reboot] 跳过: 短文本({len(content)}<{min_length})")
+                return True
+
+        # 过滤：正则表达式检查
+        # 使用 fullmatch 确保完全匹配，避免误伤包含关键词的普通句子
+        # 例如：pattern="何意味" 时
+        # fullmatch: 匹配 "何意味"，不匹配 "你这是何意味啊"
+        # search: 两者都匹配
+        pattern = self._get_ignore_patterns().match(content, count=not quiet)
+        if pattern is not None:
+            if not quiet:
+                logger.info(f"[Memory Reboot] 已正则匹配: {pattern}")
+            return True
+
+        # 过滤：插件命令自动过滤
+        if self._is_plugin_command(content, quiet=quiet):
+            if not quiet:
+                logger.info(f"[Memory Reboot] 跳过: 检测到插件命令")
+            return True
+        return False
+
+    @staticmethod
+    def _cancel_pending(task: Optional[asyncio.Future]):
+        """取消尚未完成的后台任务（None 时忽略）"""
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def _extract_content(self, event: AstrMessageEvent, group_id: str
+                               ) -> Optional[Tuple[str, Optional[str], Optional[str], Optional[str]]]:
+        """
+        提取消息内容，返回(文本内容, 图片URL, 图片缓存路径, 图片哈希)
+
+        图片先下载并计算感知哈希，再按哈希查询识别结果缓存，未命中时才调用视觉模型；
+        多张图片并发处理。没有可用的视觉模型时图片无法识别，不下载也不缓存，只保留文字。
+        """
         text = event.message_str.strip() if event.message_str else ""
-        urls = []
-        if hasattr(event, "message_obj") and event.message_obj:
-            for comp in event.message_obj.message:
-                if isinstance(comp, Image):
-                    url = getattr(comp, "url", None) or getattr(comp, "file", None)
-                    if url:
-                        urls.append(url)
-        
-        if urls:
-            for url in urls:
-                result = await self._image_to_text(url)
-                if result:
-                    img_text, _ = result
-                    content = f"{text} [图片内容: {img_text}]" if text else f"[图片内容: {img_text}]"
-                    logger.debug(f"[Memory Reboot] 图片转文本成功")
-                    return (content, url)
-                else:
-                    logger.info(f"[Memory Reboot] 跳过表情包")
-            if not text:
-                logger.debug(f"[Memory Reboot] 无有效内容，跳过")
+        urls = self._collect_image_urls(event, include_reply=False)
+        
+        if urls and self._get_vision_provider() is None:
+            logger.info(f"[Memory Reboot] 跳过表情包")
+        elif urls:
+            # 各图片的下载/哈希/识别并发进行，仍按消息中的顺序选取第一张非表情包图片；
+            # 选定后取消其后仍在处理的图片
+            base_ts = time.time()
+            tasks = [asyncio.ensure_future(self._process_image(url, base_ts + i * 1e-6, group_id))
+                     for i, url in enumerate(urls)]
+            try:
+                for i, (url, task) in enumerate(zip(urls, tasks)):
+                    cached_image, image_hash, result = await task
+                    if result and result[1] != "sticker":
+                        img_text, _ = result
+                        content = f"{text} [图片内容: {img_text}]" if text else f"[图片内容: {img_text}]"
+                        logger.debug(f"[Memory Reboot] 图片转文本成功")
+                        for later in tasks[i + 1:]:
+                            later.cancel()
+                        await asyncio.gather(*tasks[i + 1:], return_exceptions=True)
+                        for later in tasks[i + 1:]:
+                            if not later.cancelled() and not later.exception():
+                                self._remove_cached_image(later.result()[0])
+                        return (content, url, cached_image, image_hash)
+                    else:
+                        logger.info(f"[Memory Reboot] 跳过表情包")
+                        self._remove_cached_image(cached_image)
+            finally:
+                for task in tasks:
+                    self._cancel_pending(task)
+        if urls and not text:
+            logger.debug(f"[Memory Reboot] 无有效内容，跳过")
+            return None
+        return (text, None, None, None) if text else None
+
+    async def _process_image(self, url: str, timestamp: float, group_id: str
+                             ) -> Tuple[Optional[str], Optional[str], Optional[Tuple[str, str]]]:
+        """下载并哈希单张图片，再识别其内容，返回(图片缓存路径, 图片哈希, 识别结果)"""
+        cached_image, image_hash = await self._cache_image(url, timestamp, group_id)
+        logger.debug(f"[Memory Reboot] 图片缓存: {'成功' if cached_image else '失败'}, 哈希={'有' if image_hash else '无'}")
+        return cached_image, image_hash, await self._describe_image(url, image_hash)
+
+    @staticmethod
+    def _remove_cached_image(path: Optional[str]):
+        """删除未被采用的图片缓存文件"""
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def _describe_image(self, url: str, image_hash: Optional[str]) -> Optional[Tuple[str, str]]:
+        """
+        识别图片内容：依次查询表情包黑名单、识别结果缓存，均未命中再调用视觉模型并记录结果
+        """
+        blocklist = await self._get_sticker_blocklist()
+        if blocklist is not None and image_hash and blocklist.match(image_hash):
+            logger.debug("[Memory Reboot] 图片识别: 命中表情包黑名单")
+            return ("", "sticker")
+
+        cache = self._get_vision_cache()
+        if cache is not None and image_hash:
+            cached = cache.get(image_hash)
+            if cached is not None:
+                logger.debug(f"[Memory Reboot] 图片识别: 命中识别结果缓存 ({cached[1]})")
+                return cached
+        result = await self._image_to_text(url)
+        if result is not None and cache is not None and image_hash:
+            cache.put(image_hash, result)
+        if result is not None and result[1] == "sticker" and blocklist is not None and image_hash:
+            if blocklist.add(image_hash):
+                self._schedule_sticker_blocklist_save()
+        return result
+
+    async def _get_sticker_blocklist(self) -> Optional[StickerBlocklist]:
+        """
+        获取表情包哈希黑名单；sticker_blocklist_size 为0时返回None
+
+        通常已在 initialize 中加载；否则首次使用时在线程池中读盘，并发的调用共享同一次读取。
+        """
+        if self._sticker_blocklist is None:
+            size = int(self.config.get("sticker_blocklist_size", DEFAULT_STICKER_BLOCKLIST_SIZE))
+            if size <= 0:
+                return None
+            if self._sticker_blocklist_loading is None:
+                loop = asyncio.get_running_loop()
+                self._sticker_blocklist_loading = loop.run_in_executor(None, self._read_sticker_blocklist)
+            hashes = await asyncio.shield(self._sticker_blocklist_loading)
+            if self._sticker_blocklist is None:
+                self._sticker_blocklist = StickerBlocklist(size, VISION_CACHE_HASH_THRESHOLD, hashes)
+                logger.debug(f"[Memory Reboot] 已加载表情包黑名单: {len(self._sticker_blocklist)}个哈希")
+        return self._sticker_blocklist
+
+    def _read_sticker_blocklist(self) -> List[str]:
+        """读取持久化的表情包黑名单（在线程池中执行），文件不存在或损坏时返回空列表"""
+        path = os.path.join(self.data_dir, STICKER_BLOCKLIST_FILENAME)
+        if not os.path.exists(path):
+            return []
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"[Memory Reboot] 读取表情包黑名单失败: {e}")
+            return []
+
+    def _schedule_sticker_blocklist_save(self):
+        """表情包黑名单变更后延迟写盘，合并短时间内的多次变更"""
+        if self._sticker_save_timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+
+        def _save():
+            self._sticker_save_timer = None
+            if self._sticker_blocklist is not None:
+                self._track_background_save(
+                    loop.run_in_executor(None, self._save_sticker_blocklist, self._sticker_blocklist.to_list()))
+
+        self._sticker_save_timer = loop.call_later(STICKER_BLOCKLIST_SAVE_DELAY, _save)
+
+    def _save_sticker_blocklist(self, hashes: List[str]):
+        """写出表情包黑名单（在线程池中执行）"""
+        try:
+            self._atomic_write_json_gz(os.path.join(self.data_dir, STICKER_BLOCKLIST_FILENAME), hashes)
+        except Exception as e:
+            logger.error(f"[Memory Reboot] 保存表情包黑名单失败: {e}")
+
+    def _get_vision_cache(self) -> Optional[VisionResultCache]:
+        """懒加载图片识别结果缓存；vision_cache_size 为0时返回None"""
+        if self._vision_cache is None:
+            size = int(self.config.get("vision_cache_size", DEFAULT_VISION_CACHE_SIZE))
+            if size <= 0:
                 return None
-        return (text, None) if text else None
+            self._vision_cache = VisionResultCache(size, VISION_CACHE_HASH_THRESHOLD)
+        return self._vision_cache
     
     # ==========================================================================
     # 4.10 主消息处理器
@@ -1247,124 +3933,161 @@ class MemoryRebootPlugin(Star):
             logger.debug(f"[Memory Reboot] 跳过: 群{group_id}在黑名单中")
             return
         
+        # 处理期间登记为进行中：该群的缓存不会被淘汰，其矩阵也不会被释放
+        group_key = str(group_id)
+        self._inflight[group_key] = self._inflight.get(group_key, 0) + 1
+        try:
+            async for result in self._handle_group_message(event, group_id):
+                yield result
+        finally:
+            self._release_inflight(group_key)
+
+    async def _handle_group_message(self, event: AstrMessageEvent, group_id):
+        """处理单条群消息：内容提取、相似度匹配、人数与冷却检测、LLM判断及提醒"""
         sender_id = event.get_sender_id()
         sender_name = event.get_sender_name() or sender_id
         logger.debug(f"[Memory Reboot] ━━━ 收到消息 ━━━ 群:{group_id} 发送者:{sender_name}({sender_id})")
         
-        result = await self._extract_content(event)
+        # 带图消息：在图片下载/识别期间先行计算文字部分的Embedding
+        # （图片全是表情包时内容即为文字本身）；任一图片识别出内容时取消
+        text = event.message_str.strip() if event.message_str else ""
+        text_embedding_task = None
+        if text and self._collect_image_urls(event, include_reply=False) and \
+                not self._should_ignore_content(text, has_image=False, quiet=True):
+            text_embedding_task = asyncio.ensure_future(self._get_embedding(text))
+        
+        try:
+            result = await self._extract_content(event, str(group_id))
+        except BaseException:
+            self._cancel_pending(text_embedding_task)
+            raise
         if not result:
+            self._cancel_pending(text_embedding_task)
             logger.debug(f"[Memory Reboot] 跳过: 内容提取失败或为表情包")
             return
         
-        content, image_url = result
-
-        # 过滤：最小长度检查
-        if not image_url:
-            min_length = self.config.get("min_text_length", DEFAULT_MIN_TEXT_LENGTH)
-            if len(content) < min_length:
-                logger.debug(f"[Memory Reboot] 跳过: 短文本({len(content)}<{min_length})")
-                return
-
-        # 过滤：正则表达式检查
-        for pattern in self.config.get("ignore_regex", []):
-            try:
-                # 使用 fullmatch 确保完全匹配，避免误伤包含关键词的普通句子
-                # 例如：pattern="何意味" 时
-                # fullmatch: 匹配 "何意味"，不匹配 "你这是何意味啊"
-                # search: 两者都匹配
-                if re.fullmatch(pattern, content):
-                    logger.info(f"[Memory Reboot] 已正则匹配: {pattern}")
-                    return
-            except re.error:
-                pass
+        content, image_url, cached_image, image_hash = result
+        if image_url or content != text:
+            self._cancel_pending(text_embedding_task)
+            text_embedding_task = None
 
-        # 过滤：插件命令自动过滤
-        if self._is_plugin_command(content):
-            logger.info(f"[Memory Reboot] 跳过: 检测到插件命令")
+        if self._should_ignore_content(content, has_image=image_url is not None):
+            self._cancel_pending(text_embedding_task)
             return
 
-        # 加载消息（使用内存缓存）
-        messages = self._load_messages(group_id)
+        # 加载消息（使用内存缓存；未缓存的群在线程池中读盘）
+        # 在过滤之后才加载，被忽略的消息和纯表情包不会触发冷启动读盘；带图消息的文字Embedding仍与之并行
+        try:
+            messages = await self._load_messages_async(group_id)
+        except BaseException:
+            self._cancel_pending(text_embedding_task)
+            raise
+        # 消息列表与各索引取自同一缓存条目，之后的 await 期间即使条目被替换也保持逐行对应
+        cache_entry = self._cache[str(group_id)]
         logger.debug(f"[Memory Reboot] 历史消息: {len(messages)}条（缓存）")
         
         # 定期清理图片缓存（每100条消息触发一次）
         if len(messages) % 100 == 0 and len(messages) > 0:
             self._cleanup_image_cache(group_id)
         
-        # 生成embedding和图片哈希
-        embedding = await self._get_embedding(content)
+        # 逐字复读快速路径：纯文本消息先按内容指纹查找完全相同的历史消息并直接统计其发送者
+        min_unique_senders = self.config.get("min_unique_senders", 3)
+        exact_rows, exact_senders = [], set()
+        if not image_url:
+            exact_rows = cache_entry["fingerprints"].lookup(
+                FingerprintIndex.fingerprint(content), len(messages))
+            exact_senders = {sender_id} if sender_id else set()
+            exact_senders.update(s for s in (messages[r].sender_id for r in exact_rows) if s)
+        exact_hit = bool(exact_rows) and len(exact_senders) >= min_unique_senders
+        
+        # 生成embedding（逐字复读时复用历史消息中同一嵌入提供商的向量，不再请求嵌入服务）
+        embedding_provider = self.config.get("embedding_provider_id", "")
+        embedding = self._stored_embedding(messages, cache_entry["embeddings"], exact_rows,
+                                           embedding_provider) if exact_rows else None
+        if embedding is not None:
+            self._cancel_pending(text_embedding_task)
+        elif text_embedding_task is not None:
+            embedding = await text_embedding_task
+        else:
+            embedding = await self._get_embedding(content)
         logger.debug(f"[Memory Reboot] Embedding: {'成功获取' if embedding else '获取失败'}, 维度={len(embedding) if embedding else 0}")
         now = time.time()
-        cached_image, image_hash = None, None
-        if image_url:
-            cached_image, image_hash = await self._cache_image(image_url, now, group_id)
-            logger.debug(f"[Memory Reboot] 图片缓存: {'成功' if cached_image else '失败'}, 哈希={'有' if image_hash else '无'}")
         
         # 创建当前消息记录
-        msg = {
-            "id": str(uuid.uuid4()), "sender_id": sender_id, "sender_name": sender_name,
-            "content": content, "timestamp": now, "embedding": embedding,
-            "has_image": image_url is not None, "cached_image": cached_image, "image_hash": image_hash
-        }
+        msg = MessageRecord(str(uuid.uuid4()), sender_id, sender_name, content, now,
+                            image_url is not None, cached_image, image_hash,
+                            embedding_provider if embedding else None)
         
-        # 注意：此时不追加到 messages 列表，而是创建一个包含当前消息的临时列表用于匹配
-        # 实际的追加会在 _append_message 中完成
-        messages_with_current = messages + [msg]
+        # 注意：此时不追加到 messages 列表，匹配和上下文构造都以"历史 + 当前消息"的形式传参，
+        # 避免每条消息复制整个历史列表；实际的追加会在 _append_message 中完成
         
-        # 相似度匹配（使用包含当前消息的列表，但排除最后一条）
+        # 相似度匹配（仅在历史消息中查找，同时统计不同发送者，当前发送者由匹配方法计入）
         matched_msg, matched_idx, match_type = None, -1, None
         text_threshold = self.config.get("similarity_threshold", DEFAULT_SIMILARITY_THRESHOLD)
         image_hash_threshold = self.config.get("image_hash_threshold", DEFAULT_IMAGE_HASH_THRESHOLD)
         
-        if embedding:
-            emb_matched, emb_idx, emb_sim = self._find_best_match(messages_with_current, embedding, text_threshold, exclude_recent=1)
+        # 完全相同的消息已凑够人数时不再做向量检索；人数不够时才检索，按"相同 + 相似"的发送者合并统计
+        emb_matched, emb_senders = None, set()
+        if embedding and not exact_hit:
+            matrix = cache_entry["embeddings"]
+            emb_matched, emb_idx, emb_sim, emb_senders = self._find_best_match(
+                messages, matrix, embedding, text_threshold, sender_id, min_unique_senders)
             logger.info(f"[Memory Reboot] 文本相似度: {emb_sim:.4f} (阈值{text_threshold})")
-            if emb_matched:
-                matched_msg, matched_idx, match_type = emb_matched, emb_idx, "embedding"
+
+        if exact_hit:
+            # 完全相同的消息已凑够人数，以最早的一条作为匹配
+            matched_msg, matched_idx, match_type = messages[exact_rows[0]], exact_rows[0], "exact"
+            logger.info(f"[Memory Reboot] 逐字复读: {len(exact_rows)}条相同历史消息, {len(exact_senders)}人")
+        elif emb_matched:
+            matched_msg, matched_idx, match_type = emb_matched, emb_idx, "embedding"
 
         if image_hash:
-            img_matched, img_idx, img_sim = self._find_similar_image(messages_with_current, image_hash, image_hash_threshold, exclude_recent=1)
+            hash_index = cache_entry["image_hashes"]
+            img_matched, img_idx, img_sim, img_senders = self._find_similar_image(
+                messages, hash_index, image_hash, image_hash_threshold, sender_id)
             logger.info(f"[Memory Reboot] 图片哈希相似度: {img_sim:.4f} (阈值{image_hash_threshold})")
             if not matched_msg and img_matched:
                 matched_msg, matched_idx, match_type = img_matched, img_idx, "image_hash"
-            elif matched_msg and img_matched and img_matched.get("timestamp", 0) < matched_msg.get("timestamp", 0):
+            elif matched_msg and img_matched and img_matched.timestamp < matched_msg.timestamp:
                 matched_msg, matched_idx, match_type = img_matched, img_idx, "image_hash"
         
         if not matched_msg:
             logger.debug(f"[Memory Reboot] 未找到匹配消息，仅保存记录")
-            self._append_message(group_id, msg)
+            self._append_message(group_id, msg, embedding)
             return
         
-        # 人数检测（使用包含当前消息的列表）
-        min_unique_senders = self.config.get("min_unique_senders", 3)
-        if match_type == "embedding" and embedding:
-            unique_count, sender_list = self._count_unique_senders(messages_with_current, embedding, text_threshold)
+        # 人数检测（发送者集合已在匹配时一并统计，含当前发送者）
+        if match_type == "exact":
+            unique_count = len(exact_senders)
+            logger.debug(f"[Memory Reboot] 人数检测(逐字): {unique_count}人发送过相同内容")
+        elif match_type == "embedding" and embedding:
+            unique_count = len(emb_senders)
             logger.debug(f"[Memory Reboot] 人数检测(文本): {unique_count}人发送过相似内容")
         elif match_type == "image_hash" and image_hash:
-            unique_count, sender_list = self._count_unique_senders_by_hash(messages_with_current, image_hash, image_hash_threshold)
+            unique_count = len(img_senders)
             logger.debug(f"[Memory Reboot] 人数检测(图片): {unique_count}人发送过相似图片")
         else:
             unique_count = 1
             logger.debug(f"[Memory Reboot] 人数检测: 无法统计(embedding或hash缺失)")
         
-        if sender_id == matched_msg.get("sender_id"):
+        if sender_id == matched_msg.sender_id:
             logger.debug(f"[Memory Reboot] ✗ 跳过: 同一用户({sender_name})重发自己的内容")
-            self._append_message(group_id, msg)
+            self._append_message(group_id, msg, embedding)
             return
         
         if unique_count < min_unique_senders:
             logger.debug(f"[Memory Reboot] ✗ 跳过: 不同用户数{unique_count}<{min_unique_senders}(阈值)")
-            self._append_message(group_id, msg)
+            self._append_message(group_id, msg, embedding)
             return
         
         logger.debug(f"[Memory Reboot] ✓ 通过人数检测: {unique_count}人>={min_unique_senders}人")
         
         # 冷却时间检查
-        time_diff = now - matched_msg.get("timestamp", 0)
+        time_diff = now - matched_msg.timestamp
         cooldown = self.config.get("cooldown_seconds", DEFAULT_COOLDOWN_SECONDS)
         if time_diff < cooldown:
             logger.debug(f"[Memory Reboot] ✗ 跳过: 冷却时间内({int(time_diff)}s<{cooldown}s)")
-            self._append_message(group_id, msg)
+            self._append_message(group_id, msg, embedding)
             return
         
         logger.debug(f"[Memory Reboot] ✓ 通过冷却检测: 间隔{int(time_diff)}s>={cooldown}s")
@@ -1374,11 +4097,10 @@ class MemoryRebootPlugin(Star):
         
         if enable_llm_judge:
             # LLM判断
-            history_ctx = self._get_context_around(messages_with_current, matched_idx, before=40, after=40)
-            current_ctx = [{"sender_name": m.get("sender_name"), "content": m.get("content"), "timestamp": m.get("timestamp")}
-                           for m in messages_with_current[:-1][-40:]]
+            history_ctx = self._get_context_around(messages, matched_idx, before=40, after=40, current=msg)
+            current_ctx = self._get_context_around(messages, len(messages) - 1, before=39, after=0)
 
-            logger.debug(f"[Memory Reboot] 进入LLM判断: 匹配={match_type}, 来自={matched_msg.get('sender_name')}, {self._format_time_ago(matched_msg.get('timestamp', 0))}")
+            logger.debug(f"[Memory Reboot] 进入LLM判断: 匹配={match_type}, 来自={matched_msg.sender_name}, {self._format_time_ago(matched_msg.timestamp)}")
 
             should_remind = await self._judge_remind(content, sender_name, matched_msg, history_ctx, current_ctx, unique_count)
         else:
@@ -1386,7 +4108,7 @@ class MemoryRebootPlugin(Star):
             logger.debug(f"[Memory Reboot] LLM判断已关闭，直接触发提醒")
             should_remind = True
 
-        self._append_message(group_id, msg)
+        self._append_message(group_id, msg, embedding)
 
         if should_remind:
             logger.info(f"[Memory Reboot] 最终判断: 触发提醒 -> {sender_name}")
@@ -1410,7 +4132,7 @@ class MemoryRebootPlugin(Star):
             yield event.plain_result("❌ 仅管理员可执行")
             return
         
-        messages = self._load_messages(group_id)
+        messages = await self._load_messages_async(group_id)
         img_path = os.path.join(self.plugin_dir, REMINDER_IMAGE_FILENAME)
         
         # 获取黑名单状态
@@ -1420,13 +4142,25 @@ class MemoryRebootPlugin(Star):
         # 获取插件命令过滤状态
         auto_filter_enabled = self.config.get('auto_filter_commands', True)
         if auto_filter_enabled and HAS_COMMAND_FILTER:
-            plugin_commands = self._get_all_plugin_commands()
+            plugin_commands, _ = self._get_command_matcher()
             cmd_filter_status = f"✅ 已启用 (检测到{len(plugin_commands)}个命令)"
         elif auto_filter_enabled and not HAS_COMMAND_FILTER:
             cmd_filter_status = "⚠️ 已启用但模块不可用"
         else:
             cmd_filter_status = "❌ 已禁用"
         
+        # 获取忽略正则状态
+        ignore_patterns = self._get_ignore_patterns()
+        if not len(ignore_patterns) and not ignore_patterns.invalid:
+            ignore_status = "未配置"
+        else:
+            ignore_status = f"{len(ignore_patterns)}条"
+            if ignore_patterns.invalid:
+                ignore_status += f" (无效{len(ignore_patterns.invalid)}条已跳过)"
+            top = ignore_patterns.top_hits(3)
+            if top:
+                ignore_status += ", 命中: " + ", ".join(f"{p}×{n}" for p, n in top)
+        
         # 获取LLM判断开关状态
         enable_llm_judge = self.config.get('enable_llm_judge', True)
         judge_provider_id = self.config.get('judge_provider_id', '')
@@ -1437,13 +4171,75 @@ class MemoryRebootPlugin(Star):
                 llm_judge_status = "⚠️ 已启用但未配置提供商"
         else:
             llm_judge_status = "❌ 已禁用 (匹配即提醒)"
+
+        # 获取ANN索引状态
+        cache_entry = self._cache[str(group_id)]
+        ann = cache_entry["embeddings"].ann
+        if ann is None:
+            ann_status = "❌ 未启用 (精确扫描)"
+        elif ann.is_trained:
+            ann_status = f"✅ 已训练 ({len(ann.centroids)}个聚类, nprobe={ann.nprobe})"
+        else:
+            ann_status = f"⏳ 已启用，向量数达到{ann.min_size}后训练"
+
+        # 获取向量存储状态
+        matrix = cache_entry["embeddings"]
+        vector_status = f"{matrix.precision}, 常驻{matrix.resident_bytes() / 1048576:.2f}MB"
+        if matrix.quantized:
+            vector_status += f", 已精排{matrix.reranked}行"
+
+        # 获取Embedding缓存状态
+        emb_cache = self._embedding_cache
+        if self.config.get("embedding_cache_size", DEFAULT_EMBEDDING_CACHE_SIZE) <= 0:
+            emb_cache_status = "❌ 已禁用"
+        elif emb_cache is None:
+            emb_cache_status = "✅ 已启用 (尚未使用)"
+        else:
+            lookups = emb_cache.hits + emb_cache.disk_hits + emb_cache.misses
+            hit_rate = (emb_cache.hits + emb_cache.disk_hits) / lookups if lookups else 0.0
+            emb_cache_status = (f"✅ {len(emb_cache)}条, 命中率{hit_rate:.0%} "
+                                f"(内存{emb_cache.hits}/持久{emb_cache.disk_hits}/未命中{emb_cache.misses})")
+
+        # 获取识图缓存状态
+        vision_cache = self._vision_cache
+        if self.config.get("vision_cache_size", DEFAULT_VISION_CACHE_SIZE) <= 0:
+            vision_cache_status = "❌ 已禁用"
+        elif vision_cache is None:
+            vision_cache_status = "✅ 已启用 (尚未使用)"
+        else:
+            vision_cache_status = f"✅ {len(vision_cache)}张, 命中{vision_cache.hits}/未命中{vision_cache.misses}"
+
+        # 获取表情包黑名单状态
+        blocklist = await self._get_sticker_blocklist()
+        if blocklist is None:
+            sticker_status = "❌ 已禁用"
+        else:
+            sticker_status = f"✅ {len(blocklist)}个哈希, 已拦截{blocklist.hits}次"
+
+        # 获取图片下载耗时统计
+        download = self._download_stats.summary()
+        if download is None:
+            download_status = "暂无记录"
+        else:
+            download_status = (f"{download['count']}次 (失败{download['failures']}), 平均{download['avg_ms']:.0f}ms, "
+                               f"P50 {download['p50_ms']:.0f}ms / P95 {download['p95_ms']:.0f}ms")
+        
+        # 获取群组缓存占用（超出预算时淘汰最久未活跃的群组）
+        cached_groups, cached_bytes = self._cache_usage()
+        max_groups = int(self.config.get("cache_max_groups", DEFAULT_CACHE_MAX_GROUPS))
+        max_mb = float(self.config.get("cache_max_memory_mb", DEFAULT_CACHE_MAX_MEMORY_MB))
+        limits = [f"{max_groups}个群"] if max_groups > 0 else []
+        if max_mb > 0:
+            limits.append(f"{max_mb:g} MB")
+        cache_status = (f"{cached_groups}个群, 约{cached_bytes / 1048576:.1f} MB "
+                        f"(上限: {' / '.join(limits) if limits else '不限'}), 已淘汰{self._evictions}次")
         
         status = f"""✅ Memory Reboot - 记忆状态
 
 📌 群号: {group_id}
 📊 消息数: {len(messages)}
-🧠 含embedding: {sum(1 for m in messages if m.get("embedding"))}
-🖼️ 含图片: {sum(1 for m in messages if m.get("has_image"))} (含哈希: {sum(1 for m in messages if m.get("image_hash"))})
+🧠 含embedding: {cache_entry["embeddings"].count_valid()}
+🖼️ 含图片: {sum(1 for m in messages if m.has_image)} (含哈希: {cache_entry["image_hashes"].count_valid()})
 
 ⚙️ 配置参数:
 📏 文本相似度阈值: {self.config.get('similarity_threshold', DEFAULT_SIMILARITY_THRESHOLD)}
@@ -1451,12 +4247,21 @@ class MemoryRebootPlugin(Star):
 👥 最少不同用户: {self.config.get('min_unique_senders', DEFAULT_MIN_UNIQUE_SENDERS)}人
 ⏰ 冷却时间: {self.config.get('cooldown_seconds', DEFAULT_COOLDOWN_SECONDS)}秒
 📅 数据保留: {self.config.get('data_retention_days', DEFAULT_DATA_RETENTION_DAYS)}天
+💾 存储格式: {self.config.get('storage_format', DEFAULT_STORAGE_FORMAT)}
 
 🛠️ 环境检查:
 - Pillow库: {'✅ 已安装 (dHash可用)' if HAS_PIL else '❌ 未安装 (降级为MD5)'}
 - 提醒图片: {'✅ 存在' if os.path.exists(img_path) else '⚠️ 不存在 (将发送纯文本)'}
 - 命令过滤: {cmd_filter_status}
-- LLM判断: {llm_judge_status}"""
+- 忽略正则: {ignore_status}
+- LLM判断: {llm_judge_status}
+- ANN索引: {ann_status}
+- 向量存储: {vector_status}
+- Embedding缓存: {emb_cache_status}
+- 识图缓存: {vision_cache_status}
+- 表情包库: {sticker_status}
+- 图片下载: {download_status}
+- 缓存占用: {cache_status}"""
         yield event.plain_result(status)
     
     @filter.command("查看过滤命令")
@@ -1469,7 +4274,7 @@ class MemoryRebootPlugin(Star):
             yield event.plain_result("❌ 命令过滤模块不可用，请检查AstrBot版本")
             return
         
-        commands = self._get_all_plugin_commands()
+        commands, _ = self._get_command_matcher()
         
         if not commands:
             yield event.plain_result("📋 当前未检测到任何插件命令")
@@ -1495,6 +4300,132 @@ class MemoryRebootPlugin(Star):
         
         yield event.plain_result(result)
     
+    @filter.command("索引召回测试")
+    async def check_ann_recall(self, event: AstrMessageEvent):
+        """以精确扫描为基准测试当前群ANN索引的召回率（仅管理员）"""
+        group_id = event.get_group_id()
+        if not group_id:
+            yield event.plain_result("请在群聊中使用")
+            return
+        if not event.is_admin():
+            yield event.plain_result("❌ 仅管理员可执行")
+            return
+        if not self.config.get("ann_index_enabled", False):
+            yield event.plain_result("❌ 未启用ANN索引，请在配置中开启 \"ann_index_enabled\"")
+            return
+
+        await self._load_messages_async(group_id)
+        matrix = self._cache[str(group_id)]["embeddings"]
+        threshold = self.config.get("similarity_threshold", DEFAULT_SIMILARITY_THRESHOLD)
+        report = self._evaluate_ann_recall(matrix, threshold)
+        if report is None:
+            min_size = self.config.get("ann_min_size", DEFAULT_ANN_MIN_SIZE)
+            yield event.plain_result(
+                f"⏳ ANN索引尚未训练（当前{matrix.count_valid()}条向量，达到{min_size}条后自动训练）")
+            return
+
+        result = f"""📐 ANN索引召回测试
+
+🔢 测试查询: {report['queries']}条
+🎯 Top1召回率: {report['top1_recall']:.2%}
+📏 阈值内召回率: {report['threshold_recall']:.2%} (共{report['threshold_pairs']}对 ≥{threshold})
+🔍 平均扫描比例: {report['scan_ratio']:.2%}
+⏱️ 平均耗时: 精确{report['exact_ms']:.2f}ms / ANN{report['ann_ms']:.2f}ms
+
+💡 召回率偏低时可调大 "ann_nprobe"。"""
+        yield event.plain_result(result)
+
+    @filter.command("量化评估")
+    async def check_quantization(self, event: AstrMessageEvent):
+        """以全精度为基准评估当前群向量的 float16 / int8 量化效果（仅管理员）"""
+        group_id = event.get_group_id()
+        if not group_id:
+            yield event.plain_result("请在群聊中使用")
+            return
+        if not event.is_admin():
+            yield event.plain_result("❌ 仅管理员可执行")
+            return
+
+        await self._load_messages_async(group_id)
+        matrix = self._cache[str(group_id)]["embeddings"]
+        threshold = self.config.get("similarity_threshold", DEFAULT_SIMILARITY_THRESHOLD)
+        report = self._evaluate_quantization(matrix, threshold)
+        if report is None:
+            yield event.plain_result(f"⏳ 向量数量不足（当前{matrix.count_valid()}条），无法评估")
+            return
+
+        lines = []
+        for precision in EMBEDDING_PRECISIONS[1:]:
+            r = report[precision]
+            saved = 1 - r["bytes_per_row"] / report["float32_bytes"]
+            lines.append(f"""【{precision}】节省内存 {saved:.0%} ({report['vectors'] * saved * report['float32_bytes'] / 1048576:.2f}MB)
+🎯 Top1一致率: {r['top1_recall']:.2%}  最大误差: {r['max_error']:.5f}
+📏 阈值判断翻转: 未精排{r['flips']}对 / 精排后{r['flips_after_rerank']}对
+🔍 需精排比例: {r['rerank_ratio']:.3%}""")
+
+        result = f"""🧮 向量量化评估
+
+🔢 向量: {report['vectors']}条 × {report['dim']}维, 测试查询{report['queries']}条
+📐 阈值 {threshold} 以上: {report['threshold_pairs']}对
+⚙️ 当前精度: {matrix.precision} (常驻 {matrix.resident_bytes() / 1048576:.2f}MB)
+
+{chr(10).join(lines)}
+
+💡 可在配置中通过 "embedding_precision" 切换精度，精排保证阈值判断与 float32 一致。"""
+        yield event.plain_result(result)
+    
+    @filter.command("屏蔽表情包")
+    async def block_sticker(self, event: AstrMessageEvent):
+        """将命令中附带的（或所引用消息中的）图片加入表情包黑名单（仅管理员）"""
+        if not event.is_admin():
+            yield event.plain_result("❌ 仅管理员可执行")
+            return
+        blocklist = await self._get_sticker_blocklist()
+        if blocklist is None:
+            yield event.plain_result("❌ 表情包黑名单已禁用，请在配置中设置 \"sticker_blocklist_size\"")
+            return
+
+        urls = self._collect_image_urls(event)
+        if not urls:
+            yield event.plain_result("请在命令中附带图片，或引用一条图片消息后发送此命令")
+            return
+
+        added, failed = 0, 0
+        for url in urls:
+            image_hash = await self._hash_image_url(url)
+            if not image_hash:
+                failed += 1
+            elif blocklist.add(image_hash):
+                added += 1
+        if added:
+            self._schedule_sticker_blocklist_save()
+        logger.info(f"[Memory Reboot] 管理员 {event.get_sender_id()} 添加表情包: {added}个")
+        msg = f"✅ 已加入表情包黑名单: {added}张（共{len(blocklist)}个哈希）"
+        if len(urls) - added - failed > 0:
+            msg += f"\n{len(urls) - added - failed}张已在黑名单中"
+        if failed:
+            msg += f"\n⚠️ {failed}张图片下载或计算哈希失败"
+        yield event.plain_result(msg)
+
+    @filter.command("清空表情包库")
+    async def clear_sticker_blocklist(self, event: AstrMessageEvent):
+        """清空表情包黑名单及识图结果缓存（仅管理员）"""
+        if not event.is_admin():
+            yield event.plain_result("❌ 仅管理员可执行")
+            return
+        blocklist = await self._get_sticker_blocklist()
+        if blocklist is None:
+            yield event.plain_result("❌ 表情包黑名单已禁用")
+            return
+
+        count = len(blocklist)
+        blocklist.clear()
+        # 识图缓存中同样记有表情包判定，一并清空，确保图片重新识别
+        self._vision_cache = None
+        self._schedule_sticker_blocklist_save()
+        logger.info(f"[Memory Reboot] 表情包黑名单已清空（{count}个哈希）")
+        yield event.plain_result(f"✅ 已清空表情包黑名单（{count}个哈希）及识图缓存")
+
     @filter.command("擦除记忆")
     async def clear_data(self, event: AstrMessageEvent):
         """清除群组数据（仅管理员，结果仅输出到日志）"""
@@ -1508,9 +4439,20 @@ class MemoryRebootPlugin(Star):
         
         group_id = str(group_id)
         
+        # 等待进行中的后台加载结束，避免擦除后又把旧数据登记回缓存
+        if group_id in self._loading:
+            await asyncio.gather(self._loading[group_id], return_exceptions=True)
+        
+        # 等待进行中的写盘完成并丢弃该群的待写消息，避免删除目录后又被写回
+        async with self._flush_lock:
+            self._take_pending(group_id)
+        
         # 清除内存缓存
         if group_id in self._cache:
-            del self._cache[group_id]
+            self._retire_matrix(group_id, self._cache.pop(group_id)["embeddings"])
+        self._wal_last_date.pop(group_id, None)
+        for key in [k for k in self._wal_counts if k[0] == group_id]:
+            del self._wal_counts[key]
         
         # 删除整个群组数据目录
         group_dir = self._get_group_dir(group_id)
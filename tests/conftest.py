@@ -0,0 +1,117 @@
+"""
+测试公共设施
+
+插件依赖 AstrBot 运行时：各测试模块在导入 main 之前以 importorskip 检查，未安装 astrbot 时跳过。
+这里只替身插件所调用的宿主接口（上下文、事件、嵌入提供商），插件本身按真实代码运行。
+"""
+
+import asyncio
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIM = 32
+
+
+def fake_embedding(text: str):
+    """按词累加的确定性伪向量：相同文本得到相同向量，不同文本近似正交"""
+    acc = np.zeros(DIM)
+    for word in text.split():
+        seed = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16)
+        acc += np.random.default_rng(seed).standard_normal(DIM)
+    return acc.tolist()
+
+
+class FakeEmbeddingProvider:
+    id = "emb"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def get_embeddings(self, texts):
+        self.calls += 1
+        await asyncio.sleep(0.005)
+        return [fake_embedding(t) for t in texts]
+
+
+class FakeContext:
+    def __init__(self):
+        self.embedding_provider = FakeEmbeddingProvider()
+
+    def get_all_embedding_providers(self):
+        return [self.embedding_provider]
+
+    def get_provider_by_id(self, provider_id):
+        return None
+
+    def get_all_stars(self):
+        return []
+
+
+class FakeMessage:
+    def __init__(self):
+        self.message = []
+        self.message_id = "1"
+
+
+class FakeEvent:
+    def __init__(self, group_id: str, sender_id: str, text: str):
+        self.group_id, self.sender_id, self.message_str = group_id, sender_id, text
+        self.message_obj = FakeMessage()
+
+    def get_group_id(self):
+        return self.group_id
+
+    def get_sender_id(self):
+        return self.sender_id
+
+    def get_sender_name(self):
+        return f"user{self.sender_id}"
+
+    def is_admin(self):
+        return True
+
+    def plain_result(self, text):
+        return ("plain", text)
+
+    def chain_result(self, chain):
+        return ("chain", chain)
+
+
+async def send(plugin, group_id: str, sender_id: str, text: str) -> list:
+    """投递一条群消息，返回插件产生的回复"""
+    return [r async for r in plugin.on_group_message(FakeEvent(group_id, sender_id, text))]
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """把插件数据目录与工作目录（图片缓存）指向临时目录"""
+    import main
+
+    path = tmp_path / "data"
+    monkeypatch.setattr(main.StarTools, "get_data_dir", staticmethod(lambda: path))
+    monkeypatch.chdir(tmp_path)
+    return path
+
+
+@pytest.fixture
+def make_plugin(data_dir):
+    """按给定配置创建插件（在默认配置上覆盖：不冷却、不调用LLM判断、立即写盘）"""
+    import main
+
+    def factory(**overrides):
+        config = {
+            "embedding_provider_id": "emb",
+            "enable_llm_judge": False,
+            "cooldown_seconds": 0,
+            "min_text_length": 2,
+            "flush_interval_seconds": 0,
+        }
+        config.update(overrides)
+        return main.MemoryRebootPlugin(FakeContext(), config)
+    return factory
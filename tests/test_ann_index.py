@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("astrbot")
+
+import main
+
+EmbeddingMatrix, IVFIndex = main.EmbeddingMatrix, main.IVFIndex
+
+
+def _trained(matrix: EmbeddingMatrix, nprobe: int = 8) -> IVFIndex:
+    ann = matrix.ann = IVFIndex(matrix, nprobe=nprobe, min_size=100)
+    assert ann.needs_training()
+    job = ann.prepare_training()
+    ann.finish_training(job, IVFIndex.run_training(job))
+    return ann
+
+
+def _clustered(n: int, dim: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((40, dim))
+    return centers[rng.integers(0, 40, n)] + rng.standard_normal((n, dim)) * 0.1
+
+
+def test_ivf_candidates_find_near_duplicates():
+    """近重复向量的最佳匹配必定出现在候选行中，且候选只占全部行的一部分"""
+    vectors = _clustered(4000, 48, seed=0)
+    matrix = EmbeddingMatrix.from_embeddings(list(vectors))
+    ann = _trained(matrix)
+
+    rng = np.random.default_rng(1)
+    sizes = []
+    for row in rng.choice(len(vectors), 50, replace=False):
+        query = EmbeddingMatrix.normalize(vectors[row] + rng.standard_normal(48) * 0.01)
+        rows = ann.candidates(query)
+        assert np.all(np.diff(rows) > 0)
+        assert row in rows
+        sizes.append(len(rows))
+    assert np.mean(sizes) < len(vectors) / 2
+
+
+def test_ivf_follows_append_and_compaction():
+    """训练后追加的行会被分配进倒排表；压缩得到的新索引与新矩阵的行号一致"""
+    vectors = _clustered(1200, 32, seed=2)
+    matrix = EmbeddingMatrix.from_embeddings(list(vectors[:1000]))
+    _trained(matrix)
+    for vec in vectors[1000:]:
+        matrix.append(vec.tolist())
+    assert 1100 in matrix.ann.candidates(EmbeddingMatrix.normalize(vectors[1100]))
+
+    keep = np.arange(matrix.size) >= 300
+    compacted = matrix.compacted(keep)
+    assert compacted.ann is not matrix.ann and compacted.ann.matrix is compacted
+    assert 1100 - 300 in compacted.ann.candidates(EmbeddingMatrix.normalize(vectors[1100]))
+    # 旧索引仍按旧行号工作
+    assert 1100 in matrix.ann.candidates(EmbeddingMatrix.normalize(vectors[1100]))
+
+
+def test_ann_match_counts_senders_over_all_rows(make_plugin):
+    """ANN只在候选行中找匹配；找到匹配但人数不足时，人数按全部行精确统计"""
+    rng = np.random.default_rng(2)
+    base = rng.standard_normal(48)
+    vectors = [base + rng.standard_normal(48) * 0.01 for _ in range(6)] + list(rng.standard_normal((200, 48)))
+    messages = [main.MessageRecord(f"m{i}", f"user{i}", f"user{i}", "text", float(i)) for i in range(len(vectors))]
+    matrix = EmbeddingMatrix.from_embeddings(vectors)
+
+    class FirstRowOnly:
+        def candidates(self, query):
+            return np.array([0])
+
+    matrix.ann = FirstRowOnly()
+    plugin = make_plugin()
+    matched, idx, _, senders = plugin._find_best_match(messages, matrix, list(base), 0.9, "me", min_senders=0)
+    assert idx == 0 and senders == {"me", "user0"}
+    matched, idx, _, senders = plugin._find_best_match(messages, matrix, list(base), 0.9, "me", min_senders=3)
+    assert idx == 0 and senders == {"me"} | {f"user{i}" for i in range(6)}
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+from conftest import send
+
+
+@pytest.mark.parametrize("config", [
+    {},
+    {"cache_max_groups": 2},
+    {"cache_max_groups": 2, "embedding_precision": "int8"},
+])
+def test_concurrent_groups_under_budget_still_detect_repeats(make_plugin, config):
+    """多个群并发处理时，超出预算的淘汰不能让处理中的消息对着已淘汰的缓存匹配"""
+    async def run():
+        plugin = make_plugin(min_unique_senders=3, **config)
+        groups = [f"g{i}" for i in range(6)]
+        results = await asyncio.gather(*[
+            send(plugin, group, str(sender), f"breaking news from {group} today")
+            for sender in range(6) for group in groups
+        ])
+        reminders = {group: 0 for group in groups}
+        for i, replies in enumerate(results):
+            reminders[groups[i % len(groups)]] += len(replies)
+        # 第3~6个发送者各触发一次提醒
+        assert reminders == {group: 4 for group in groups}
+        assert not plugin._inflight and not plugin._retired_matrices
+        if config:
+            await asyncio.gather(*plugin._eviction_tasks)
+            assert len(plugin._cache) <= 2
+        await plugin.terminate()
+
+    asyncio.run(run())
+
+
+def test_evicted_group_reloads_history(make_plugin):
+    """被淘汰的群组先写盘，再次收到消息时从磁盘完整重新加载"""
+    async def run():
+        plugin = make_plugin(cache_max_groups=2, min_unique_senders=2)
+        for group in ("g1", "g2", "g3"):
+            for sender in range(3):
+                await send(plugin, group, str(sender), f"chatter {group} number {sender}")
+        await asyncio.gather(*plugin._eviction_tasks)
+        assert list(plugin._cache) == ["g2", "g3"]
+        assert plugin._evictions == 1
+
+        replies = await send(plugin, "g1", "9", "chatter g1 number 0")
+        assert len(replies) == 1
+        assert len(plugin._cache["g1"]["messages"]) == 4
+        await asyncio.gather(*plugin._eviction_tasks)
+        assert "g1" in plugin._cache and len(plugin._cache) == 2
+        await plugin.terminate()
+
+    asyncio.run(run())
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+import main
+
+
+def test_terminate_waits_for_pending_cache_saves(make_plugin, monkeypatch):
+    """卸载时等待进行中的Embedding缓存落盘完成后才关闭数据库"""
+    events = []
+    original_save = main.EmbeddingCache.save_to_disk
+    original_close = main.EmbeddingCache.close
+
+    def slow_save(cache, key, stored_at, vector):
+        time.sleep(0.05)
+        original_save(cache, key, stored_at, vector)
+        events.append("save")
+
+    def close(cache):
+        events.append("close")
+        original_close(cache)
+
+    monkeypatch.setattr(main.EmbeddingCache, "save_to_disk", slow_save)
+    monkeypatch.setattr(main.EmbeddingCache, "close", close)
+
+    async def run():
+        plugin = make_plugin(embedding_cache_persistent=True)
+        assert await plugin._get_embedding("persist me please") is not None
+        assert plugin._background_saves
+        await plugin.terminate()
+        assert not plugin._background_saves
+
+        restarted = make_plugin(embedding_cache_persistent=True)
+        assert await restarted._get_embedding("persist me please") is not None
+        assert restarted._embedding_cache.disk_hits == 1
+        await restarted.terminate()
+
+    asyncio.run(run())
+    assert events[:2] == ["save", "close"]
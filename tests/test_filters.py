@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip("astrbot")
+
+import main
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.records = []
+
+    def __getattr__(self, level):
+        return lambda message, *args, **kwargs: self.records.append((level, message))
+
+
+def test_quiet_precheck_is_silent_and_uncounted(make_plugin, monkeypatch):
+    """预判（quiet）既不输出日志，也不计入忽略正则的命中次数"""
+    plugin = make_plugin(ignore_regex=["签到"])
+    plugin._get_command_matcher()  # 匹配器只在构建时输出日志，这里先行构建
+    recorder = RecordingLogger()
+    monkeypatch.setattr(main, "logger", recorder)
+
+    for text in ("签到", "记忆状态", "a"):
+        assert plugin._should_ignore_content(text, has_image=False, quiet=True) == (text != "记忆状态")
+    assert plugin._get_ignore_patterns().hits.get("签到", 0) == 0
+    assert recorder.records == []
+
+    assert plugin._should_ignore_content("签到", has_image=False)
+    assert not plugin._should_ignore_content("记忆状态", has_image=False)
+    assert plugin._get_ignore_patterns().hits["签到"] == 1
+    assert any("自己的命令" in message for _, message in recorder.records)
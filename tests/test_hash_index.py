@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("astrbot")
+
+import main
+
+
+def _flip_bits(hex_hash: str, count: int, rng) -> str:
+    value = int(hex_hash, 16)
+    for bit in rng.choice(len(hex_hash) * 4, count, replace=False):
+        value ^= 1 << int(bit)
+    return f"{value:0{len(hex_hash)}x}"
+
+
+@pytest.mark.parametrize("threshold", [0.95, 0.9, 0.8, 0.5])
+def test_multi_index_search_matches_linear_scan(threshold):
+    """多索引哈希检索的结果与逐行计算相似度后按阈值过滤完全一致（含过期压缩之后）"""
+    rng = np.random.default_rng(0)
+    bases = [f"{int(rng.integers(0, 2**63)):016x}" * 4 for _ in range(50)]
+    hashes = [_flip_bits(bases[i % len(bases)], int(rng.integers(0, 40)), rng) for i in range(2000)]
+    hashes[::7] = [None] * len(hashes[::7])
+
+    index = main.HashIndex()
+    for h in hashes:
+        index.append(h)
+
+    def check(limit=None):
+        for query in (bases[3], hashes[1], _flip_bits(bases[10], 5, rng)):
+            rows, sims = index.search(query, threshold, limit)
+            full = index.similarities(query, limit)
+            expected = np.flatnonzero(full >= threshold)
+            assert np.array_equal(rows, expected)
+            assert np.allclose(sims, full[expected])
+
+    check()
+    check(limit=1500)
+    index.retain(np.arange(index.size) >= 600)
+    check()
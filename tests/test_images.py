@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+import main
+from conftest import FakeEvent
+
+
+def _image_event(group_id: str, sender_id: str, text: str) -> FakeEvent:
+    event = FakeEvent(group_id, sender_id, text)
+    event.message_obj.message.append(main.Image.fromURL("http://127.0.0.1:9/sticker.jpg"))
+    return event
+
+
+@pytest.mark.parametrize("vision_provider_id", ["", "missing"])
+def test_images_untouched_without_vision_provider(make_plugin, monkeypatch, vision_provider_id):
+    """没有可用的视觉模型时不下载、不缓存图片，只按文字处理"""
+    async def run():
+        plugin = make_plugin(vision_provider_id=vision_provider_id)
+        downloads = []
+
+        async def _download(url):
+            downloads.append(url)
+            return None
+
+        monkeypatch.setattr(plugin, "_download_image", _download)
+
+        assert [r async for r in plugin.on_group_message(_image_event("g1", "1", ""))] == []
+        assert "g1" not in plugin._cache
+
+        assert [r async for r in plugin.on_group_message(_image_event("g1", "1", "look at this one"))] == []
+        stored = plugin._cache["g1"]["messages"]
+        assert [(m.content, m.has_image, m.image_hash) for m in stored] == [("look at this one", False, None)]
+        assert downloads == []
+        await plugin.terminate()
+
+    asyncio.run(run())
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+from conftest import send
+
+
+def test_ignored_messages_do_not_load_group(make_plugin):
+    """被过滤的消息不触发群组历史的冷启动加载"""
+    async def run():
+        plugin = make_plugin(min_text_length=5, ignore_regex=["签到"])
+        assert await send(plugin, "g1", "1", "hi") == []
+        assert await send(plugin, "g1", "1", "签到") == []
+        assert "g1" not in plugin._cache and not plugin._loading
+
+        await send(plugin, "g1", "1", "something worth remembering")
+        assert len(plugin._cache["g1"]["messages"]) == 1
+        await plugin.terminate()
+
+    asyncio.run(run())
+
+
+def test_cold_loads_share_one_decode_pool(make_plugin):
+    """多个群同时冷启动加载时只创建一个解码线程池"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    plugin = make_plugin()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        pools = set(map(id, pool.map(lambda _: plugin._get_load_pool(), range(64))))
+    assert len(pools) == 1
+    asyncio.run(plugin.terminate())
+    assert plugin._load_pool is None
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("astrbot")
+
+import main
+
+EmbeddingMatrix = main.EmbeddingMatrix
+
+
+def _clustered_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """围绕少量中心生成的向量，使大量行的相似度落在阈值附近"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((8, dim))
+    noise = rng.standard_normal((n, dim)) * 0.12
+    return (centers[rng.integers(0, len(centers), n)] + noise).astype(np.float32)
+
+
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_quantized_threshold_decisions_match_float32(tmp_path, precision):
+    """量化矩阵经全精度精排后，是否达到阈值的判断与 float32 矩阵完全一致"""
+    vectors = _clustered_vectors(3000, 64)
+    reference = EmbeddingMatrix.from_embeddings(list(vectors))
+    matrix = EmbeddingMatrix.from_embeddings(list(vectors), precision, str(tmp_path / "spill"))
+    assert matrix.resident_bytes() < reference.resident_bytes()
+
+    rng = np.random.default_rng(1)
+    for query in vectors[rng.choice(len(vectors), 40, replace=False)]:
+        exact = reference.similarities(query)
+        for threshold in (0.9, 0.95, 0.98):
+            approx = matrix.similarities(query, threshold=threshold)
+            assert np.array_equal(approx >= threshold, exact >= threshold)
+            passed = exact >= threshold
+            if passed.any():
+                assert int(np.argmax(np.where(passed, approx, -1))) == int(np.argmax(np.where(passed, exact, -1)))
+    assert matrix.reranked > 0
+    assert np.allclose(matrix.vector(7), vectors[7], atol=1e-4)
+
+
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_quantized_matrix_append_compact_and_close(tmp_path, precision):
+    """追加扩容、压缩都保持精排结果正确；close 删除全精度映射文件"""
+    spill = tmp_path / "spill"
+    vectors = _clustered_vectors(600, 32, seed=2)
+    matrix = EmbeddingMatrix(precision, str(spill))
+    for vec in vectors:
+        matrix.append(vec.tolist())
+    matrix.append(None)
+    assert matrix.size == 601 and matrix.count_valid() == 600
+
+    keep = np.ones(matrix.size, dtype=bool)
+    keep[:250] = False
+    compacted = matrix.compacted(keep)
+    reference = EmbeddingMatrix.from_embeddings(list(vectors[250:]) + [None])
+    query = vectors[400]
+    assert np.array_equal(compacted.similarities(query, threshold=0.95) >= 0.95,
+                          reference.similarities(query) >= 0.95)
+    # 旧矩阵不受压缩影响
+    assert matrix.size == 601 and np.allclose(matrix.vector(0), vectors[0], atol=1e-4)
+
+    matrix.close()
+    assert os.listdir(spill)  # 压缩后的矩阵有自己的映射文件
+    compacted.close()
+    assert os.listdir(spill) == []
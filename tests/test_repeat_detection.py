@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+from conftest import send
+
+
+def test_verbatim_match_skips_vector_scan(make_plugin):
+    """逐字复读凑够人数时不调用嵌入服务也不做向量检索；人数不够时才回退到语义匹配"""
+    async def run():
+        plugin = make_plugin(min_unique_senders=3, similarity_threshold=0.8)
+        counts, scans = [], []
+
+        async def judge(content, sender_name, matched_msg, history_ctx, current_ctx, unique_count):
+            counts.append(unique_count)
+            return True
+
+        find_best_match = plugin._find_best_match
+
+        def counting_find_best_match(*args, **kwargs):
+            scans.append(args[2])
+            return find_best_match(*args, **kwargs)
+
+        plugin._judge_remind = judge
+        plugin._find_best_match = counting_find_best_match
+        plugin.config["enable_llm_judge"] = True
+        base = "the server goes down for maintenance tonight at ten"
+        await send(plugin, "g1", "1", base)
+        await send(plugin, "g1", "2", base)
+        await send(plugin, "g1", "3", base + " sharp")
+        await send(plugin, "g1", "4", base + " sharp")
+        # 逐字相同的只有2人（不足3人），走语义匹配；相似的共4人
+        assert counts == [3, 4]
+        assert len(scans) == 4
+
+        calls = plugin.context.embedding_provider.calls
+        await send(plugin, "g1", "5", base)
+        # 逐字相同已有3人（1、2、5）：直接按相同内容的发送者计数
+        assert counts[-1] == 3
+        assert len(scans) == 4
+        assert plugin.context.embedding_provider.calls == calls
+        await plugin.terminate()
+
+    asyncio.run(run())
+
+
+def test_verbatim_reuse_requires_same_embedding_provider(make_plugin):
+    """逐字复读只复用同一嵌入提供商生成的向量；更换提供商后重新请求"""
+    text = "the server goes down for maintenance tonight at ten"
+
+    async def run():
+        plugin = make_plugin()
+        await send(plugin, "g1", "1", text)
+        await plugin.terminate()
+
+        plugin = make_plugin()
+        provider = plugin.context.embedding_provider
+        await send(plugin, "g1", "2", text)
+        assert provider.calls == 0
+        await plugin.terminate()
+
+        plugin = make_plugin(embedding_provider_id="emb2")
+        provider = plugin.context.embedding_provider
+        provider.id = "emb2"
+        await send(plugin, "g1", "3", text)
+        assert provider.calls == 1
+        stored = plugin._cache["g1"]["messages"]
+        assert [m.embedding_provider for m in stored] == ["emb", "emb", "emb2"]
+        await plugin.terminate()
+
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("astrbot")
+
+import main
+from conftest import fake_embedding
+
+
+@pytest.mark.parametrize("precision", ["float32", "int8"])
+def test_day_rollover_replaces_entry_without_touching_old_one(make_plugin, precision):
+    """跨天清理生成新的消息列表与索引；仍持有旧条目的检索按旧行号继续工作"""
+    plugin = make_plugin(data_retention_days=1, embedding_precision=precision, ann_index_enabled=True,
+                         ann_min_size=1)
+    now = time.time()
+    texts = ["old news one", "old news two", "fresh news three"]
+    for i, (text, ts) in enumerate(zip(texts, [now - 3 * 86400, now - 2 * 86400, now])):
+        record = main.MessageRecord(f"m{i}", str(i), f"user{i}", text, ts, False, None,
+                                    "f" * 64 if i == 1 else None)
+        plugin._append_message("g1", record, fake_embedding(text))
+
+    old_entry = plugin._cache["g1"]
+    old_entry["last_load"] = now - 86400
+    messages = plugin._load_messages("g1")
+
+    new_entry = plugin._cache["g1"]
+    assert new_entry is not old_entry
+    assert [m.content for m in messages] == ["fresh news three"]
+    assert new_entry["embeddings"].size == 1
+    assert new_entry["image_hashes"].count_valid() == 0
+    assert new_entry["fingerprints"].lookup(main.FingerprintIndex.fingerprint("fresh news three")) == [0]
+
+    # 旧条目保持原样，行号与旧消息列表一一对应
+    assert len(old_entry["messages"]) == 3 and old_entry["embeddings"].size == 3
+    sims = old_entry["embeddings"].similarities(fake_embedding("old news two"), threshold=0.9)
+    assert int(np.argmax(sims)) == 1
+    assert old_entry["image_hashes"].count_valid() == 1
+    assert old_entry["fingerprints"].lookup(main.FingerprintIndex.fingerprint("old news one")) == [0]
+
+    sims = new_entry["embeddings"].similarities(fake_embedding("fresh news three"), threshold=0.9)
+    assert sims[0] == pytest.approx(1.0, abs=1e-5)
+    assert new_entry["embeddings"].ann.is_trained and new_entry["embeddings"].ann.matrix is new_entry["embeddings"]
+
+
+@pytest.mark.parametrize("precision", ["float32", "int8"])
+def test_compacted_matrix_shrinks_to_kept_rows(precision):
+    """过期清理后新矩阵按保留行数重新分配容量，内存随之收缩"""
+    matrix = main.EmbeddingMatrix(precision)
+    for i in range(3000):
+        matrix.append(fake_embedding(f"row {i}"))
+    keep_mask = np.zeros(matrix.size, dtype=bool)
+    keep_mask[-300:] = True
+
+    compacted = matrix.compacted(keep_mask)
+    assert compacted._capacity == 512
+    assert compacted.resident_bytes() < matrix.resident_bytes() / 4
+    assert np.allclose(compacted.vector(0), fake_embedding("row 2700"), atol=0.05)
+
+    empty = matrix.compacted(np.zeros(matrix.size, dtype=bool))
+    assert empty._capacity == main.EMBEDDING_MATRIX_INITIAL_CAPACITY and empty.size == 0
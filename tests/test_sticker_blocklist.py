@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+
+def test_blocklist_loads_in_initialize(make_plugin):
+    """持久化的表情包黑名单在 initialize 中（线程池里）加载，并发的首次使用共享同一次读取"""
+    sticker = "ab" * 32
+
+    async def run():
+        plugin = make_plugin()
+        blocklist = await plugin._get_sticker_blocklist()
+        assert blocklist.add(sticker)
+        plugin._save_sticker_blocklist(blocklist.to_list())
+
+        restarted = make_plugin()
+        await restarted.initialize()
+        assert restarted._sticker_blocklist is not None
+        assert restarted._sticker_blocklist.match(sticker)
+
+        lazy = make_plugin()
+        first, second = await asyncio.gather(lazy._get_sticker_blocklist(), lazy._get_sticker_blocklist())
+        assert first is second and first.match(sticker)
+
+        assert await make_plugin(sticker_blocklist_size=0)._get_sticker_blocklist() is None
+
+    asyncio.run(run())
@@ -0,0 +1,108 @@
+import asyncio
+import datetime
+import os
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("astrbot")
+
+import main
+from conftest import fake_embedding
+
+
+def _write_history(plugin):
+    """写入两天的消息：含图片哈希、无向量、以及另一维度（换模型前）的向量"""
+    now = time.time()
+    rows = [
+        ("m0", "yesterday talk", now - 86400, fake_embedding("yesterday talk"), None),
+        ("m1", "an image message", now - 60, fake_embedding("an image message"), "0f" * 32),
+        ("m2", "no vector here", now - 50, None, None),
+        ("m3", "old model vector", now - 40, [0.5, -0.25, 1.0], None),
+        ("m4", "latest words", now - 30, fake_embedding("latest words"), None),
+    ]
+    for i, (msg_id, text, ts, emb, image_hash) in enumerate(rows):
+        record = main.MessageRecord(msg_id, str(i), f"user{i}", text, ts, image_hash is not None, None, image_hash)
+        plugin._append_message("g1", record, emb)
+    return rows
+
+
+@pytest.mark.parametrize("config", [
+    {"storage_format": "json"},
+    {"storage_format": "npy"},
+    {"storage_format": "npy", "storage_float16": True},
+])
+def test_snapshot_round_trip(make_plugin, data_dir, config):
+    """日志合并进快照后重新加载，消息字段、图片哈希与向量保持不变"""
+    plugin = make_plugin(**config)
+    rows = _write_history(plugin)
+    asyncio.run(plugin.terminate())
+
+    files = os.listdir(data_dir / "g1")
+    assert not any(f.endswith(".wal") for f in files)
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    if config["storage_format"] == "npy":
+        assert f"{today}.meta.json.gz" in files and any(f.endswith(".emb.npy") for f in files)
+    else:
+        assert f"{today}.json.gz" in files
+
+    reloaded = make_plugin(**config)
+    messages = reloaded._load_messages("g1")
+    matrix = reloaded._cache["g1"]["embeddings"]
+    assert [m.id for m in messages] == [r[0] for r in rows]
+    atol = 1e-2 if config.get("storage_float16") else 1e-5
+    for row, (msg_id, text, ts, emb, image_hash) in enumerate(rows):
+        msg = messages[row]
+        assert (msg.content, msg.sender_id, msg.image_hash) == (text, str(row), image_hash)
+        assert msg.timestamp == pytest.approx(ts)
+        if emb is None:
+            assert matrix.vector(row) is None
+        else:
+            assert np.allclose(matrix.vector(row), emb, atol=atol, rtol=1e-3)
+    assert reloaded._cache["g1"]["image_hashes"].count_valid() == 1
+
+
+def test_switching_format_keeps_history(make_plugin, data_dir):
+    """切换 storage_format 后重新合并，旧格式快照被替换且数据完整"""
+    plugin = make_plugin(storage_format="json")
+    rows = _write_history(plugin)
+    asyncio.run(plugin.terminate())
+
+    switched = make_plugin(storage_format="npy")
+    switched._load_messages("g1")
+    switched._append_message("g1", main.MessageRecord("m5", "9", "user9", "after switch", time.time(),
+                                                      False, None, None), fake_embedding("after switch"))
+    asyncio.run(switched.terminate())
+
+    files = os.listdir(data_dir / "g1")
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    assert f"{today}.json.gz" not in files and f"{today}.meta.json.gz" in files
+    messages = make_plugin(storage_format="json")._load_messages("g1")
+    assert [m.id for m in messages] == [r[0] for r in rows] + ["m5"]
+
+
+def test_npy_reader_retries_when_vector_file_is_replaced(make_plugin, data_dir, monkeypatch):
+    """读到旧元数据后向量文件被新快照替换删除：重新读取一次元数据，不丢失当天数据"""
+    plugin = make_plugin(storage_format="npy")
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    group_dir = str(data_dir / "g1")
+    os.makedirs(group_dir)
+    old = [{"id": "m0", "content": "first", "timestamp": 1.0, "embedding": fake_embedding("first")}]
+    new = old + [{"id": "m1", "content": "second", "timestamp": 2.0, "embedding": fake_embedding("second")}]
+    plugin._write_snapshot(group_dir, today, old)
+
+    np_load = np.load
+    loads = []
+
+    def racing_load(*args, **kwargs):
+        if not loads:
+            plugin._write_snapshot(group_dir, today, new)
+        loads.append(args[0])
+        return np_load(*args, **kwargs)
+
+    monkeypatch.setattr(main.np, "load", racing_load)
+    messages = plugin._read_snapshot(group_dir, today)
+    assert len(loads) == 2
+    assert [m["id"] for m in messages] == ["m0", "m1"]
+    assert np.allclose(messages[1]["embedding"], fake_embedding("second"), atol=1e-5)
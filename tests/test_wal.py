@@ -0,0 +1,134 @@
+import asyncio
+import datetime
+import os
+import time
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+import main
+from conftest import fake_embedding
+
+
+def _record(i: int, text: str, ts: float) -> main.MessageRecord:
+    return main.MessageRecord(f"m{i}", str(i), f"user{i}", text, ts, False, None, None)
+
+
+def _append(plugin, group_id: str, i: int, ts: float = None):
+    text = f"message number {i}"
+    plugin._append_message(group_id, _record(i, text, ts or time.time()), fake_embedding(text))
+
+
+def test_compaction_merges_log_into_snapshot(make_plugin, data_dir, monkeypatch):
+    """日志达到阈值后合并进快照，合并前后读到的消息一致"""
+    monkeypatch.setattr(main, "WAL_COMPACT_THRESHOLD", 5)
+    plugin = make_plugin()
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    group_dir = data_dir / "g1"
+    for i in range(4):
+        _append(plugin, "g1", i)
+    assert (group_dir / f"{today}.wal").exists()
+    assert not (group_dir / f"{today}.json.gz").exists()
+
+    _append(plugin, "g1", 4)
+    assert not (group_dir / f"{today}.wal").exists()
+    assert (group_dir / f"{today}.json.gz").exists()
+
+    _append(plugin, "g1", 5)
+    reloaded = make_plugin()._load_messages("g1")
+    assert [m.id for m in reloaded] == [f"m{i}" for i in range(6)]
+
+
+def test_log_count_survives_restart(make_plugin, data_dir, monkeypatch):
+    """重启后首次写入会计入日志中已有的记录，合并阈值不会从0重新计数"""
+    monkeypatch.setattr(main, "WAL_COMPACT_THRESHOLD", 5)
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    first = make_plugin()
+    for i in range(3):
+        _append(first, "g1", i)
+
+    # 不调用 terminate，模拟进程异常退出后重启
+    second = make_plugin()
+    second._load_messages("g1")
+    _append(second, "g1", 3)
+    assert second._wal_counts[("g1", today)] == 4
+    _append(second, "g1", 4)
+    assert not (data_dir / "g1" / f"{today}.wal").exists()
+    assert [m.id for m in make_plugin()._load_messages("g1")] == [f"m{i}" for i in range(5)]
+
+
+def test_leftover_log_rotation_waits_for_flush_lock(make_plugin, data_dir):
+    """加载时发现的往日日志要等进行中的写盘结束后才改名合并"""
+    yesterday = time.time() - 86400
+    date_str = datetime.date.fromtimestamp(yesterday).strftime("%Y-%m-%d")
+    wal_path = data_dir / "g1" / f"{date_str}.wal"
+    crashed = make_plugin()
+    _append(crashed, "g1", 0, yesterday)
+    assert wal_path.exists()
+
+    async def run():
+        plugin = make_plugin()
+        async with plugin._flush_lock:
+            await plugin._load_messages_async("g1")
+            await asyncio.sleep(0.01)
+            assert wal_path.exists() and not os.path.exists(f"{wal_path}.compacting")
+        await asyncio.gather(*plugin._rotation_tasks)
+        await asyncio.gather(*plugin._compactions.values())
+        assert not wal_path.exists()
+        assert (data_dir / "g1" / f"{date_str}.json.gz").exists()
+        await plugin.terminate()
+
+    asyncio.run(run())
+    assert [m.id for m in make_plugin()._load_messages("g1")] == ["m0"]
+
+
+@pytest.mark.parametrize("storage_format", ["json", "npy"])
+def test_reload_during_compaction_sees_every_message(make_plugin, data_dir, monkeypatch, storage_format):
+    """读盘读完快照后日志合并随即开始：合并须等读盘结束，读到的消息不缺失"""
+    import threading
+
+    monkeypatch.setattr(main, "WAL_COMPACT_THRESHOLD", 1000)
+    plugin = make_plugin(storage_format=storage_format)
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    group_dir = str(data_dir / "g1")
+    for i in range(3):
+        _append(plugin, "g1", i)
+    plugin._flush_cache("g1")
+    for i in range(3, 6):
+        _append(plugin, "g1", i)
+    os.replace(os.path.join(group_dir, f"{today}.wal"), os.path.join(group_dir, f"{today}.wal.compacting"))
+
+    read_snapshot = plugin._read_snapshot
+    compaction = threading.Thread(target=plugin._compact_daily_log, args=(group_dir, today))
+
+    def racing_read_snapshot(*args):
+        messages = read_snapshot(*args)
+        if compaction.ident is None:
+            compaction.start()
+            compaction.join(0.2)
+        return messages
+
+    monkeypatch.setattr(plugin, "_read_snapshot", racing_read_snapshot)
+    messages = plugin._read_daily_messages(group_dir, today)
+    compaction.join()
+    assert sorted(m["id"] for m in messages) == [f"m{i}" for i in range(6)]
+    assert all(m.get("embedding") is not None for m in messages)
+    assert not os.path.exists(os.path.join(group_dir, f"{today}.wal.compacting"))
+
+
+def test_log_writes_are_fsynced_once_per_batch(make_plugin, monkeypatch):
+    """每批写入日志后 fsync 一次，系统崩溃也不丢失已写入的记录"""
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(main.os, "fsync", lambda fd: (synced.append(fd), fsync(fd)))
+
+    async def run():
+        plugin = make_plugin(flush_interval_seconds=0.05)
+        for i in range(5):
+            _append(plugin, "g1", i)
+        await asyncio.sleep(0.2)
+        assert len(synced) == 1
+        await plugin.terminate()
+
+    asyncio.run(run())